@@ -5,6 +5,8 @@ import socket
 import asyncio
 import websockets
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
@@ -17,10 +19,80 @@ class WSClient():
         self.ping_timeout = kwargs.get('ping_timeout') or 5
         self.sleep_time = kwargs.get('sleep_time') or 5
         self.callback = kwargs.get('callback')
+        # called with every message right when it is received, must be cheap (e.g. recording it)
+        self.on_receive = kwargs.get('on_receive')
+        # received messages wait here for the callback, the oldest is dropped if it is full
+        self.queue_size = kwargs.get('queue_size') or 1000
+        # run the callback in a worker thread instead of the event loop
+        self.process_in_thread = kwargs.get('process_in_thread') or False
+        self._queue = None
+        self._stats = {
+            'received': 0,
+            'processed': 0,
+            'dropped': 0,
+            'failed': 0,
+            'reconnects': 0,
+            'max_depth': 0,
+            'queue_time_total': 0.0,
+            'queue_time_max': 0.0
+        }
+
+    def _enqueue(self, reply):
+        if self._queue.full():
+            self._queue.get_nowait()
+            self._stats['dropped'] += 1
+            logger.warning('processing queue full, dropped oldest message')
+        self._queue.put_nowait((time.monotonic(), reply))
+        self._stats['received'] += 1
+        self._stats['max_depth'] = max(self._stats['max_depth'], self._queue.qsize())
+
+    async def _process_forever(self):
+        # one worker thread keeps the order of the messages
+        executor = ThreadPoolExecutor(max_workers=1) if self.process_in_thread else None
+        loop = asyncio.get_event_loop()
+        while True:
+            received, reply = await self._queue.get()
+            queue_time = time.monotonic() - received
+            self._stats['queue_time_total'] += queue_time
+            self._stats['queue_time_max'] = max(self._stats['queue_time_max'], queue_time)
+            try:
+                if executor:
+                    await loop.run_in_executor(executor, self.callback, reply)
+                else:
+                    self.callback(reply)
+                    # let the receive loop read the socket between two messages of a burst
+                    await asyncio.sleep(0)
+                self._stats['processed'] += 1
+            except Exception as e:
+                self._stats['failed'] += 1
+                logger.error(f"cannot process message, due to {e}.")
+
+    def get_stats(self):
+        stats = dict(self._stats)
+        stats['depth'] = self._queue.qsize() if self._queue else 0
+        dequeued = stats['processed'] + stats['failed']
+        stats['queue_time_avg'] = stats['queue_time_total'] / dequeued if dequeued else 0.0
+        return stats
 
     async def listen_forever(self):
+        processor = None
+        if self.callback:
+            # decouple reading the socket from processing the messages
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            processor = asyncio.ensure_future(self._process_forever())
+        try:
+            await self._listen_forever()
+        finally:
+            if processor:
+                processor.cancel()
+
+    async def _listen_forever(self):
+        first_attempt = True
         while True:
         # outer loop restarted every time the connection fails
+            if not first_attempt:
+                self._stats['reconnects'] += 1
+            first_attempt = False
             logger.debug('Creating new connection...')
             try:
                 async with websockets.connect(self.url) as ws:
@@ -36,19 +108,21 @@ class WSClient():
                                 continue
                             except:
                                 logger.debug(
-                                    'Ping error - retrying connection in {} sec (Ctrl-C to quit)'.format(self.sleep_time))
+                                    'Ping error - retrying connection in %s sec (Ctrl-C to quit)', self.sleep_time)
                                 await asyncio.sleep(self.sleep_time)
                                 break
-                        logger.debug('Server said > {}'.format(reply))
+                        logger.debug('Server said > %s', reply)
+                        if self.on_receive:
+                            self.on_receive(reply)
                         if self.callback:
-                            self.callback(reply)
+                            self._enqueue(reply)
             except socket.gaierror:
                 logger.debug(
-                    'Socket error - retrying connection in {} sec (Ctrl-C to quit)'.format(self.sleep_time))
+                    'Socket error - retrying connection in %s sec (Ctrl-C to quit)', self.sleep_time)
                 await asyncio.sleep(self.sleep_time)
                 continue
             except ConnectionRefusedError:
                 logger.debug('Nobody seems to listen to this endpoint. Please check the URL.')
-                logger.debug('Retrying connection in {} sec (Ctrl-C to quit)'.format(self.sleep_time))
+                logger.debug('Retrying connection in %s sec (Ctrl-C to quit)', self.sleep_time)
                 await asyncio.sleep(self.sleep_time)
                 continue
@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import collections
+import time
+
+logger = logging.getLogger(__name__)
+
+class Command(object):
+
+    def __init__(self, path, value, deadline, paths=None):
+        self.path = path
+        self.value = value
+        # commands not started before this (time.monotonic) are dropped
+        self.deadline = deadline
+        # the paths this command changes, commands sharing one are sent one after the other
+        self.paths = frozenset(paths or [path])
+
+class CommandQueue(object):
+
+    # bounded queue of outbound deCONZ commands, sent by a pool of worker threads
+    # so the caller (e.g. the MQTT network thread) never waits for HTTP.
+    # commands to the same path are never sent concurrently and keep their order, as well as
+    # commands to related paths (e.g. a group action and the state of one of the group's lights).
+    # coalescing commands replace the value of a command to the same path still waiting
+    # in the queue, so only the latest value is sent once the previous PUT is done.
+
+    DROP_OLDEST = 'drop-oldest'
+    BLOCK = 'block'
+    REJECT = 'reject'
+    OVERFLOW_POLICIES = [DROP_OLDEST, BLOCK, REJECT]
+
+    def __init__(self, sender, max_depth=100, workers=2, overflow=DROP_OLDEST, timeout=10, related_paths=None):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError('invalid overflow policy {}, use one of {}'.format(overflow, self.OVERFLOW_POLICIES))
+        if max_depth < 1 or workers < 1:
+            raise ValueError('max_depth and workers need to be at least 1')
+        # called as sender(path, value) from a worker thread
+        self.sender = sender
+        self.max_depth = max_depth
+        self.workers = workers
+        self.overflow = overflow
+        # seconds a command may wait in the queue (and a blocked submit may wait for space)
+        self.timeout = timeout
+        # related_paths(path) returns the paths a command to path changes as well
+        self.related_paths = related_paths
+
+        self._queue = collections.deque()
+        # path -> queued command newer values may be merged into
+        self._coalescable = {}
+        self._in_flight = set()
+        # paths of the commands being sent, with their related paths
+        self._in_flight_paths = set()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._running = False
+
+        self._stats = {
+            'submitted': 0,
+            'sent': 0,
+            'failed': 0,
+            'dropped': 0,
+            'rejected': 0,
+            'expired': 0,
+            'coalesced': 0
+        }
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name='deconz-command-{}'.format(i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.debug("started %s command workers", self.workers)
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, path, value, coalesce=False):
+        # returns whether the command was queued
+        with self._condition:
+            self._stats['submitted'] += 1
+            if coalesce and path in self._coalescable:
+                # last write wins, the waiting command is sent with the newest value
+                command = self._coalescable[path]
+                command.value = value
+                command.deadline = time.monotonic() + self.timeout
+                self._stats['coalesced'] += 1
+                logger.debug("coalesced command for %s", path)
+                return True
+
+            if len(self._queue) >= self.max_depth:
+                if not self._make_room():
+                    self._stats['rejected'] += 1
+                    logger.error("command queue full, rejected command for {}".format(path))
+                    return False
+            paths = self.related_paths(path) if self.related_paths else None
+            command = Command(path, value, time.monotonic() + self.timeout, paths)
+            self._queue.append(command)
+            if coalesce:
+                self._coalescable[path] = command
+            else:
+                # later values must not overtake this command
+                self._coalescable.pop(path, None)
+            if paths:
+                # nor later values to related paths
+                for other in [other for other, queued in self._coalescable.items()
+                        if other != path and not queued.paths.isdisjoint(command.paths)]:
+                    del self._coalescable[other]
+            self._condition.notify_all()
+            return True
+
+    def _forget(self, command):
+        # called with the lock held for a command leaving the queue
+        if self._coalescable.get(command.path) is command:
+            del self._coalescable[command.path]
+
+    def _make_room(self):
+        # called with the lock held and a full queue
+        if self.overflow == self.DROP_OLDEST:
+            dropped = self._queue.popleft()
+            self._forget(dropped)
+            self._stats['dropped'] += 1
+            logger.warning("command queue full, dropped oldest command for %s", dropped.path)
+            return True
+        if self.overflow == self.BLOCK:
+            return self._condition.wait_for(lambda: len(self._queue) < self.max_depth, timeout=self.timeout)
+        return False
+
+    def _next_command(self):
+        # called with the lock held, the first command whose paths are neither being sent
+        # nor changed by a command waiting before it
+        blocked = set(self._in_flight_paths)
+        for i, command in enumerate(self._queue):
+            if blocked.isdisjoint(command.paths):
+                del self._queue[i]
+                self._forget(command)
+                return command
+            blocked.update(command.paths)
+        return None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                command = None
+                while self._running:
+                    command = self._next_command()
+                    if command is not None:
+                        break
+                    self._condition.wait()
+                if command is None:
+                    return
+                self._in_flight.add(command.path)
+                self._in_flight_paths.update(command.paths)
+                # there is space again for blocked submits
+                self._condition.notify_all()
+
+            try:
+                self._send(command)
+            finally:
+                with self._condition:
+                    self._in_flight.discard(command.path)
+                    self._in_flight_paths.difference_update(command.paths)
+                    self._condition.notify_all()
+
+    def _send(self, command):
+        if time.monotonic() > command.deadline:
+            logger.warning("command for %s expired in queue", command.path)
+            self._count('expired')
+            return
+        try:
+            self.sender(command.path, command.value)
+            self._count('sent')
+        except Exception as e:
+            logger.error(f"cannot send command to {command.path}, due to {e}.")
+            self._count('failed')
+
+    def _count(self, key):
+        with self._condition:
+            self._stats[key] += 1
+
+    def join(self, timeout=None):
+        # waits until all queued commands are processed, returns False on timeout
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._queue and not self._in_flight, timeout=timeout)
+
+    def get_stats(self):
+        with self._condition:
+            stats = dict(self._stats)
+            stats['depth'] = len(self._queue)
+            stats['in_flight'] = len(self._in_flight)
+            return stats
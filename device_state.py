@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class DeviceState(object):
+
+    # mirror of the deCONZ lights, sensors and groups: loaded in bulk from the REST api
+    # and kept up to date with the websocket events
+
+    RESOURCES = ['lights', 'sensors', 'groups']
+    # resource -> key of the full object in an "added" event
+    ADDED_KEYS = {'lights': 'light', 'sensors': 'sensor', 'groups': 'group'}
+    # parts of a device a "changed" event updates one field at a time
+    NESTED_KEYS = ['state', 'config']
+    # fields of an event describing the event itself, not the device
+    EVENT_KEYS = ['t', 'e', 'r', 'id', 'uniqueid']
+
+    def __init__(self):
+        # resource -> id -> device
+        self._resources = {resource: {} for resource in self.RESOURCES}
+        self._lock = threading.Lock()
+
+    def load(self, fetch):
+        # fetch(resource) returns all devices of a resource, as GET /api/<key>/<resource> does
+        for resource in self.RESOURCES:
+            devices = fetch(resource) or {}
+            with self._lock:
+                self._resources[resource] = {str(id): device for id, device in devices.items()}
+            logger.info("loaded %s %s", len(devices), resource)
+
+    def get(self, resource, id):
+        return self._resources.get(resource, {}).get(str(id), None)
+
+    def __len__(self):
+        return sum(len(devices) for devices in self._resources.values())
+
+    def apply(self, event):
+        # updates the mirror with a websocket event and returns the merged state of the device
+        # as an event, or None if the event isn't about a known device
+        devices = self._resources.get(event.get('r', None), None)
+        id = event.get('id', None)
+        if devices is None or id is None:
+            return None
+        id = str(id)
+        kind = event.get('e', None)
+
+        with self._lock:
+            if kind == 'deleted':
+                devices.pop(id, None)
+                return None
+            if kind == 'added':
+                device = event.get(self.ADDED_KEYS[event['r']], None)
+                if device is None:
+                    return None
+                devices[id] = device
+            elif kind == 'changed':
+                device = devices.get(id, None)
+                if device is None:
+                    # unknown until now, keep what the event tells
+                    device = devices[id] = {}
+                self._merge(device, event)
+            else:
+                device = devices.get(id, None)
+                if device is None:
+                    return None
+            return self._view(device, event)
+
+    def _merge(self, device, event):
+        for key, value in event.items():
+            if key in self.EVENT_KEYS:
+                if key == 'uniqueid':
+                    device[key] = value
+                continue
+            if key in self.NESTED_KEYS and isinstance(value, dict):
+                device.setdefault(key, {}).update(value)
+            elif key == 'attr' and isinstance(value, dict):
+                # attribute changes (name, modelid, ...) are top level fields of the device
+                device.update(value)
+            else:
+                device[key] = value
+
+    def _view(self, device, event):
+        # shallow copy, the nested parts are shared and must not be changed by the reader
+        view = dict(device)
+        for key in self.EVENT_KEYS:
+            if key in event:
+                view[key] = event[key]
+        return view
+
+    def events(self):
+        # the whole mirror as "changed" events, e.g. for an initial publish of all values
+        with self._lock:
+            snapshot = [(resource, id, device) for resource, devices in self._resources.items() for id, device in devices.items()]
+        for resource, id, device in snapshot:
+            event = dict(device)
+            event.update({'t': 'event', 'e': 'changed', 'r': resource, 'id': id})
+            yield event
@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import gzip
+import shutil
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class EventRecorder(object):
+
+    # records raw websocket events to a file, one "<receive timestamp> <event>" per line.
+    # record() only appends to a buffer, writing, rotating and compressing happens in a background thread.
+
+    def __init__(self, filename, flush_interval=1.0, flush_size=64*1024, max_bytes=10*1024*1024, max_age=None, backup_count=5, compress=False):
+        self.filename = filename
+        # seconds between two writes of the buffer
+        self.flush_interval = flush_interval
+        # buffered bytes that trigger a write before the interval is over
+        self.flush_size = flush_size
+        # rotate when the file gets bigger than this (bytes) or older than max_age (seconds), None disables
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # number of rotated files kept as filename.1, filename.2, ...
+        self.backup_count = backup_count
+        # gzip rotated files (filename.1.gz, ...)
+        self.compress = compress
+
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._lock = threading.Lock()
+        # serializes flushes of the writer thread and explicit flush()/close() calls
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+        self._file = None
+        self._opened_at = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='event-recorder', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._write_lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def record(self, data, received=None):
+        if received is None:
+            received = time.time()
+        # keep one event per line
+        line = "{:.3f} {}\n".format(received, data.replace('\r', ' ').replace('\n', ' '))
+        with self._lock:
+            self._buffer.append(line)
+            self._buffered_bytes += len(line)
+            full = self._buffered_bytes >= self.flush_size
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"cannot write events to {self.filename}, due to {e}.")
+
+    def flush(self):
+        with self._lock:
+            lines = self._buffer
+            self._buffer = []
+            self._buffered_bytes = 0
+        if not lines:
+            return
+
+        with self._write_lock:
+            if self._should_rotate():
+                self._rotate()
+            if self._file is None:
+                self._open()
+            self._file.write(''.join(lines))
+            self._file.flush()
+
+    def _open(self):
+        self._file = open(self.filename, 'a', encoding='utf-8')
+        self._opened_at = time.monotonic()
+
+    def _should_rotate(self):
+        if self._file is None:
+            if not os.path.exists(self.filename):
+                return False
+            size = os.path.getsize(self.filename)
+        else:
+            size = self._file.tell()
+        if self.max_bytes and size >= self.max_bytes:
+            return True
+        if self.max_age and self._opened_at is not None and time.monotonic() - self._opened_at >= self.max_age:
+            return True
+        return False
+
+    def _backup_name(self, index):
+        name = "{}.{}".format(self.filename, index)
+        if self.compress:
+            name += ".gz"
+        return name
+
+    def _rotate(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+        logger.debug("rotating %s", self.filename)
+
+        if self.backup_count < 1:
+            os.remove(self.filename)
+            return
+
+        oldest = self._backup_name(self.backup_count)
+        if os.path.exists(oldest):
+            os.remove(oldest)
+        for index in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(self._backup_name(index)):
+                os.replace(self._backup_name(index), self._backup_name(index + 1))
+
+        if self.compress:
+            with open(self.filename, 'rb') as source, gzip.open(self._backup_name(1), 'wb') as target:
+                shutil.copyfileobj(source, target)
+            os.remove(self.filename)
+        else:
+            os.replace(self.filename, self._backup_name(1))
+
+def read_events(filename):
+    # yields (receive timestamp or None, raw event) from a recording, also from the plain
+    # format of older versions (one raw event per line) and from gzipped rotated files
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            timestamp, separator, event = line.partition(' ')
+            try:
+                yield float(timestamp), event
+            except ValueError:
+                yield None, line
@@ -5,23 +5,46 @@ import os
 import sys
 import json
 import logging
+import logging.handlers
+import time
+import queue
+import signal
 import asyncio
 
 from automatic_websocket_reconnect import WSClient
-from mqtt_connector import MQTTConnector
+from mqtt_connector import MQTTConnector, AsyncioMQTTConnector
+from command_queue import CommandQueue
+from event_recorder import EventRecorder
+from device_state import DeviceState
+from metrics import Registry, RuleMetrics, MetricsServer
 from processors.deconz_to_mqtt_processor import DeconzToMqttProcessor
 from processors.mqtt_to_deconz_processor import MqttToDeconzProcessor
+from processors.light_group_batcher import LightGroupBatcher
 
-from webservice import get_value_from, put_value_to
+from webservice import get_value_from, KeepAliveClient
 
 logger = logging.getLogger(__name__)
 
-def setup_logging():
+def setup_logging(config):
+    # "level" for everything, "levels" per module (e.g. {"processors": "DEBUG"}),
+    # "asynchronous" writes the log in a background thread instead of the logging thread
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(config.get('format', '%(asctime)s - %(name)s - %(levelname)s - %(message)s')))
+    
+    if config.get('asynchronous', False):
+        log_queue = queue.Queue(-1)
+        listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+        listener.start()
+        handler = logging.handlers.QueueHandler(log_queue)
+        # the listener's handler applies the real format
+        handler.setFormatter(logging.Formatter('%(message)s'))
+    
     logging.basicConfig(
-        stream=sys.stdout,
-        level=logging.DEBUG,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        level=config.get('level', 'INFO'),
+        handlers=[handler]
     )
+    for name, level in config.get('levels', {}).items():
+        logging.getLogger(name).setLevel(level)
     logger.info("logger configured")
 
 def load_config(): 
@@ -35,32 +58,83 @@ def store_pid_file(pidfilename):
     f.write(pid)
     f.close()
 
-def init_deconz_ws(config, d_to_m_proc):
+def init_deconz_ws(config, d_to_m_proc, json_time=None):
     websocket_url = config['websocket_url']
     api_token = config['api_token']
     debug_file = config.get('debug_file', None)
+    # events are processed with the rules of this gateway
+    gateway = config.get('name', None)
+    
+    # record all received events, written in the background
+    recorder = None
+    if (debug_file):
+        recorder = EventRecorder(debug_file,
+            flush_interval=config.get('debug_file_flush_interval', 1.0),
+            max_bytes=config.get('debug_file_max_bytes', 10*1024*1024),
+            max_age=config.get('debug_file_max_age', None),
+            backup_count=config.get('debug_file_backup_count', 5),
+            compress=config.get('debug_file_compress', False))
+        recorder.start()
     
     def callback_fn(data, *args, **kwargs):
-        logger.debug('callback received: {}'.format(data))
+        logger.debug('callback received: %s', data)
         # parse json from
-        json_data = json.loads(data)
-        if (debug_file):
-            with open(debug_file,"a+") as out_file:
-                out_file.write(data)
-                out_file.write("\r\n")
-        d_to_m_proc.process_message(json_data)
-    
-    client = WSClient(url=websocket_url, callback=callback_fn)
-    logger.debug("ws client created, starting now")
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(client.listen_forever())
+        if json_time is None:
+            json_data = json.loads(data)
+        else:
+            start = time.perf_counter()
+            json_data = json.loads(data)
+            json_time.observe(time.perf_counter() - start)
+        d_to_m_proc.process_message(json_data, gateway)
+    
+    client = WSClient(url=websocket_url, callback=callback_fn,
+        on_receive=recorder.record if recorder else None,
+        queue_size=config.get('ws_queue_size', 1000),
+        process_in_thread=config.get('ws_process_in_thread', False))
+    logger.debug("ws client for gateway %s created", gateway)
+    return client
+    
+def run_deconz_ws(clients, loop):
+    # one event loop listens to all gateways
+    loop.run_until_complete(asyncio.gather(*[client.listen_forever() for client in clients]))
     
     print("will never come here")
     
-    return client
+def load_light_groups(config, client):
+    # group id -> light ids, either configured or read from deCONZ
+    if 'light_groups' in config:
+        return config['light_groups']
+    if not config.get('batch_light_groups', False):
+        return {}
+    groups = json.loads(client.get('/groups'))
+    return {group_id: group.get('lights', []) for group_id, group in groups.items()}
+    
+def init_device_state(config):
+    # mirror the devices only if asked for, it costs one bulk request per resource at startup
+    if not config.get('state_mirror', False):
+        return None
+    url = config["rest_url"] + "/api/" + config['api_token'] + "/"
     
-def init_deconz_rest(config):
+    def fetch(resource):
+        return json.load(get_value_from(url + resource))
+    
+    device_state = DeviceState()
+    device_state.load(fetch)
+    return device_state
+    
+def timed(function, histogram, errors):
+    def timed_function(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start)
+    return timed_function
+    
+def init_deconz_rest(config, put_time=None, put_errors=None):
 
     # make sure sth. is running there, break early if false-configured
     api_token = config['api_token']
@@ -68,49 +142,231 @@ def init_deconz_rest(config):
     full_url = rest_url + "/api/" + api_token + "/config"
     get_value_from(full_url)
 
+    # keep connections to deCONZ open between requests
+    client = KeepAliveClient(rest_url + "/api/" + api_token,
+        pool_size=config.get('rest_pool_size', 4),
+        timeout=config.get('rest_timeout', 10),
+        max_idle=config.get('rest_max_idle', 30))
+
+    put = client.put
+    if put_time is not None:
+        put = timed(put, put_time, put_errors)
+
+    light_groups = load_light_groups(config, client)
+
+    # PUT requests are sent by worker threads, so a slow deCONZ doesn't block mqtt;
+    # a group action is never sent at the same time as (or overtaking) a command to one of its lights
+    commands = CommandQueue(put,
+        max_depth=config.get('command_queue_size', 100),
+        workers=config.get('command_workers', 2),
+        overflow=config.get('command_overflow', CommandQueue.DROP_OLDEST),
+        timeout=config.get('command_timeout', 10),
+        related_paths=LightGroupBatcher(light_groups).related_paths if light_groups else None)
+    commands.start()
+
     # init a class to send PUT requests to deCONZ
     class Deconz(object):          
         
-        def send(self, path, value_str):
-            # construct url
-            api_token = config['api_token']
-            rest_url = config["rest_url"]
-            full_url = rest_url + "/api/" + api_token + path
-            try:
-                put_value_to(full_url, value_str)
-            except Exception as e:
-                logger.error(f"cannot send message, due to {e}.")
+        def __init__(self):
+            self.light_groups = light_groups
+            self.commands = commands
+        
+        def send(self, path, value_str, coalesce=False):
+            commands.submit(path, value_str, coalesce=coalesce)
 
     return Deconz()
     
-def init_mqtt(config):
+def init_mqtt(config, loop):
     host = config['host']
     port = config['port']
     
-    mqtt = MQTTConnector(host, port)
+    # "asyncio": run mqtt on the event loop of the websockets instead of an own thread
+    max_queued = config.get('max_queued', 1000)
+    max_inflight = config.get('max_inflight', 20)
+    use_asyncio = config.get('asyncio', False)
+    if use_asyncio and not AsyncioMQTTConnector.supports(loop):
+        logger.warning("the event loop can't watch the mqtt socket (windows), using paho's network thread instead")
+        use_asyncio = False
+    if use_asyncio:
+        mqtt = AsyncioMQTTConnector(host, port, loop, max_queued, max_inflight,
+            flush_interval=config.get('flush_interval', 0))
+    else:
+        mqtt = MQTTConnector(host, port, max_queued, max_inflight)
     mqtt.start()
 
     return mqtt
     
-def main():
-    setup_logging()
+async def watch_file(filename, interval, callback):
+    # polls the modification time, checking every few seconds costs next to nothing
+    mtime = os.stat(filename).st_mtime
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            current = os.stat(filename).st_mtime
+        except OSError:
+            continue
+        if current != mtime:
+            mtime = current
+            try:
+                callback()
+            except Exception as e:
+                # keep watching, the next change may fix it
+                logger.error(f"cannot handle the change of {filename}, due to {e}.")
+    
+def init_reload(config, loop, processors):
+    # rules are reloaded on "kill -HUP <pid>", or when config.json changes if "watch_config" (seconds) is set
+    def reload():
+        logger.info("reloading rules")
+        try:
+            rules = load_config()['rules']
+            # all processors parse their rules before any swaps them in, so an invalid rule
+            # for one of them doesn't leave the other one with the new rules
+            prepared = [processor.prepare_reload(rules) for processor in processors]
+        except Exception as e:
+            # e.g. unparsable json or an invalid rule (a bad regex, ...), the current rules stay in place
+            logger.error(f"cannot reload the rules, due to {e}.")
+            return
+        for processor, processor_prepared in zip(processors, prepared):
+            processor.commit_reload(processor_prepared)
+    
+    interval = config.get('watch_config', 0)
+    # no SIGHUP on windows, and signal handlers need a unix event loop
+    on_signal = False
+    if hasattr(signal, 'SIGHUP'):
+        try:
+            loop.add_signal_handler(signal.SIGHUP, reload)
+            on_signal = True
+        except NotImplementedError:
+            pass
+    if not on_signal and not interval:
+        logger.info("reloading on SIGHUP is not supported here, \"watch_config\" reloads the rules when config.json changes")
+    if interval:
+        loop.create_task(watch_file('config.json', interval, reload))
+    return reload
+    
+def init_metrics(config):
+    # "metrics": {"port": 9100} serves the metrics on http://127.0.0.1:9100/metrics
+    if not config:
+        return None
+    registry = Registry()
+    server = MetricsServer(registry, config.get('host', '127.0.0.1'), config.get('port', 9100))
+    server.start()
+    return registry
+    
+def register_metrics(registry, mqtt_connector, d_to_m_proc, deconz, ws_clients):
+    # read from the statistics the components keep anyway, only when the metrics are requested
+    def single(component, stat):
+        return lambda: component.get_stats()[stat]
+    
+    def per_gateway(components, stat):
+        return lambda: {(name or '',): component.get_stats()[stat] for name, component in components.items()}
+    
+    commands = {name: gateway.commands for name, gateway in deconz.items()}
+    for stat, kind, help in [
+            ('received', 'counter', 'Websocket events received.'),
+            ('processed', 'counter', 'Websocket events processed.'),
+            ('dropped', 'counter', 'Websocket events dropped because the processing queue was full.'),
+            ('failed', 'counter', 'Websocket events failing to process.'),
+            ('reconnects', 'counter', 'Websocket reconnects.'),
+            ('depth', 'gauge', 'Websocket events waiting to be processed.'),
+            ('queue_time_avg', 'gauge', 'Average seconds a websocket event waited to be processed.'),
+            ('queue_time_max', 'gauge', 'Maximum seconds a websocket event waited to be processed.')]:
+        registry.callback('deconz_ws_' + stat + ('_total' if kind == 'counter' else ''), help, kind, per_gateway(ws_clients, stat), ['gateway'])
+    for stat, kind, help in [
+            ('sent', 'counter', 'Commands sent to deCONZ.'),
+            ('failed', 'counter', 'Commands deCONZ failed to take.'),
+            ('dropped', 'counter', 'Commands dropped because the command queue was full.'),
+            ('expired', 'counter', 'Commands expired in the command queue.'),
+            ('coalesced', 'counter', 'Commands replaced by a newer one for the same path before being sent.'),
+            ('depth', 'gauge', 'Commands waiting to be sent to deCONZ.')]:
+        registry.callback('deconz_command_' + stat + ('_total' if kind == 'counter' else ''), help, kind, per_gateway(commands, stat), ['gateway'])
+    for stat, kind, help in [
+            ('published', 'counter', 'Messages handed to the mqtt client.'),
+            ('failed', 'counter', 'Messages the mqtt client failed to publish.'),
+            ('dropped', 'counter', 'Messages dropped because the publish queue was full.'),
+            ('acknowledged', 'counter', 'Messages sent (QoS 0) or acknowledged (QoS 1/2).'),
+            ('ack_latency_avg', 'gauge', 'Average seconds from publishing to the acknowledgement.'),
+            ('ack_latency_max', 'gauge', 'Maximum seconds from publishing to the acknowledgement.'),
+            ('depth', 'gauge', 'Messages waiting to be published.'),
+            ('inflight', 'gauge', 'QoS 1/2 messages waiting for their acknowledgement.')]:
+        registry.callback('mqtt_publish_' + stat + ('_total' if kind == 'counter' else ''), help, kind, single(mqtt_connector, stat))
+    for stat, help in [
+            ('published', 'Values published by deconz->mqtt rules.'),
+            ('unchanged', 'Values not published because they did not change.'),
+            ('rate_limited', 'Values held back by a rate limit.'),
+            ('rate_limit_dropped', 'Values held back by a rate limit and never published.')]:
+        registry.callback('bridge_' + stat + '_total', help, 'counter', single(d_to_m_proc, stat))
+    
+def load_gateways(config):
+    # "deconz" is one gateway or a list of them, each may have a "name" rules can refer to with "gateway"
+    gateways = config['deconz']
+    if isinstance(gateways, dict):
+        return [gateways]
+    names = [gateway.get('name', None) for gateway in gateways]
+    if len(set(names)) != len(names):
+        raise ValueError("Invalid deconz configuration, the gateways need distinct names.")
+    return gateways
     
+def main():
     config = load_config()
-    logger.debug("config: {}".format(config))
+    setup_logging(config.get('logging', {}))
+    
+    logger.debug("config: %s", config)
     
     store_pid_file(config['pidfile'])
+    gateways = load_gateways(config)
+    
+    # websockets (and mqtt if configured) run on this loop
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
     
-    # first start mqtt connector
-    mqtt_connector = init_mqtt(config['mqtt'])
+    metrics = init_metrics(config.get('metrics', None))
+    json_time = put_time = put_errors = None
+    if metrics:
+        json_time = metrics.histogram('deconz_json_decode_seconds', 'Time parsing a websocket event.', ['gateway'])
+        put_time = metrics.histogram('deconz_rest_put_seconds', 'Time of a REST PUT to deCONZ.', ['gateway'])
+        put_errors = metrics.counter('deconz_rest_put_errors_total', 'Failed REST PUTs to deCONZ.', ['gateway'])
+    
+    # first start mqtt connector, shared by all gateways
+    mqtt_connector = init_mqtt(config['mqtt'], loop)
     
     # start processor to forward messages from deconz to mqtt. (uses websocket connector for deconz)
-    d_to_m_proc = DeconzToMqttProcessor(config['rules'], mqtt_connector)
+    d_to_m_proc = DeconzToMqttProcessor(config['rules'], mqtt_connector,
+        adaptive_matcher_order=config.get('adaptive_matcher_order', False))
+    for gateway in gateways:
+        device_state = init_device_state(gateway)
+        if device_state is not None:
+            d_to_m_proc.add_device_state(gateway.get('name', None), device_state)
+            if gateway.get('state_initial_publish', False):
+                d_to_m_proc.publish_state(gateway.get('name', None))
     
     # start processor to forward message from mqtt to deconz. (uses simple rest interface for deconz)
-    m_to_d_proc = MqttToDeconzProcessor(config['rules'], mqtt_connector, init_deconz_rest(config['deconz']))
+    m_to_d_proc = MqttToDeconzProcessor(config['rules'], mqtt_connector)
+    deconz = {}
+    for gateway in gateways:
+        name = gateway.get('name', None)
+        if metrics:
+            deconz[name] = init_deconz_rest(gateway, put_time.labels(name or ''), put_errors.labels(name or ''))
+        else:
+            deconz[name] = init_deconz_rest(gateway)
+        m_to_d_proc.add_gateway(name, deconz[name], deconz[name].light_groups)
+    
+    init_reload(config, loop, [d_to_m_proc, m_to_d_proc])
+    
+    ws_clients = {}
+    for gateway in gateways:
+        name = gateway.get('name', None)
+        ws_clients[name] = init_deconz_ws(gateway, d_to_m_proc, json_time.labels(name or '') if metrics else None)
+    
+    if metrics:
+        register_metrics(metrics, mqtt_connector, d_to_m_proc, deconz, ws_clients)
+        # timing every rule costs two clock reads per rule and event
+        if config['metrics'].get('rule_timing', False):
+            d_to_m_proc.rule_metrics = RuleMetrics(metrics, 'deconz_to_mqtt')
+            m_to_d_proc.rule_metrics = RuleMetrics(metrics, 'mqtt_to_deconz')
     
     # start websocket deconz (this will never return)
-    init_deconz_ws(config['deconz'], d_to_m_proc)
+    run_deconz_ws(list(ws_clients.values()), loop)
         
 if __name__ == '__main__':
     main()
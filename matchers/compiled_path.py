@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+import re
+import jsonpath
+
+logger = logging.getLogger(__name__)
+
+# returned by get() if the path does not resolve
+MISSING = object()
+
+# a normalized segment that can be resolved by a plain dict/list lookup
+# (no wildcards, recursion, filters, slices, unions or quoting left over)
+_SIMPLE_SEGMENT = re.compile(r"^[^.*!()?:,@'\"\[\]]+$")
+
+class CompiledPath(object):
+
+    # rough relative cost of resolving the path
+    COST = 1
+
+    def __init__(self, expr, canonical):
+        self.expr = expr
+        # canonical form, equal for expressions resolving the same way (e.g. "$.e" and "e")
+        self.canonical = canonical
+
+    def get(self, data):
+        # first value the path resolves to, or MISSING
+        pass
+
+    def find(self, data):
+        # same result as jsonpath.jsonpath(data, expr): a list of values or False
+        pass
+
+class SimplePath(CompiledPath):
+
+    def __init__(self, expr, keys):
+        super().__init__(expr, keys)
+        self.keys = keys
+        self.COST = len(keys)
+
+    def get(self, data):
+        # same checks as jsonpath's trace for plain keys
+        if not data:
+            return MISSING
+        obj = data
+        for key in self.keys:
+            if isinstance(obj, dict):
+                if key not in obj:
+                    return MISSING
+                obj = obj[key]
+            elif isinstance(obj, list) and key.isdigit():
+                index = int(key)
+                if index >= len(obj):
+                    return MISSING
+                obj = obj[index]
+            else:
+                return MISSING
+        return obj
+
+    def find(self, data):
+        result = self.get(data)
+        if result is MISSING:
+            return False
+        return [result]
+
+class GenericPath(CompiledPath):
+
+    # the jsonpath library parses and evaluates the expression on every call
+    COST = 50
+
+    def __init__(self, expr):
+        super().__init__(expr, expr)
+
+    def get(self, data):
+        result = jsonpath.jsonpath(data, self.expr)
+        if not result:
+            return MISSING
+        return result[0]
+
+    def find(self, data):
+        return jsonpath.jsonpath(data, self.expr)
+
+def _simple_keys(expr):
+    # use the library's own normalization, so both implementations agree on the segments
+    normalized = jsonpath.normalize(expr)
+    if normalized.startswith("$;"):
+        normalized = normalized[2:]
+    segments = normalized.split(';')
+    for segment in segments:
+        if not _SIMPLE_SEGMENT.match(segment):
+            return None
+    return tuple(segments)
+
+def compile_path(expr):
+    keys = None
+    if expr and isinstance(expr, str):
+        keys = _simple_keys(expr)
+
+    if keys is not None:
+        logger.debug("compiled path %s into key lookup %s", expr, keys)
+        return SimplePath(expr, keys)
+
+    logger.debug("path %s needs generic jsonpath evaluation", expr)
+    return GenericPath(expr)
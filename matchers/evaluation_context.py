@@ -0,0 +1,36 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+
+from . compiled_path import MISSING
+
+logger = logging.getLogger(__name__)
+
+class EvaluationContext(object):
+
+    # one per event: every distinct path is resolved and every distinct matcher evaluated once,
+    # no matter how many rules ask for it
+
+    def __init__(self, data):
+        self.data = data
+        # canonical path -> find() result
+        self._paths = {}
+        # canonical matcher -> result
+        self._matchers = {}
+
+    def find(self, path):
+        result = self._paths.get(path.canonical, MISSING)
+        if result is MISSING:
+            result = self._paths[path.canonical] = path.find(self.data)
+        return result
+
+    def matches(self, matcher):
+        key = matcher.canonical
+        if key is None:
+            return matcher.matches_in(self)
+        # results are booleans, None means not evaluated yet
+        result = self._matchers.get(key)
+        if result is None:
+            result = self._matchers[key] = matcher.matches_in(self)
+        return result
@@ -1,18 +1,42 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import re
+import json
 import logging
-import jsonpath
+
+from . compiled_path import compile_path
 
 logger = logging.getLogger(__name__)
 
 class Matcher(object):
 
+    # estimates for ordering the matchers of a rule: relative cost of matches()
+    # and the share of events expected to pass
+    COST = 1
+    PASS_RATE = 0.5
+    
+    # equal for matchers giving the same result, so rules can share it within an event; None if not shareable
+    canonical = None
+
     def matches(self, json_expr):
         pass
+        
+    def matches_in(self, context):
+        # evaluated in an EvaluationContext, path lookups are shared with other matchers and rules
+        return self.matches(context.data)
+        
+    def cost(self):
+        return self.COST
+        
+    def pass_rate(self):
+        return self.PASS_RATE
     
 class AlwaysMatcher(Matcher):
     
+    COST = 0
+    PASS_RATE = 1.0
+    
     def __init__(self):
         pass
         
@@ -22,13 +46,22 @@ class AlwaysMatcher(Matcher):
     
 class HasKeyMatcher(Matcher):
 
+    PASS_RATE = 0.3
+
     def __init__(self, key):
-        logger.debug("New HasKeyMatcher with key {}".format(key))
+        logger.debug("New HasKeyMatcher with key %s", key)
         self.key = key
+        self.path = compile_path(key)
+        self.canonical = ('has-key', self.path.canonical)
     
     def matches(self, json):
-        result = jsonpath.jsonpath(json, self.key)
-        logger.debug("matching {} against {} results in {}".format(json, self.key, result))
+        return self._matches_result(self.path.find(json))
+        
+    def matches_in(self, context):
+        return self._matches_result(context.find(self.path))
+        
+    def _matches_result(self, result):
+        logger.debug("matching %s results in %s", self.key, result)
         
         if (result):
             return True
@@ -36,16 +69,41 @@ class HasKeyMatcher(Matcher):
         logger.debug("finally no match found.")
         return False
         
+    def cost(self):
+        return self.path.COST
+        
 class KeyValueMatcher(Matcher):
     
+    # share of events expected to pass by the compared event field, identifiers are the most selective
+    PASS_RATES = {
+        ('uniqueid',): 0.02,
+        ('id',): 0.05,
+        ('r',): 0.5,
+        ('e',): 0.7,
+        ('t',): 0.95
+    }
+    PASS_RATE = 0.3
+    
     def __init__(self, key, value):
-        logger.debug("New KeyValueMatcher with key {} and value {}".format(key, value))
+        logger.debug("New KeyValueMatcher with key %s and value %s", key, value)
         self.key = key
         self.value = value
+        self.path = compile_path(key)
+        try:
+            self.canonical = ('keyvalue', self.path.canonical, value)
+            hash(self.canonical)
+        except TypeError:
+            # e.g. a list as value, evaluated for every rule
+            self.canonical = None
         
     def matches(self, json):
-        result = jsonpath.jsonpath(json, self.key)
-        logger.debug("matching {} against {} result in: {}".format(json, self.key, result))
+        return self._matches_result(self.path.find(json))
+        
+    def matches_in(self, context):
+        return self._matches_result(context.find(self.path))
+        
+    def _matches_result(self, result):
+        logger.debug("matching %s result in: %s", self.key, result)
         if not result:
             logger.debug("match aborted.")
             return False
@@ -60,6 +118,212 @@ class KeyValueMatcher(Matcher):
         logger.debug("finally no match found.")
         return False
         
+    def cost(self):
+        return self.path.COST + 1
+        
+    def pass_rate(self):
+        return self.PASS_RATES.get(self.path.canonical, self.PASS_RATE)
+        
+class ValueMatcher(Matcher):
+
+    # base of the matchers checking the first value of a path, missing values never match
+
+    PASS_RATE = 0.3
+
+    def __init__(self, key):
+        self.key = key
+        self.path = compile_path(key)
+
+    def matches(self, json):
+        return self._matches_result(self.path.find(json))
+
+    def matches_in(self, context):
+        return self._matches_result(context.find(self.path))
+
+    def _matches_result(self, result):
+        logger.debug("matching %s result in: %s", self.key, result)
+        if not result:
+            return False
+        return self._matches_value(result[0])
+
+    def _matches_value(self, value):
+        pass
+
+    def cost(self):
+        return self.path.COST + 1
+
+class InSetMatcher(ValueMatcher):
+
+    # like a keyvalue matcher for each of the values, with one hash lookup
+
+    def __init__(self, key, values):
+        super().__init__(key)
+        logger.debug("New InSetMatcher with key %s and values %s", key, values)
+        try:
+            self.values = frozenset(values)
+        except TypeError:
+            raise ValueError('values must be numbers or strings')
+        self.canonical = ('in-set', self.path.canonical, self.values)
+
+    def _matches_value(self, value):
+        # same as keyvalue: an empty value never matches
+        if not value:
+            return False
+        try:
+            return value in self.values
+        except TypeError:
+            # unhashable, e.g. a dict
+            return False
+
+    def pass_rate(self):
+        single = KeyValueMatcher.PASS_RATES.get(self.path.canonical, KeyValueMatcher.PASS_RATE)
+        return min(0.95, single * len(self.values))
+
+class RangeMatcher(ValueMatcher):
+
+    # numeric value between minimum and maximum, either bound may be left open
+
+    def __init__(self, key, minimum=None, maximum=None, include_minimum=True, include_maximum=True):
+        super().__init__(key)
+        logger.debug("New RangeMatcher with key %s, minimum %s and maximum %s", key, minimum, maximum)
+        for bound in [minimum, maximum]:
+            if bound is not None and not _is_number(bound):
+                raise ValueError('bounds must be numbers')
+        if minimum is None and maximum is None:
+            raise ValueError('no min or max')
+        self.minimum = minimum
+        self.maximum = maximum
+        self.include_minimum = include_minimum
+        self.include_maximum = include_maximum
+        self.canonical = ('range', self.path.canonical, minimum, maximum, include_minimum, include_maximum)
+
+    def _matches_value(self, value):
+        if not _is_number(value):
+            return False
+        if self.minimum is not None:
+            if value < self.minimum or (value == self.minimum and not self.include_minimum):
+                return False
+        if self.maximum is not None:
+            if value > self.maximum or (value == self.maximum and not self.include_maximum):
+                return False
+        return True
+
+class RegexMatcher(ValueMatcher):
+
+    # the value, as text, matches the pattern from its start (like the regex extract-type)
+
+    def __init__(self, key, pattern):
+        super().__init__(key)
+        logger.debug("New RegexMatcher with key %s and pattern %s", key, pattern)
+        try:
+            self.pattern = re.compile(pattern)
+        except (re.error, TypeError) as e:
+            raise ValueError('invalid pattern {}: {}'.format(pattern, e))
+        self.canonical = ('regex', self.path.canonical, pattern)
+
+    def _matches_value(self, value):
+        if isinstance(value, (dict, list)):
+            return False
+        if not isinstance(value, str):
+            value = json.dumps(value)
+        return self.pattern.match(value) is not None
+
+    def cost(self):
+        return self.path.COST + 5
+
+class NotMatcher(Matcher):
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        if matcher.canonical is not None:
+            self.canonical = ('not', matcher.canonical)
+
+    def matches(self, json):
+        return not self.matcher.matches(json)
+
+    def matches_in(self, context):
+        return not context.matches(self.matcher)
+
+    def cost(self):
+        return self.matcher.cost()
+
+    def pass_rate(self):
+        return 1.0 - self.matcher.pass_rate()
+
+class AllMatcher(Matcher):
+
+    # all of the matchers, checked in the order most likely to fail early
+
+    def __init__(self, matchers):
+        self.matchers = sorted(matchers, key=lambda matcher: rank(matcher.cost(), matcher.pass_rate()))
+        self.canonical = _canonical('all', self.matchers)
+
+    def matches(self, json):
+        return all(matcher.matches(json) for matcher in self.matchers)
+
+    def matches_in(self, context):
+        return all(context.matches(matcher) for matcher in self.matchers)
+
+    def cost(self):
+        return sum(matcher.cost() for matcher in self.matchers)
+
+    def pass_rate(self):
+        pass_rate = 1.0
+        for matcher in self.matchers:
+            pass_rate *= matcher.pass_rate()
+        return pass_rate
+
+class AnyMatcher(Matcher):
+
+    # one of the matchers, checked in the order most likely to pass early
+
+    def __init__(self, matchers):
+        self.matchers = sorted(matchers, key=lambda matcher: rank(matcher.cost(), 1.0 - matcher.pass_rate()))
+        self.canonical = _canonical('any', self.matchers)
+
+    def matches(self, json):
+        return any(matcher.matches(json) for matcher in self.matchers)
+
+    def matches_in(self, context):
+        return any(context.matches(matcher) for matcher in self.matchers)
+
+    def cost(self):
+        return sum(matcher.cost() for matcher in self.matchers)
+
+    def pass_rate(self):
+        fail_rate = 1.0
+        for matcher in self.matchers:
+            fail_rate *= 1.0 - matcher.pass_rate()
+        return 1.0 - fail_rate
+
+def _is_number(value):
+    # booleans are ints to python, but not numbers in deConz events
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _canonical(kind, matchers):
+    # the order of the nested matchers doesn't change the result
+    canonicals = [matcher.canonical for matcher in matchers]
+    if None in canonicals:
+        return None
+    return (kind, frozenset(canonicals))
+
+def rank(cost, pass_rate):
+    # matchers are ordered by rank: cheap ones likely to fail first, one that never fails last
+    if pass_rate >= 1:
+        return float('inf')
+    return cost / (1.0 - pass_rate)
+        
+def _get_key(matcher_config):
+    if (not 'key' in matcher_config):
+        raise ValueError('no key')
+    return matcher_config['key']
+
+def _parse_nested(matcher_config):
+    matcher = parse_matcher(matcher_config)
+    if matcher is None:
+        raise ValueError('unknown matcher {}'.format(matcher_config))
+    return matcher
+
 def parse_matcher(matcher_config):
     if (not 'type' in matcher_config):
         raise ValueError('no type')
@@ -83,6 +347,43 @@ def parse_matcher(matcher_config):
     elif t == 'always':
         return AlwaysMatcher()
         
-    logger.warn("no matcher found for config {}.".format(matcher_config))
+    elif t == 'in-set':
+        k = _get_key(matcher_config)
+        values = matcher_config.get('values', None)
+        if not isinstance(values, list):
+            raise ValueError('values must be a list')
+        return InSetMatcher(k, values)
+        
+    elif t == 'range':
+        k = _get_key(matcher_config)
+        return RangeMatcher(k, matcher_config.get('min', None), matcher_config.get('max', None))
+        
+    elif t in ['gt', 'lt']:
+        k = _get_key(matcher_config)
+        if (not 'value' in matcher_config):
+            raise ValueError('no value')
+        v = matcher_config['value']
+        if t == 'gt':
+            return RangeMatcher(k, minimum=v, include_minimum=False)
+        return RangeMatcher(k, maximum=v, include_maximum=False)
+        
+    elif t == 'regex':
+        k = _get_key(matcher_config)
+        if (not 'pattern' in matcher_config):
+            raise ValueError('no pattern')
+        return RegexMatcher(k, matcher_config['pattern'])
+        
+    elif t == 'not':
+        if (not 'matcher' in matcher_config):
+            raise ValueError('no matcher')
+        return NotMatcher(_parse_nested(matcher_config['matcher']))
+        
+    elif t in ['any', 'all']:
+        matchers = matcher_config.get('matchers', None)
+        if not isinstance(matchers, list) or not matchers:
+            raise ValueError('matchers must be a non-empty list')
+        matchers = [_parse_nested(nested) for nested in matchers]
+        return AnyMatcher(matchers) if t == 'any' else AllMatcher(matchers)
+        
+    logger.warning("no matcher found for config %s.", matcher_config)
     return None
-    
\ No newline at end of file
@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import json
+import jsonpath
+
+from . compiled_path import compile_path, SimplePath, GenericPath, MISSING
+
+class TestCompiledPath(unittest.TestCase):
+
+    def test_simple_forms(self):
+        self.assertTrue(type(compile_path("$['state'].temperature")) is SimplePath)
+        self.assertTrue(type(compile_path("$.state.temperature")) is SimplePath)
+        self.assertTrue(type(compile_path("e")) is SimplePath)
+        self.assertTrue(type(compile_path("uniqueid")) is SimplePath)
+        self.assertTrue(type(compile_path("$.list[1]")) is SimplePath)
+
+        self.assertEqual(compile_path("$['state'].temperature").canonical, compile_path("$.state.temperature").canonical)
+        self.assertEqual(compile_path("$.e").canonical, compile_path("e").canonical)
+
+    def test_generic_forms(self):
+        self.assertTrue(type(compile_path("$..temperature")) is GenericPath)
+        self.assertTrue(type(compile_path("$.state.*")) is GenericPath)
+        self.assertTrue(type(compile_path("$.list[0:2]")) is GenericPath)
+        self.assertTrue(type(compile_path("$.list[?(@.a)]")) is GenericPath)
+        self.assertTrue(type(compile_path("")) is GenericPath)
+
+    def test_same_result_as_jsonpath(self):
+        data = json.loads('{"e":"changed","id":"1","uniqueid":"12:34","state":{"on":false,"temperature":2612},"list":[{"a":1},{"a":2}],"empty":{}}')
+        expressions = [
+            "$['state'].temperature", "$.state.on", "$.id", "$.state", "e", "uniqueid", "state.on",
+            "$.id2", "$sate", "$id", "$['state'].updated", "$.list[1]", "$.list[5]", "$.list.1.a",
+            "$.empty", "$.empty.x", "$.e.x", "$", "$..a", "$.list[*].a", ""
+        ]
+        for expr in expressions:
+            self.assertEqual(jsonpath.jsonpath(data, expr), compile_path(expr).find(data), expr)
+
+        for expr in expressions:
+            self.assertEqual(jsonpath.jsonpath({}, expr), compile_path(expr).find({}), expr)
+            self.assertEqual(jsonpath.jsonpath("a string", expr), compile_path(expr).find("a string"), expr)
+
+    def test_get(self):
+        data = json.loads('{"e":"changed","state":{"on":false}}')
+        self.assertEqual("changed", compile_path("e").get(data))
+        self.assertEqual(False, compile_path("$['state'].on").get(data))
+        self.assertTrue(compile_path("$['state'].off").get(data) is MISSING)
+        self.assertTrue(compile_path("$..off").get(data) is MISSING)
+        self.assertEqual(False, compile_path("$..on").get(data))
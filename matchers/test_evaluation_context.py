@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from . compiled_path import compile_path
+from . matchers import HasKeyMatcher, KeyValueMatcher, AlwaysMatcher
+from . evaluation_context import EvaluationContext
+
+class CountingPath(object):
+
+    def __init__(self, expr):
+        self.path = compile_path(expr)
+        self.canonical = self.path.canonical
+        self.calls = 0
+
+    def find(self, data):
+        self.calls += 1
+        return self.path.find(data)
+
+class TestEvaluationContext(unittest.TestCase):
+
+    def test_paths_resolved_once(self):
+        testee = EvaluationContext({"state": {"temperature": 2000}})
+        path = CountingPath("$['state'].temperature")
+        self.assertEqual([2000], testee.find(path))
+        self.assertEqual([2000], testee.find(path))
+        self.assertEqual(1, path.calls)
+
+        # same path written differently
+        other = CountingPath("$.state.temperature")
+        self.assertEqual([2000], testee.find(other))
+        self.assertEqual(0, other.calls)
+
+    def test_matchers_shared(self):
+        testee = EvaluationContext({"e": "changed", "state": {"temperature": 2000}})
+        first = KeyValueMatcher("e", "changed")
+        first.path = CountingPath("e")
+        second = KeyValueMatcher("$.e", "changed")
+        self.assertTrue(testee.matches(first))
+        self.assertTrue(testee.matches(second))
+        self.assertEqual(1, first.path.calls)
+
+        self.assertFalse(testee.matches(KeyValueMatcher("e", "added")))
+        self.assertTrue(testee.matches(HasKeyMatcher("$['state'].temperature")))
+        self.assertFalse(testee.matches(HasKeyMatcher("$['state'].humidity")))
+        self.assertTrue(testee.matches(AlwaysMatcher()))
+
+    def test_unhashable_value(self):
+        testee = EvaluationContext({"list": [1, 2]})
+        matcher = KeyValueMatcher("list", [1, 2])
+        self.assertIsNone(matcher.canonical)
+        self.assertTrue(testee.matches(matcher))
+        self.assertFalse(testee.matches(KeyValueMatcher("list", [2, 1])))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,8 @@
 import unittest
 import json
 
-from . matchers import parse_matcher, HasKeyMatcher, KeyValueMatcher
+from . matchers import parse_matcher, HasKeyMatcher, KeyValueMatcher, InSetMatcher, RangeMatcher, RegexMatcher, NotMatcher, AllMatcher, AnyMatcher
+from . evaluation_context import EvaluationContext
 
 class TestHasKeyMatcher(unittest.TestCase):
 
@@ -67,3 +68,133 @@ class TestHasKeyMatcher(unittest.TestCase):
         json_expr = json.loads('{"type": "keyvalue", "value": "a"}')
         with self.assertRaises(ValueError):
             parse_matcher(json_expr)
+
+class TestValueMatchers(unittest.TestCase):
+
+    def setUp(self):
+        self.json_expr = json.loads('{"id":"1","uniqueid":"00:11-01","state":{"temperature":2612,"on":true,"name":"Kitchen","lastupdated":null}}')
+
+    def _matches(self, config):
+        matcher = parse_matcher(config)
+        result = matcher.matches(self.json_expr)
+        # same result when evaluated in a context
+        self.assertEqual(result, EvaluationContext(self.json_expr).matches(matcher))
+        return result
+
+    def test_in_set(self):
+        self.assertTrue(self._matches({"type": "in-set", "key": "uniqueid", "values": ["00:11-01", "00:11-02"]}))
+        self.assertFalse(self._matches({"type": "in-set", "key": "uniqueid", "values": ["00:11-02"]}))
+        # unhashable and missing values
+        self.assertFalse(self._matches({"type": "in-set", "key": "state", "values": ["00:11-01"]}))
+        self.assertFalse(self._matches({"type": "in-set", "key": "missing", "values": ["00:11-01"]}))
+        self.assertTrue(type(parse_matcher({"type": "in-set", "key": "id", "values": ["1"]})) is InSetMatcher)
+
+        with self.assertRaises(ValueError):
+            parse_matcher({"type": "in-set", "key": "id", "values": "1"})
+        with self.assertRaises(ValueError):
+            parse_matcher({"type": "in-set", "key": "id", "values": [["1"]]})
+        with self.assertRaises(ValueError):
+            parse_matcher({"type": "in-set", "values": ["1"]})
+
+    def test_range(self):
+        # inclusive bounds
+        self.assertTrue(self._matches({"type": "range", "key": "$['state'].temperature", "min": 2000, "max": 2612}))
+        self.assertTrue(self._matches({"type": "range", "key": "$['state'].temperature", "min": 2612}))
+        self.assertTrue(self._matches({"type": "range", "key": "$['state'].temperature", "max": 2612.0}))
+        self.assertFalse(self._matches({"type": "range", "key": "$['state'].temperature", "max": 2000}))
+        self.assertFalse(self._matches({"type": "range", "key": "$['state'].temperature", "min": 2613}))
+        self.assertTrue(type(parse_matcher({"type": "range", "key": "id", "min": 0})) is RangeMatcher)
+
+    def test_gt_lt(self):
+        # strict
+        self.assertTrue(self._matches({"type": "gt", "key": "$['state'].temperature", "value": 2611.5}))
+        self.assertFalse(self._matches({"type": "gt", "key": "$['state'].temperature", "value": 2612}))
+        self.assertTrue(self._matches({"type": "lt", "key": "$['state'].temperature", "value": 2613}))
+        self.assertFalse(self._matches({"type": "lt", "key": "$['state'].temperature", "value": 2612}))
+        self.assertTrue(type(parse_matcher({"type": "gt", "key": "id", "value": 0})) is RangeMatcher)
+
+    def test_range_numbers_only(self):
+        # booleans, strings, null, objects and missing values never compare
+        for key in ["$['state'].on", "id", "$['state'].lastupdated", "state", "missing"]:
+            self.assertFalse(self._matches({"type": "range", "key": key, "min": -1, "max": 1}), key)
+            self.assertFalse(self._matches({"type": "gt", "key": key, "value": -1}), key)
+            self.assertFalse(self._matches({"type": "lt", "key": key, "value": 100}), key)
+
+    def test_regex(self):
+        self.assertTrue(self._matches({"type": "regex", "key": "$['state'].name", "pattern": "Kit"}))
+        # from the start of the value
+        self.assertFalse(self._matches({"type": "regex", "key": "$['state'].name", "pattern": "chen"}))
+        self.assertTrue(self._matches({"type": "regex", "key": "$['state'].name", "pattern": ".*chen$"}))
+        self.assertFalse(self._matches({"type": "regex", "key": "missing", "pattern": ".*"}))
+        self.assertTrue(type(parse_matcher({"type": "regex", "key": "id", "pattern": "1"})) is RegexMatcher)
+
+    def test_regex_json(self):
+        # values other than strings are matched as json
+        self.assertTrue(self._matches({"type": "regex", "key": "$['state'].temperature", "pattern": "26\\d\\d$"}))
+        self.assertTrue(self._matches({"type": "regex", "key": "$['state'].on", "pattern": "true$"}))
+        self.assertFalse(self._matches({"type": "regex", "key": "$['state'].on", "pattern": "True"}))
+        self.assertTrue(self._matches({"type": "regex", "key": "$['state'].lastupdated", "pattern": "null$"}))
+        # but never objects or lists
+        self.assertFalse(self._matches({"type": "regex", "key": "state", "pattern": ".*"}))
+
+    def test_combinators(self):
+        on = {"type": "keyvalue", "key": "$['state'].on", "value": True}
+        hot = {"type": "gt", "key": "$['state'].temperature", "value": 3000}
+        self.assertFalse(self._matches({"type": "not", "matcher": on}))
+        self.assertTrue(self._matches({"type": "not", "matcher": hot}))
+        self.assertFalse(self._matches({"type": "all", "matchers": [on, hot]}))
+        self.assertTrue(self._matches({"type": "all", "matchers": [on, {"type": "not", "matcher": hot}]}))
+        self.assertTrue(self._matches({"type": "any", "matchers": [on, hot]}))
+        self.assertFalse(self._matches({"type": "any", "matchers": [hot, {"type": "not", "matcher": on}]}))
+        self.assertTrue(type(parse_matcher({"type": "all", "matchers": [on]})) is AllMatcher)
+        self.assertTrue(type(parse_matcher({"type": "any", "matchers": [on]})) is AnyMatcher)
+
+    def test_combinators_in_context(self):
+        # nested matchers are evaluated once per context, no matter how many combinators use them
+        evaluated = []
+        on = KeyValueMatcher("$['state'].on", True)
+        hot = RangeMatcher("$['state'].temperature", minimum=3000, include_minimum=False)
+        for matcher in [on, hot]:
+            matcher.matches_in = (lambda matches_in: lambda context: evaluated.append(1) or matches_in(context))(matcher.matches_in)
+        combinators = [AllMatcher([on, hot]), AnyMatcher([hot, on]), NotMatcher(hot)]
+
+        context = EvaluationContext(self.json_expr)
+        self.assertEqual([False, True, True], [context.matches(combinator) for combinator in combinators])
+        self.assertEqual(2, len(evaluated))
+        self.assertEqual([False, True, True], [combinator.matches(self.json_expr) for combinator in combinators])
+
+        # equal combinators share their result
+        self.assertEqual(combinators[0].canonical, AllMatcher([hot, on]).canonical)
+        self.assertNotEqual(combinators[0].canonical, combinators[1].canonical)
+
+    def test_parse_errors(self):
+        for config in [
+                {"type": "range", "key": "$['state'].temperature"},
+                {"type": "range", "key": "$['state'].temperature", "min": "1"},
+                {"type": "range", "key": "$['state'].temperature", "max": True},
+                {"type": "gt", "key": "$['state'].temperature"},
+                {"type": "lt", "key": "$['state'].temperature", "value": "1"},
+                {"type": "regex", "key": "id", "pattern": "("},
+                {"type": "regex", "key": "id", "pattern": 1},
+                {"type": "regex", "key": "id"},
+                {"type": "not"},
+                {"type": "not", "matcher": {"type": "unknown"}},
+                {"type": "any", "matchers": []},
+                {"type": "all"},
+                {"type": "all", "matchers": [{"type": "unknown"}]},
+                {"type": "any", "matchers": [{"type": "keyvalue", "key": "e"}]}]:
+            with self.assertRaises(ValueError, msg=config):
+                parse_matcher(config)
+
+    def test_estimates(self):
+        in_set = parse_matcher({"type": "in-set", "key": "uniqueid", "values": ["1", "2"]})
+        self.assertAlmostEqual(0.04, in_set.pass_rate())
+        negated = parse_matcher({"type": "not", "matcher": {"type": "keyvalue", "key": "e", "value": "changed"}})
+        self.assertAlmostEqual(0.3, negated.pass_rate())
+        either = parse_matcher({"type": "any", "matchers": [{"type": "keyvalue", "key": "e", "value": "changed"}, {"type": "keyvalue", "key": "e", "value": "added"}]})
+        self.assertAlmostEqual(0.91, either.pass_rate())
+        both = parse_matcher({"type": "all", "matchers": [{"type": "keyvalue", "key": "e", "value": "changed"}, {"type": "keyvalue", "key": "uniqueid", "value": "1"}]})
+        self.assertAlmostEqual(0.014, both.pass_rate())
+        self.assertEqual(in_set.cost() + negated.cost(), parse_matcher({"type": "all", "matchers": [
+            {"type": "in-set", "key": "uniqueid", "values": ["1", "2"]},
+            {"type": "not", "matcher": {"type": "keyvalue", "key": "e", "value": "changed"}}]}).cost())
@@ -0,0 +1,234 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# counters and histograms in the prometheus text format, served by a small http server.
+# recording is a few additions without locks (a lost increment in a race is acceptable for metrics),
+# values other components count anyway (queue depths, ...) are only read when the metrics are scraped.
+
+import bisect
+import logging
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+# seconds, from 10 microseconds (matching a rule) to 10 seconds (a REST request timing out)
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labelnames, labelvalues, extra=None):
+    pairs = ['{}="{}"'.format(name, _escape(value)) for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(pairs) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric(object):
+
+    # a metric with labels has one child per combination of label values
+
+    TYPE = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *labelvalues):
+        child = self._children.get(labelvalues, None)
+        if child is None:
+            child = self._children.setdefault(labelvalues, self._create_child())
+        return child
+
+    def _create_child(self):
+        raise NotImplementedError()
+
+    def _samples(self):
+        # (name suffix, label values, extra label, value)
+        raise NotImplementedError()
+
+    def collect(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} {}'.format(self.name, self.TYPE)]
+        for suffix, labelvalues, extra, value in self._samples():
+            lines.append('{}{}{} {}'.format(self.name, suffix, _labels(self.labelnames, labelvalues, extra), _number(value)))
+        return lines
+
+class _CounterValue(object):
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+class Counter(Metric):
+
+    TYPE = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        if not self.labelnames:
+            self._value = self.labels()
+            self.inc = self._value.inc
+
+    def _create_child(self):
+        return _CounterValue()
+
+    def _samples(self):
+        for labelvalues, child in list(self._children.items()):
+            yield '', labelvalues, None, child.value
+
+class _HistogramValue(object):
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        # per bucket, not cumulative, the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self._buckets, value)] += 1
+        self.sum += value
+
+class Histogram(Metric):
+
+    TYPE = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        if not self.labelnames:
+            self._value = self.labels()
+            self.observe = self._value.observe
+
+    def _create_child(self):
+        return _HistogramValue(self.buckets)
+
+    def _samples(self):
+        for labelvalues, child in list(self._children.items()):
+            counts = list(child.counts)
+            total = 0
+            for upper, count in zip(self.buckets + (float('inf'),), counts):
+                total += count
+                yield '_bucket', labelvalues, 'le="{}"'.format(_number(upper)), total
+            yield '_sum', labelvalues, None, child.sum
+            yield '_count', labelvalues, None, total
+
+class CallbackMetric(Metric):
+
+    # read when collected: the callback returns a number, or {label values: number} for a metric with labels
+
+    def __init__(self, name, help, kind, callback, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.TYPE = kind
+        self.callback = callback
+
+    def _samples(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.error(f"cannot collect metric {self.name}, due to {e}.")
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labelvalues, value in values.items():
+            yield '', labelvalues, None, value
+
+class Registry(object):
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, kind, callback, labelnames=()):
+        # kind is "counter" or "gauge"
+        return self.register(CallbackMetric(name, help, kind, callback, labelnames))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+class RuleMetrics(object):
+
+    # times matching and value extraction per rule, the processors call it instead of the rule
+
+    def __init__(self, registry, prefix):
+        self._match_time = registry.histogram(prefix + '_rule_match_seconds', 'Time matching an event against a rule.', ['rule'])
+        self._value_time = registry.histogram(prefix + '_rule_value_seconds', 'Time extracting the value of a matching rule.', ['rule'])
+
+    def matches(self, rule, message, context=None):
+        start = time.perf_counter()
+        result = rule.matches(message, context)
+        self._match_time.labels(rule.get_description()).observe(time.perf_counter() - start)
+        return result
+
+    def get_value(self, rule, message, context=None):
+        start = time.perf_counter()
+        result = rule.get_value(message, context)
+        self._value_time.labels(rule.get_description()).observe(time.perf_counter() - start)
+        return result
+
+class MetricsServer(object):
+
+    # serves the metrics of a registry on http://<host>:<port>/metrics
+
+    def __init__(self, registry, host='127.0.0.1', port=9100):
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(handler):
+                if handler.path.split('?')[0] != '/metrics':
+                    handler.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                logger.debug(format, *args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True)
+        self._thread.start()
+        logger.info("serving metrics on port %s", self.port)
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
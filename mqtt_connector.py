@@ -2,56 +2,180 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import asyncio
 import paho.mqtt.client as mqtt
 
+from topic_trie import TopicTrie
+from publish_queue import PublishQueue
+
 logger = logging.getLogger(__name__)
 
 class MQTTConnector(object):
     
-    def __init__(self, host, port):
-        self.client = mqtt.Client()
-        self.client.connect(host, port, 60)
+    def __init__(self, host, port, max_queued=1000, max_inflight=20):
+        self.client = self._create_client()
         self.client.on_message = self._on_message
-        self._topic_to_callback = {}
+        # topic filter (may contain + and # wildcards) -> callbacks
+        self._subscriptions = TopicTrie()
+        # outgoing messages, at most max_inflight QoS 1/2 messages wait for their acknowledgement
+        self.client.max_inflight_messages_set(max_inflight)
+        self._publish_queue = PublishQueue(self.client, max_queued, max_inflight)
+        self.client.on_publish = self._publish_queue.on_publish
+        self.client.connect(host, port, 60)
+        
+    def _create_client(self):
+        return mqtt.Client()
         
     def _on_message(self, client, userdata, message):
-        logger.debug("received message {} on topic {}".format(message.payload, message.topic))
-        if message.topic in self._topic_to_callback:
-            clbk = self._topic_to_callback[message.topic]
-            # call it
-            clbk(message.topic, userdata, message.payload.decode('utf-8'))
-        else:
-            logger.debug("no listener to topic {}".format(message.topic))
+        logger.debug("received message %s on topic %s", message.payload, message.topic)
+        matches = self._subscriptions.match(message.topic)
+        if not matches:
+            logger.debug("no listener to topic %s", message.topic)
+            return
+            
+        payload = message.payload.decode('utf-8')
+        called = []
+        for topic_filter, callbacks, captures in matches:
+            for clbk in callbacks:
+                # a callback registered to several matching filters is called once
+                if clbk in called:
+                    continue
+                called.append(clbk)
+                # call it
+                clbk(message.topic, userdata, payload)
 
     def start(self):
         self.client.loop_start()
         logger.debug("started loop")
         
-    def publish(self, topic, msg):
-        logger.debug("publishing {} to topic {}".format(msg, topic))
-        self.client.publish(topic, msg)
+    def publish(self, topic, msg, qos=0, retain=False):
+        logger.debug("publishing %s to topic %s", msg, topic)
+        if self._publish_queue.put(topic, msg, qos, retain):
+            self._schedule_flush()
+            
+    def _schedule_flush(self):
+        # paho's network thread writes everything queued meanwhile at once
+        self._publish_queue.flush()
+        
+    def get_stats(self):
+        return self._publish_queue.get_stats()
         
-    def unsubscribe_from(self, topic):
-        if topic in self._topic_to_callback:
-            self._topic_to_callback.pop(topic)
-            logger.debug("removed topic {} subscription".format(topic))
+    def unsubscribe_from(self, topic, callback=None):
+        if topic in self._subscriptions:
+            # the broker only needs to know once no callback is left for the topic filter
+            if self._subscriptions.remove(topic, callback):
+                self.client.unsubscribe(topic)
+            logger.debug("removed topic %s subscription", topic)
         else:
             logger.error("there is no subscription to topic {}".format(topic))
         
     def subscribe_to(self, topic, callback, overwrite=False):
-        if topic in self._topic_to_callback:
-            logger.info("topic {} already registered".format(topic))
+        if callback is None:
+            logger.error("callback is invalid, do not register")
+            return
             
-            if not overwrite:
+        if topic in self._subscriptions:
+            logger.info("topic %s already registered", topic)
+            
+            if overwrite:
+                logger.info("reregister to topic %s", topic)
+                self._subscriptions.remove(topic)
+            elif callback in self._subscriptions.get(topic):
                 logger.info("do not re-register")
                 return
-            logger.info("reregister to topic {}".format(topic))
         
-        if callback is None:
-            logger.error("callback is invalid, do not register")
-            return
+        # register, the broker only needs to know about new topic filters
+        if self._subscriptions.add(topic, callback):
+            self.client.subscribe(topic)
         
-        # register
-        self._topic_to_callback[topic] = callback
-        self.client.subscribe(topic)
-        
\ No newline at end of file
+class AsyncioMQTTConnector(MQTTConnector):
+
+    # runs the paho client on an asyncio event loop (the one of the deCONZ websockets) instead of
+    # paho's own network thread, so messages in both directions are handled without changing threads
+
+    # seconds between two keepalive/reconnect checks
+    MISC_INTERVAL = 1
+
+    @staticmethod
+    def supports(loop):
+        # the socket is watched with add_reader/add_writer, which the proactor event loop
+        # (the default on windows) does not implement
+        proactor = getattr(asyncio, 'ProactorEventLoop', None)
+        return proactor is None or not isinstance(loop, proactor)
+
+    def __init__(self, host, port, loop=None, max_queued=1000, max_inflight=20, flush_interval=0):
+        self.loop = loop or asyncio.get_event_loop()
+        self._misc = None
+        # publishes are collected for flush_interval seconds (or the current loop iteration)
+        # and then written together
+        self.flush_interval = flush_interval
+        self._flush_scheduled = False
+        super().__init__(host, port, max_queued, max_inflight)
+
+    def _create_client(self):
+        client = super()._create_client()
+        # paho tells when to watch its socket, the event loop calls it when the socket is ready
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+        return client
+
+    def _on_socket_open(self, client, userdata, sock):
+        logger.debug("mqtt socket opened")
+        self.loop.add_reader(sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        logger.debug("mqtt socket closed")
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    async def _loop_misc(self):
+        # keepalive pings and reconnects, paho's network thread would do this
+        while True:
+            if self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+                logger.info("mqtt connection lost, reconnecting")
+                try:
+                    self.client.reconnect()
+                except OSError as e:
+                    logger.error(f"cannot reconnect to mqtt, due to {e}.")
+            await asyncio.sleep(self.MISC_INTERVAL)
+
+    def _in_loop(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def start(self):
+        # runs as soon as the event loop runs
+        if self._misc is None:
+            self._misc = self.loop.create_task(self._loop_misc())
+        logger.debug("started loop")
+
+    def publish(self, topic, msg, qos=0, retain=False):
+        # publishes from other threads (e.g. processing in a worker thread, trailing rate limits)
+        # are handed to the event loop, which owns the socket
+        if self._in_loop():
+            super().publish(topic, msg, qos, retain)
+        else:
+            self.loop.call_soon_threadsafe(super().publish, topic, msg, qos, retain)
+            
+    def _schedule_flush(self):
+        if self._flush_scheduled:
+            return
+        self._flush_scheduled = True
+        if self.flush_interval:
+            self.loop.call_later(self.flush_interval, self._flush)
+        else:
+            self.loop.call_soon(self._flush)
+            
+    def _flush(self):
+        self._flush_scheduled = False
+        self._publish_queue.flush()
@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+
+from matchers.matchers import AlwaysMatcher, HasKeyMatcher, KeyValueMatcher, InSetMatcher, AllMatcher
+from matchers.evaluation_context import EvaluationContext
+
+logger = logging.getLogger(__name__)
+
+EQUALS = 'equals'
+PRESENT = 'present'
+
+class _Test(object):
+
+    # a compiled matcher: the path has one of the values (EQUALS) or is present (PRESENT)
+
+    def __init__(self, kind, path, values=None, pass_rate=0.5):
+        self.kind = kind
+        self.path = path
+        self.values = values
+        # estimated share of events passing, see Matcher.pass_rate
+        self.pass_rate = pass_rate
+
+    def key(self):
+        return (self.kind, self.path.canonical)
+
+class _Node(object):
+
+    def __init__(self):
+        # rules whose compiled matchers all passed on the way here
+        self.positions = []
+        # EQUALS: value -> node, PRESENT: True -> node
+        self.test = None
+        self.branches = {}
+        # rules not depending on this node's test, walked in any case
+        self.rest = None
+
+def _compile(matcher):
+    # (the _Tests of a matcher, whether they cover it completely)
+    if isinstance(matcher, AlwaysMatcher):
+        return [], True
+    if isinstance(matcher, HasKeyMatcher):
+        return [_Test(PRESENT, matcher.path, pass_rate=matcher.pass_rate())], True
+    if isinstance(matcher, KeyValueMatcher):
+        try:
+            return [_Test(EQUALS, matcher.path, frozenset([matcher.value]), matcher.pass_rate())], True
+        except TypeError:
+            # unhashable value
+            return [], False
+    if isinstance(matcher, InSetMatcher):
+        return [_Test(EQUALS, matcher.path, matcher.values, matcher.pass_rate())], True
+    if isinstance(matcher, AllMatcher):
+        tests = []
+        complete = True
+        for nested in matcher.matchers:
+            nested_tests, nested_complete = _compile(nested)
+            tests.extend(nested_tests)
+            complete = complete and nested_complete
+        return tests, complete
+    # anything else is checked with the rule after the walk
+    return [], False
+
+class DecisionTree(object):
+
+    # the matchers of all rules compiled into one tree branching on the presence and the values of event fields
+    # (keyvalue, in-set and has-key, also within "all"),
+    # a walk over an event finds every matching rule without checking the rules one by one.
+    # rules with matchers that can't be compiled are checked with rule.matches() after the walk,
+    # only their matcher order (and its adaptation to the events, see ProcessorRule.enable_adaptive_order) matters.
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        # positions of rules with matchers left to check after the walk
+        self._residual = set()
+
+        entries = []
+        for position, rule in enumerate(self.rules):
+            tests = {}
+            for matcher in rule.matchers:
+                compiled, complete = _compile(matcher)
+                if not complete:
+                    self._residual.add(position)
+                for test in compiled:
+                    existing = tests.get(test.key(), None)
+                    if existing is not None and test.kind == EQUALS:
+                        # equal to one of both sets of values, often none
+                        tests[test.key()] = _Test(EQUALS, test.path, existing.values & test.values,
+                            min(existing.pass_rate, test.pass_rate))
+                    else:
+                        tests[test.key()] = test
+            entries.append((position, tests))
+        self._root = self._build(entries)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _build(self, entries):
+        node = _Node()
+        remaining = []
+        for position, tests in entries:
+            if tests:
+                remaining.append((position, tests))
+            else:
+                node.positions.append(position)
+        if not remaining:
+            return node
+
+        # branch on the test most rules share, equality first as it splits the rules the most,
+        # then the most selective one (lowest estimated pass rate), so fewer events go down the branches
+        counts = {}
+        pass_rates = {}
+        for position, tests in remaining:
+            for key, test in tests.items():
+                counts[key] = counts.get(key, 0) + 1
+                pass_rates[key] = min(pass_rates.get(key, 1.0), test.pass_rate)
+        key = max(counts, key=lambda key: (counts[key], key[0] == EQUALS, -pass_rates[key]))
+
+        branches = {}
+        rest = []
+        for position, tests in remaining:
+            test = tests.get(key, None)
+            if test is None:
+                rest.append((position, tests))
+                continue
+            node.test = test
+            others = {other: other_test for other, other_test in tests.items() if other != key}
+            values = test.values if test.kind == EQUALS else [True]
+            for value in values:
+                branches.setdefault(value, []).append((position, others))
+        # the node's test only needs the path, the values are in the branches
+        node.test = _Test(node.test.kind, node.test.path)
+        node.branches = {value: self._build(branch) for value, branch in branches.items()}
+        if rest:
+            node.rest = self._build(rest)
+        return node
+
+    def match(self, context, matches=None):
+        # the rules matching the event of the EvaluationContext (or plain event), in configuration order.
+        # matches(rule, message, context), if given, confirms every rule the walk found (e.g. to time
+        # them, see metrics.RuleMetrics), otherwise only rules with uncompiled matchers are checked
+        if not isinstance(context, EvaluationContext):
+            context = EvaluationContext(context)
+        positions = []
+        self._walk(self._root, context, positions)
+        if not positions:
+            return []
+        positions.sort()
+        result = []
+        for position in positions:
+            rule = self.rules[position]
+            if matches is not None:
+                # the compiled matchers are answered from the context, resolved by the walk
+                if not matches(rule, context.data, context):
+                    continue
+            elif position in self._residual and not rule.matches(context.data, context):
+                continue
+            result.append(rule)
+        return result
+
+    def _walk(self, node, context, positions):
+        while node is not None:
+            positions.extend(node.positions)
+            test = node.test
+            if test is None:
+                return
+            found = context.find(test.path)
+            child = None
+            if test.kind == EQUALS:
+                # same as KeyValueMatcher: a missing or empty value never matches
+                if found and found[0]:
+                    try:
+                        child = node.branches.get(found[0], None)
+                    except TypeError:
+                        # unhashable values (dicts, lists) can't equal a compiled value
+                        child = None
+            elif found:
+                child = node.branches[True]
+            if child is not None:
+                self._walk(child, context, positions)
+            node = node.rest
+
+    def dump(self):
+        # the compiled tree as text, for debugging
+        lines = []
+        self._dump(self._root, 0, lines)
+        return "\n".join(lines)
+
+    def _dump(self, node, depth, lines):
+        indent = "  " * depth
+        for position in node.positions:
+            rule = self.rules[position]
+            checked = " (checks uncompiled matchers)" if position in self._residual else ""
+            lines.append("{}-> [{}] {}{}".format(indent, position, rule.get_description(), checked))
+        if node.test is not None:
+            for value, child in node.branches.items():
+                if node.test.kind == EQUALS:
+                    lines.append("{}{} == {!r}:".format(indent, node.test.path.expr, value))
+                else:
+                    lines.append("{}has {}:".format(indent, node.test.path.expr))
+                self._dump(child, depth + 1, lines)
+        if node.rest is not None:
+            self._dump(node.rest, depth, lines)
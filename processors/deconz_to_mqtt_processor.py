@@ -2,35 +2,198 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import threading
 
-from . processor_rule import ProcessorRule
+from . processor_rule import parse_rules
+from . decision_tree import DecisionTree
+from . publish_cache import PublishCache
+from . publish_throttle import PublishThrottle
+from matchers.evaluation_context import EvaluationContext
 
 logger = logging.getLogger(__name__)
         
 class DeconzToMqttProcessor(object):
     
-    def __init__(self, rules, mqtt):
+    def __init__(self, rules, mqtt, publish_cache_size=10000, device_state=None, adaptive_matcher_order=False):
+        # held while an event is processed, the rules are swapped in between
+        self._rules_lock = threading.Lock()
+        # order the matchers the decision tree checks after its walk by the pass rates seen in the events
+        self.adaptive_matcher_order = adaptive_matcher_order
         self.processor_rules = []
+        self._throttles = {}
         self._parse_rules(rules)
         self.mqtt = mqtt
+        # gateway name -> mirror of its devices (optional), updated by the processed events
+        self.device_states = {}
+        if device_state is not None:
+            self.add_device_state(None, device_state)
+        # times matching and extraction per rule if set (see metrics.RuleMetrics)
+        self.rule_metrics = None
+        # last value per topic, for rules publishing only changes
+        self._publish_cache = PublishCache(publish_cache_size)
+        # guards the cache and the stats: trailing values of rate limited rules are published from timer
+        # threads, without the rules lock (held around submitting to the throttles, so it can't be taken there)
+        self._publish_lock = threading.Lock()
+        self._stats = {
+            'published': 0,
+            'unchanged': 0
+        }
         
-    def _parse_rules(self, rules):
-        self.processor_rules = []
+    def _parse_rules(self, rules, previous=None):
+        self._swap_rules(self._prepare_rules(rules, previous))
+
+    def _prepare_rules(self, rules, previous=None):
+        # everything is prepared before the swap, a rule failing to parse leaves the current rules in place
+        processor_rules = parse_rules(rules, 'deconz->mqtt', previous)
+        if self.adaptive_matcher_order:
+            # rules taken over keep what they learned
+            taken_over = set(previous or [])
+            for pr in processor_rules:
+                if pr not in taken_over:
+                    pr.enable_adaptive_order()
+        throttles = self._create_throttles(processor_rules, self._throttles)
+        return processor_rules, throttles
+
+    def _swap_rules(self, prepared):
+        processor_rules, throttles = prepared
+        with self._rules_lock:
+            self.processor_rules = processor_rules
+            # gateway name -> decision trees of the rules for its events, built on the first event of a gateway
+            self._rule_trees = {}
+            # rule -> configuration position, to keep the order across the trees
+            self._positions = {pr: position for position, pr in enumerate(processor_rules)}
+            # the cache only needs to follow the published values if some rule uses it
+            self._use_publish_cache = any(pr.publish_on_change_only for pr in processor_rules)
+            self._throttles = throttles
+            
+    def reload(self, rules):
+        # swaps in new rules, unchanged rules are taken over (with their rate limits)
+        self.commit_reload(self.prepare_reload(rules))
+
+    def prepare_reload(self, rules):
+        # parses the new rules without touching the current ones, commit_reload swaps them in
+        return self._prepare_rules(rules, self.processor_rules)
+
+    def commit_reload(self, prepared):
+        self._swap_rules(prepared)
+        logger.info("reloaded %s deconz->mqtt rules", len(self.processor_rules))
+        
+    def _create_throttles(self, rules, previous):
+        # rule -> throttle, rules limited per topic share the throttle of their topic
+        throttles = {}
+        by_topic = {}
         for rule in rules:
-            logger.debug("attempting to parse {}".format(rule))
-            if rule['type'] == 'deconz->mqtt':                
-                pr = ProcessorRule(rule)
-                self.processor_rules.append(pr)
-        
-    def process_message(self, msg):
-        logger.debug("processing message {}".format(msg))
-        for rule in self.processor_rules:
-            logger.debug("processing on rule {}".format(rule.get_description()))
-            if rule.matches(msg):
+            rate_limit = rule.rate_limit
+            if not rate_limit:
+                continue
+            if rate_limit['scope'] == 'topic':
                 topic = rule.get_config_value("target-mqtt-topic")
-                message = rule.get_value(msg)
-                logger.debug("rule hit! sending {} to topic {}".format(message, topic))
-                try:
-                    self.mqtt.publish(topic, message)
-                except Exception as e:
-                    logger.error(f"cannot send message, due to {e}.")
+                # the first rule of a topic configures the limit
+                if topic not in by_topic:
+                    by_topic[topic] = previous.get(rule, None) or self._create_throttle(rate_limit)
+                throttles[rule] = by_topic[topic]
+            else:
+                throttles[rule] = previous.get(rule, None) or self._create_throttle(rate_limit)
+        return throttles
+        
+    def _create_throttle(self, rate_limit):
+        return PublishThrottle(self._publish, rate_limit['rate'], rate_limit['burst'], rate_limit['trailing'])
+        
+    def add_device_state(self, gateway, device_state):
+        self.device_states[gateway] = device_state
+        
+    def _rule_tree(self, gateway):
+        # only rules that could match an event are checked for it, rules with a "gateway" only for its events;
+        # one tree for the rules seeing the event, one for the "merged-state" rules seeing the whole device
+        trees = self._rule_trees.get(gateway, None)
+        if trees is None:
+            rules = [pr for pr in self.processor_rules if pr.gateway is None or pr.gateway == gateway]
+            trees = self._rule_trees[gateway] = (
+                DecisionTree([pr for pr in rules if not pr.merged_state]),
+                DecisionTree([pr for pr in rules if pr.merged_state]))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("rules for the events of gateway %s:\n%s", gateway, self.dump_rule_tree(gateway))
+        return trees
+        
+    def dump_rule_tree(self, gateway=None):
+        # the compiled rules for the events of a gateway, for debugging
+        event_tree, merged_tree = self._rule_tree(gateway)
+        return "event:\n{}\nmerged state:\n{}".format(event_tree.dump(), merged_tree.dump())
+        
+    def process_message(self, msg, gateway=None):
+        logger.debug("processing message %s", msg)
+        merged = None
+        device_state = self.device_states.get(gateway, None)
+        if device_state is not None:
+            merged = device_state.apply(msg)
+        self._process(msg, merged, gateway)
+        
+    def publish_state(self, *gateways):
+        # runs the rules on the mirrored state of every device (of the given gateways, all if none given),
+        # e.g. to fill retained topics at startup
+        for gateway, device_state in self.device_states.items():
+            if gateways and gateway not in gateways:
+                continue
+            logger.info("publishing the state of %s devices", len(device_state))
+            for event in device_state.events():
+                self._process(event, event, gateway)
+        
+    def _process(self, msg, merged, gateway):
+        with self._rules_lock:
+            self._process_rules(msg, merged, gateway)
+        
+    def _process_rules(self, msg, merged, gateway):
+        rule_metrics = self.rule_metrics
+        matches = rule_metrics.matches if rule_metrics is not None else None
+        event_tree, merged_tree = self._rule_tree(gateway)
+        # paths and matchers are evaluated once per event, not once per rule
+        msg_context = EvaluationContext(msg)
+        rules = event_tree.match(msg_context, matches)
+        merged_context = msg_context
+        if len(merged_tree):
+            # "merged-state" rules see the whole device, not only the changed fields
+            if merged is not None and merged is not msg:
+                merged_context = EvaluationContext(merged)
+            merged_rules = merged_tree.match(merged_context, matches)
+            if merged_rules:
+                rules = sorted(rules + merged_rules, key=self._positions.get)
+        for rule in rules:
+            logger.debug("processing on rule %s", rule.get_description())
+            context = merged_context if rule.merged_state else msg_context
+            rule_msg = context.data
+            topic = rule.get_config_value("target-mqtt-topic")
+            message = rule.get_value(rule_msg, context) if rule_metrics is None else rule_metrics.get_value(rule, rule_msg, context)
+            if self._use_publish_cache and rule.publish_on_change_only:
+                with self._publish_lock:
+                    unchanged = self._publish_cache.is_unchanged(topic, message, rule.deadband, rule.max_silence)
+                    if unchanged:
+                        self._stats['unchanged'] += 1
+                if unchanged:
+                    logger.debug("rule hit, but %s is unchanged on topic %s", message, topic)
+                    continue
+            throttle = self._throttles.get(rule)
+            if throttle:
+                throttle.submit(topic, message, rule.qos, rule.retain)
+            else:
+                self._publish(topic, message, rule.qos, rule.retain)
+                
+    def _publish(self, topic, message, qos=0, retain=False):
+        logger.debug("rule hit! sending %s to topic %s", message, topic)
+        try:
+            self.mqtt.publish(topic, message, qos=qos, retain=retain)
+            with self._publish_lock:
+                self._stats['published'] += 1
+                if self._use_publish_cache:
+                    self._publish_cache.remember(topic, message)
+        except Exception as e:
+            logger.error(f"cannot send message, due to {e}.")
+                    
+    def get_stats(self):
+        with self._publish_lock:
+            stats = dict(self._stats)
+            stats['cached_topics'] = len(self._publish_cache)
+        # a throttle shared by several rules counts once
+        throttles = set(self._throttles.values())
+        stats['rate_limited'] = sum(throttle.limited for throttle in throttles)
+        stats['rate_limit_dropped'] = sum(throttle.get_dropped() for throttle in throttles)
+        return stats
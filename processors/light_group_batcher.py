@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+class LightGroupBatcher(object):
+
+    # replaces identical state commands to all lights of a deCONZ group by one group action
+
+    LIGHT_STATE_PATH = re.compile(r'^/lights/([^/]+)/state$')
+    GROUP_ACTION_PATH = "/groups/{}/action"
+    LIGHT_STATE = "/lights/{}/state"
+
+    def __init__(self, light_groups):
+        # light ids of a group -> group id
+        self._group_by_lights = {}
+        # group action path -> the group action and the state paths of its lights
+        self._related_paths = {}
+        for group_id, lights in light_groups.items():
+            lights = frozenset(str(light) for light in lights)
+            action = self.GROUP_ACTION_PATH.format(group_id)
+            self._related_paths[action] = frozenset([action] + [self.LIGHT_STATE.format(light) for light in lights])
+            # a single light is cheaper to address directly
+            if len(lights) < 2:
+                continue
+            self._group_by_lights.setdefault(lights, group_id)
+        logger.debug("batching commands for %s light groups", len(self._group_by_lights))
+
+    def batch(self, commands):
+        # commands is a list of (path, value, coalesce) and returned the same way, in order of first occurrence
+        if not self._group_by_lights or len(commands) < 2:
+            return commands
+
+        # value -> positions of light state commands with that value
+        by_value = {}
+        for position, (path, value, coalesce) in enumerate(commands):
+            match = self.LIGHT_STATE_PATH.match(path)
+            if not match:
+                continue
+            try:
+                by_value.setdefault(value, []).append(position)
+            except TypeError:
+                # unhashable value, sent as it is
+                continue
+
+        # position of the first command of a batch -> replacing group command
+        replacements = {}
+        replaced = set()
+        for value, positions in by_value.items():
+            if len(positions) < 2:
+                continue
+            lights = frozenset(self.LIGHT_STATE_PATH.match(commands[position][0]).group(1) for position in positions)
+            group_id = self._group_by_lights.get(lights)
+            if group_id is None:
+                continue
+            logger.debug("sending value %s to group %s instead of lights %s", value, group_id, sorted(lights))
+            coalesce = all(commands[position][2] for position in positions)
+            replacements[positions[0]] = (self.GROUP_ACTION_PATH.format(group_id), value, coalesce)
+            replaced.update(positions)
+
+        if not replacements:
+            return commands
+        result = []
+        for position, command in enumerate(commands):
+            if position in replacements:
+                result.append(replacements[position])
+            elif position not in replaced:
+                result.append(command)
+        return result
+
+    def related_paths(self, path):
+        # a group action changes the state of the group's lights, see CommandQueue's related_paths
+        return self._related_paths.get(path, None) or (path,)
@@ -3,53 +3,124 @@
 
 import logging
 
-from . processor_rule import ProcessorRule
+from topic_trie import TopicTrie
+from . processor_rule import parse_rules
+from . light_group_batcher import LightGroupBatcher
 
 logger = logging.getLogger(__name__)
 
 class MqttToDeconzProcessor(object):
 
-    def __init__(self, rules, mqtt, deconz):
-        self.deconz = deconz
+    def __init__(self, rules, mqtt, deconz=None, light_groups=None):
         self.mqtt = mqtt
+        # gateway name -> (deconz, batcher), rules without a "gateway" send to the first one
+        self._gateways = {}
+        self._default_gateway = None
+        # times matching and extraction per rule if set (see metrics.RuleMetrics)
+        self.rule_metrics = None
+        if deconz is not None:
+            self.add_gateway(None, deconz, light_groups)
         
         self.processor_rules = []
+        self._topic_to_rules = TopicTrie()
         self._parse_rules(rules)
         self._subscribe_to_mqtt()
                 
-    def _parse_rules(self, rules):
-        self.processor_rules = []
-        for rule in rules:
-            logger.debug("attempting to parse {}".format(rule))
-            if rule['type'] == 'mqtt->deconz':                
-                pr = ProcessorRule(rule)
-                self.processor_rules.append(pr)
+    def _parse_rules(self, rules, previous=None):
+        self._swap_rules(self._prepare_rules(rules, previous))
+
+    def _prepare_rules(self, rules, previous=None):
+        processor_rules = parse_rules(rules, 'mqtt->deconz', previous)
+        # source topic filter (may contain + and # wildcards) -> (position, rule)
+        topic_to_rules = TopicTrie()
+        for position, pr in enumerate(processor_rules):
+            source_topic = pr.get_config_value("source-mqtt-topic")
+            topic_to_rules.add(source_topic, (position, pr))
+        return processor_rules, topic_to_rules
+
+    def _swap_rules(self, prepared):
+        # messages see either the old or the new rules
+        self.processor_rules, self._topic_to_rules = prepared
+        
+    def reload(self, rules):
+        # swaps in new rules, unchanged rules are taken over and only the changed topic filters are (un)subscribed
+        self.commit_reload(self.prepare_reload(rules))
+
+    def prepare_reload(self, rules):
+        # parses the new rules without touching the current ones, commit_reload swaps them in
+        return self._prepare_rules(rules, self.processor_rules)
+
+    def commit_reload(self, prepared):
+        subscribed = set(self._topic_to_rules.filters())
+        self._swap_rules(prepared)
+        filters = self._topic_to_rules.filters()
+        for source_topic in filters:
+            if source_topic not in subscribed:
+                logger.debug("subscribing %s", source_topic)
+                self.mqtt.subscribe_to(source_topic, self.process_message)
+        for source_topic in subscribed.difference(filters):
+            logger.debug("unsubscribing %s", source_topic)
+            self.mqtt.unsubscribe_from(source_topic, self.process_message)
+        logger.info("reloaded %s mqtt->deconz rules", len(self.processor_rules))
                 
+    def add_gateway(self, name, deconz, light_groups=None):
+        # group id -> light ids, used to send one group action instead of a command per light
+        self._gateways[name] = (deconz, LightGroupBatcher(light_groups or {}))
+        if len(self._gateways) == 1:
+            self._default_gateway = name
+            
     def _subscribe_to_mqtt(self):
-        for rule in self.processor_rules:
-            source_topic = rule.get_config_value("source-mqtt-topic")
-            logger.debug("subscribing {}".format(source_topic))
+        # one subscription per topic filter, shared by all rules on it
+        for source_topic in self._topic_to_rules.filters():
+            logger.debug("subscribing %s", source_topic)
             self.mqtt.subscribe_to(source_topic, self.process_message)
+            
+    def _rules_for_topic(self, topic):
+        # (rule, captured wildcard segments) in configuration order
+        hits = []
+        for topic_filter, entries, captures in self._topic_to_rules.match(topic):
+            for position, rule in entries:
+                hits.append((position, rule, captures))
+        hits.sort(key=lambda hit: hit[0])
+        return [(rule, captures) for position, rule, captures in hits]
     
     def process_message(self, topic, userdata, message):
-        for rule in self.processor_rules:
-            logger.debug("processing on rule {}".format(rule.get_description()))
-            # first check rule has same topic
-            source_topic = rule.get_config_value("source-mqtt-topic")
-            if source_topic != topic:
-                logger.debug("topic not hit")
-                continue
-            logger.debug("hit topic")
+        rules = self._rules_for_topic(topic)
+        if not rules:
+            logger.debug("no rule for topic %s", topic)
+            return
             
+        # gateway name -> (path, value, coalesce) of all rules hit by the message
+        commands = {}
+        rule_metrics = self.rule_metrics
+        for rule, captures in rules:
+            logger.debug("processing on rule %s", rule.get_description())
             # than check matches
-            if rule.matches(message):
+            if rule.matches(message) if rule_metrics is None else rule_metrics.matches(rule, message):
                 logger.debug("rule hit!")
-                value = rule.get_value(message)
-                logger.debug("value returned was {}".format(value))
+                value = rule.get_value(message) if rule_metrics is None else rule_metrics.get_value(rule, message)
+                logger.debug("value returned was %s", value)
                 
                 # make bool from value
                 value_bool = False
                 if value:
                     value_bool = True
                     
-                self.deconz.send(rule.get_config_value("target-path"), value)
+                try:
+                    target_path = rule.get_target_path(captures)
+                except (IndexError, KeyError, ValueError) as e:
+                    logger.error(f"cannot build target path for topic {topic}, due to {e}.")
+                    continue
+                    
+                # "coalesce": only the latest value is sent if values come faster than deCONZ takes them
+                coalesce = bool(rule.get_config_value("coalesce"))
+                gateway = rule.gateway if rule.gateway is not None else self._default_gateway
+                commands.setdefault(gateway, []).append((target_path, value, coalesce))
+                
+        for gateway, gateway_commands in commands.items():
+            if gateway not in self._gateways:
+                logger.error(f"no deCONZ gateway named {gateway}, dropping commands for topic {topic}.")
+                continue
+            deconz, batcher = self._gateways[gateway]
+            for target_path, value, coalesce in batcher.batch(gateway_commands):
+                deconz.send(target_path, value, coalesce=coalesce)
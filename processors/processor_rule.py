@@ -2,14 +2,35 @@
 # -*- coding: utf-8 -*-
 
 import logging
-import jsonpath
+import json
 import re
 import datetime
 
-from matchers.matchers import parse_matcher
+from matchers.matchers import parse_matcher, rank
+from matchers.compiled_path import compile_path
 
 logger = logging.getLogger(__name__)
 
+def parse_rules(rules, rule_type, previous=None):
+    # the rules of a type, a rule configured exactly like one of the previous rules is taken over instead of parsed again
+    reusable = {}
+    for pr in previous or []:
+        reusable.setdefault(_config_key(pr.config), []).append(pr)
+    processor_rules = []
+    for rule in rules:
+        if rule['type'] != rule_type:
+            continue
+        same = reusable.get(_config_key(rule), None)
+        if same:
+            processor_rules.append(same.pop(0))
+            continue
+        logger.debug("attempting to parse %s", rule)
+        processor_rules.append(ProcessorRule(rule))
+    return processor_rules
+
+def _config_key(config):
+    return json.dumps(config, sort_keys=True, default=str)
+
 class ProcessorRule(object):
 
     ERROR_INVALID_CONFIG_TEXT = "Invalid value configuration"
@@ -22,38 +43,13 @@ class ProcessorRule(object):
         if c1 in config and c2 not in config:
             self._raise_value_error(f'"{c1}" is configured but "{c2}" is not defined.')
     
-    def _raise_error_if_transform_expression_invalid(self):
-        if not self.transform_expression:
-            return
-    
-        valid_types = ['int', 'float']
-        if self.transform_expression in  valid_types:
-            return
-    
-        # divide-by or multiply-by
-        divide_by = False
-        rest = None
-        if self.transform_expression.startswith(self.DIVIDE_BY_):
-            divide_by = True
-            rest = self.transform_expression[len(self.DIVIDE_BY_):]
-        elif self.transform_expression.startswith(self.MULTIPLY_BY_):
-            rest = self.transform_expression[len(self.MULTIPLY_BY_):]
-        else:
-            return # nothing else to validate
-            
-        # check whether rest of type is a number
-        try:
-            float(rest)
-        except ValueError:
-            self._raise_value_error("wrong transform_expression, multiply-by or divide-by invalid")
-    
     def __init__(self, config):
     
         # parsing
         
         # description is optional
         self.description = config.get('description', '')
-        logger.debug("parsing rule with description {}".format(self.description))
+        logger.debug("parsing rule with description %s", self.description)
 
         # either use a static 'value', or use the 3-phase approach:
         # 
@@ -115,15 +111,21 @@ class ProcessorRule(object):
             
             self.transform_type = config.get('transform-type', 'typeconvert')
             self.transform_expression = config.get('transform-expression', None)
-            self._raise_error_if_transform_expression_invalid()
             self.output_type = config.get('output-type', 'stringformat')
             self.output_expression = config.get('output-expression', None)
         
             self.value = None
             
+            if self.extract_type == 'jsonpath':
+                # parse the path once, not on every message
+                self.extract_path = compile_path(self.extract_expression)
+            
             if self.extract_type in ['regex', 'regex_multi']:
                 # precompile regex in case it is a regex expression
                 self.extract_expression_pattern = re.compile(self.extract_expression)
+                
+        # the phases this rule needs, each a callable taking the result of the previous one
+        self._stages = self._compile_stages()
 
         # matchers are optional        
         logger.debug("loading matchers")
@@ -132,10 +134,71 @@ class ProcessorRule(object):
             for matcher_config in config['matchers']:
                 matcher = parse_matcher(matcher_config)
                 self.matchers.append(matcher)
+        # cheap matchers likely to fail run first, matchers have no side effects so the result is the same
+        self.matchers.sort(key=self._matcher_rank)
+        # observed [evaluated, passed] per matcher if the order adapts to the events, see enable_adaptive_order
+        self._matcher_stats = None
+                
+        # publishing options (deconz->mqtt): publish only changed values, numeric changes
+        # within the "deadband" don't count, but publish at least every "max-silence" seconds
+        self.publish_on_change_only = bool(config.get('publish-on-change-only', False))
+        self.deadband = self._get_number_config(config, 'deadband')
+        self.max_silence = self._get_number_config(config, 'max-silence')
+        # mqtt delivery of the published values (deconz->mqtt)
+        self.qos = config.get('qos', 0)
+        if self.qos not in [0, 1, 2] or isinstance(self.qos, bool):
+            self._raise_value_error('"qos" has to be 0, 1 or 2.')
+        self.retain = bool(config.get('retain', False))
+        # name of the deCONZ gateway the rule is limited to, all gateways if not set
+        self.gateway = config.get('gateway', None)
+        # evaluate the rule against the mirrored state of the device instead of the event alone
+        self.merged_state = bool(config.get('merged-state', False))
+        # rate limit of the publishes, per rule or shared by all rules of a "target-mqtt-topic"
+        self.rate_limit = self._get_rate_limit_config(config)
                 
         # store config for later retrival of values
         self.config = config
         
+    def _get_number_config(self, config, key):
+        value = config.get(key, None)
+        if value is None:
+            return None
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            self._raise_value_error(f'"{key}" has to be a positive number.')
+        return value
+        
+    def _get_rate_limit_config(self, config):
+        # "rate-limit": {"min-interval": seconds} or {"rate": per second, "burst": n}
+        # optional "trailing": publish the latest limited value at the end of the window
+        # optional "scope": "rule" (default) or "topic"
+        rate_limit = config.get('rate-limit', None)
+        if rate_limit is None:
+            return None
+        if not isinstance(rate_limit, dict):
+            self._raise_value_error('"rate-limit" has to be an object.')
+        self._raise_error_if_both(rate_limit, 'min-interval', 'rate')
+        self._raise_error_if_both(rate_limit, 'min-interval', 'burst')
+        min_interval = self._get_number_config(rate_limit, 'min-interval')
+        rate = self._get_number_config(rate_limit, 'rate')
+        burst = self._get_number_config(rate_limit, 'burst')
+        if min_interval:
+            rate = 1.0 / min_interval
+        if not rate:
+            self._raise_value_error('"rate-limit" needs a "min-interval" or a "rate" greater than 0.')
+        if burst is None:
+            burst = 1
+        if burst < 1:
+            self._raise_value_error('"burst" has to be at least 1.')
+        scope = rate_limit.get('scope', 'rule')
+        if scope not in ['rule', 'topic']:
+            self._raise_value_error('"scope" has an invalid value.')
+        return {
+            'rate': rate,
+            'burst': burst,
+            'trailing': bool(rate_limit.get('trailing', False)),
+            'scope': scope
+        }
+        
     def _raise_value_error(self, msg):
         raise ValueError(", ".join([self.ERROR_INVALID_CONFIG_TEXT, self._rule_description(), msg]))
         
@@ -144,7 +207,55 @@ class ProcessorRule(object):
             return f"Rule with description \"{self.description}\""
         return ""
         
-    def matches(self, message):
+    def _matcher_rank(self, matcher):
+        if matcher is None:
+            return float('inf')
+        return rank(matcher.cost(), matcher.pass_rate())
+        
+    # observations the estimated pass rate of a matcher counts as when re-ranking
+    PRIOR_WEIGHT = 20
+        
+    def enable_adaptive_order(self, interval=1000):
+        # re-rank the matchers every interval events by the pass rates seen so far
+        self._rerank_interval = interval
+        self._until_rerank = interval
+        self._matcher_stats = [[0, 0] for matcher in self.matchers]
+        
+    def _matches_counting(self, message, context):
+        result = True
+        for matcher, counts in zip(self.matchers, self._matcher_stats):
+            counts[0] += 1
+            if not (matcher.matches(message) if context is None else context.matches(matcher)):
+                result = False
+                break
+            counts[1] += 1
+        self._until_rerank -= 1
+        if self._until_rerank <= 0:
+            self._rerank()
+        return result
+        
+    def _rerank(self):
+        self._until_rerank = self._rerank_interval
+        ranked = []
+        for matcher, (evaluated, passed) in zip(self.matchers, self._matcher_stats):
+            pass_rate = (passed + matcher.pass_rate() * self.PRIOR_WEIGHT) / (evaluated + self.PRIOR_WEIGHT)
+            # halved, so older events count less and the order follows changes
+            ranked.append((rank(matcher.cost(), pass_rate), matcher, [evaluated // 2, passed // 2]))
+        # stable, matchers ranked equal keep their order
+        ranked.sort(key=lambda entry: entry[0])
+        self.matchers = [matcher for r, matcher, counts in ranked]
+        self._matcher_stats = [counts for r, matcher, counts in ranked]
+        
+    def matches(self, message, context=None):
+        # with an EvaluationContext of the message, results are shared with the other rules
+        if self._matcher_stats is not None:
+            return self._matches_counting(message, context)
+        if context is not None:
+            for matcher in self.matchers:
+                if not context.matches(matcher):
+                    logger.debug("single matcher doesn't match - returning quickly")
+                    return False
+            return True
         for matcher in self.matchers:
             if not matcher.matches(message):
                 logger.debug("single matcher doesn't match - returning quickly")
@@ -155,38 +266,48 @@ class ProcessorRule(object):
     DIVIDE_BY_ = "divide-by-"
     MULTIPLY_BY_ = "multiply-by-"
     
-    def _do_transform(self, extract_result):
-        if not extract_result:
-            return extract_result
+    def _compile_stages(self):
+        stages = []
+        extract = self._compile_extract()
+        if extract:
+            stages.append(extract)
+        transform = self._compile_transform()
+        if transform:
+            stages.append(self._skip_empty(transform))
+        if self.output_expression:
+            stages.append(self._skip_empty(self._output))
+        return stages
         
-        if not (self.transform_expression):
-            return extract_result
+    def _skip_empty(self, stage):
+        # transform and output pass empty results on unchanged
+        def skipping_stage(result):
+            if not result:
+                return result
+            return stage(result)
+        return skipping_stage
+        
+    def _compile_extract(self):
+        # phase 1 extract
+        if self.extract_type == 'jsonpath':
+            return self._extract_jsonpath
+        elif self.extract_type == 'regex':
+            return self._extract_regex
+        elif self.extract_type == 'regex_multi':
+            return self._extract_regex_multi
+        return None
+        
+    def _compile_transform(self):
+        # phase 2 transform, the expression is parsed here and not for every value
+        if not self.transform_expression:
+            return None
             
-        # do your transform
         if self.transform_expression == 'int':
-            try:
-                return int(extract_result)
-            except ValueError:
-                logger.error(f"cannot convert {extract_result} into integer")
-                return extract_result
-                
+            return self._transform_int
         if self.transform_expression == 'float':
-            try:
-                return float(extract_result)
-            except ValueError:
-                logger.error(f"cannot convert {extract_result} into float")
-                return extract_result
-                
+            return self._transform_float
         if self.transform_expression == 'localdatetime':
-            try:
-                extract_result_fixed = extract_result.replace('Z', '+00:00')
-                datetime_utc = datetime.datetime.fromisoformat(extract_result_fixed)
-                LOCAL_TIMEZONE = datetime.datetime.now(datetime.timezone.utc).astimezone().tzinfo
-                return datetime_utc.astimezone(LOCAL_TIMEZONE)
-            except ValueError:
-                logger.error(f"cannot convert {extract_result} into datetime")
-                return extract_result
-                
+            return self._transform_localdatetime
+            
         # divide-by or multiply-by
         divide_by = False
         rest = None
@@ -196,26 +317,52 @@ class ProcessorRule(object):
         elif self.transform_expression.startswith(self.MULTIPLY_BY_):
             rest = self.transform_expression[len(self.MULTIPLY_BY_):]
         else:
-            return extract_result
+            return None # nothing to transform
+            
         # check whether rest of type is a number
         try:
             rest_number = float(rest)
-            num = float(extract_result)
-            if divide_by:
-                return num/rest_number
-            else:
-                return num*rest_number
         except ValueError:
-            logger.error(f"error converting to number or calculating with {rest}")
-            return extract_result
-
-    def _do_output(self, transform_result):
-        if not transform_result:
-            return transform_result
+            self._raise_value_error("wrong transform_expression, multiply-by or divide-by invalid")
+            
+        def transform_calculate(extract_result):
+            try:
+                num = float(extract_result)
+                if divide_by:
+                    return num/rest_number
+                else:
+                    return num*rest_number
+            except ValueError:
+                logger.error(f"error converting to number or calculating with {rest}")
+                return extract_result
+        return transform_calculate
         
-        if not (self.output_expression):
-            return transform_result
+    def _transform_int(self, extract_result):
+        try:
+            return int(extract_result)
+        except ValueError:
+            logger.error(f"cannot convert {extract_result} into integer")
+            return extract_result
+            
+    def _transform_float(self, extract_result):
+        try:
+            return float(extract_result)
+        except ValueError:
+            logger.error(f"cannot convert {extract_result} into float")
+            return extract_result
+            
+    def _transform_localdatetime(self, extract_result):
+        try:
+            extract_result_fixed = extract_result.replace('Z', '+00:00')
+            datetime_utc = datetime.datetime.fromisoformat(extract_result_fixed)
+            # without argument the system's local timezone is used, no need to look it up every time
+            return datetime_utc.astimezone()
+        except ValueError:
+            logger.error(f"cannot convert {extract_result} into datetime")
+            return extract_result
 
+    def _output(self, transform_result):
+        # phase 3 output
         try:
             if isinstance(transform_result, list):
                 return self.output_expression.format(*transform_result)
@@ -224,50 +371,57 @@ class ProcessorRule(object):
             logger.error(f"cannot format {transform_result}")
             return transform_result
 
-    def _do_extract(self, message):
-        # phase 1 extract
-        if self.extract_type == 'jsonpath':
-            logger.debug(f"matching jsonpath {self.extract_expression} against message {message}")
-            
-            jsonpath_extract = jsonpath.jsonpath(message, self.extract_expression)
-            return str(jsonpath_extract[0])
-
-        elif self.extract_type == 'regex':
-            logger.debug(f"matching regex {self.extract_expression} against data {message} and return bool whether matches or not")
-            
-            regex_res = self.extract_expression_pattern.match(message)
-            return 'true' if regex_res else 'false'
-            
-        elif self.extract_type == 'regex_multi':
-            logger.debug("matching regex {} against data {} multiple times.".format(self.extract_expression, message))
-            
-            extract_result = self.extract_expression_pattern.findall(message)
-            # ease the use (but make it impossible in situations)
-            # pro: you don't need to define the first array item if there is only one (dont' do {0[0]} but {0} or {} is enough)
-            # con: in case you may get one or many results you won't be able to express anything. TODO make this deactivateable by config
-            if len(extract_result) == 1:
-                extract_result = extract_result[0]
-            return extract_result
-            
-        else:
-            return message
+    def _extract_jsonpath(self, message):
+        logger.debug("matching jsonpath %s against message %s", self.extract_expression, message)
+        
+        jsonpath_extract = self.extract_path.find(message)
+        return str(jsonpath_extract[0])
+        
+    def _extract_regex(self, message):
+        logger.debug("matching regex %s against data %s and return bool whether matches or not", self.extract_expression, message)
+        
+        regex_res = self.extract_expression_pattern.match(message)
+        return 'true' if regex_res else 'false'
+        
+    def _extract_regex_multi(self, message):
+        logger.debug("matching regex %s against data %s multiple times.", self.extract_expression, message)
+        
+        extract_result = self.extract_expression_pattern.findall(message)
+        # ease the use (but make it impossible in situations)
+        # pro: you don't need to define the first array item if there is only one (dont' do {0[0]} but {0} or {} is enough)
+        # con: in case you may get one or many results you won't be able to express anything. TODO make this deactivateable by config
+        if len(extract_result) == 1:
+            extract_result = extract_result[0]
+        return extract_result
 
-    def get_value(self, message):
-        logger.debug(f"calling get_value with {message}")
+    def get_value(self, message, context=None):
+        logger.debug("calling get_value with %s", message)
         
         # if static value defined
         if (self.value):
             return self.value
             
-        # 3-phases approach
-        extract_result = self._do_extract(message)
-        transform_result = self._do_transform(extract_result)
-        output_result = self._do_output(transform_result)
+        # 3-phases approach, only the phases configured for this rule
+        result = message
+        stages = self._stages
+        if context is not None and self.extract_type == 'jsonpath':
+            # the path may be resolved for another rule already
+            result = str(context.find(self.extract_path)[0])
+            stages = stages[1:]
+        for stage in stages:
+            result = stage(result)
 
-        return output_result
+        return result
 
     def get_config_value(self, key):
         return self.config.get(key, '')
         
+    def get_target_path(self, captures=None):
+        # segments captured by + and # of the source topic fill {0}, {1}, ... in the target path
+        target_path = self.get_config_value("target-path")
+        if captures:
+            return target_path.format(*captures)
+        return target_path
+        
     def get_description(self):
         return self.description
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+import collections
+import time
+
+logger = logging.getLogger(__name__)
+
+class PublishCache(object):
+
+    # last published value and time per topic, the least recently used topics are evicted
+
+    def __init__(self, max_size=10000, clock=time.monotonic):
+        self.max_size = max_size
+        self.clock = clock
+        # topic -> (value, time published)
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def is_unchanged(self, topic, value, deadband=None, max_silence=None):
+        # whether publishing the value to the topic can be skipped
+        entry = self._entries.get(topic)
+        if entry is None:
+            return False
+        self._entries.move_to_end(topic)
+        last_value, last_published = entry
+
+        if max_silence is not None and self.clock() - last_published >= max_silence:
+            return False
+        if last_value == value:
+            return True
+        if deadband is None:
+            return False
+        try:
+            return abs(float(value) - float(last_value)) <= deadband
+        except (TypeError, ValueError):
+            return False
+
+    def remember(self, topic, value):
+        self._entries[topic] = (value, self.clock())
+        self._entries.move_to_end(topic)
+        while len(self._entries) > self.max_size:
+            evicted, entry = self._entries.popitem(last=False)
+            logger.debug("evicted topic %s from publish cache", evicted)
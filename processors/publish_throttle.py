@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def _schedule_timer(delay, function):
+    timer = threading.Timer(delay, function)
+    timer.daemon = True
+    timer.start()
+
+class PublishThrottle(object):
+
+    # token bucket limiting the publishes of a rule (or a topic): "rate" publishes per second
+    # with bursts of up to "burst" publishes. a minimum interval is a bucket with rate 1/interval and burst 1.
+    # with "trailing" the latest limited value is published as soon as the bucket allows it again.
+
+    def __init__(self, publish, rate, burst=1, trailing=False, schedule=_schedule_timer, clock=time.monotonic):
+        # called as publish(topic, message, *options)
+        self.publish = publish
+        self.rate = rate
+        self.burst = burst
+        self.trailing = trailing
+        # called as schedule(delay, function) to publish the trailing value later
+        self._schedule = schedule
+        self._clock = clock
+
+        self._tokens = burst
+        self._updated = clock()
+        # (topic, message, options) waiting for the end of the window
+        self._pending = None
+        self._scheduled = False
+        # publishing happens with the lock held, so a trailing value never overtakes a newer one
+        self._lock = threading.Lock()
+
+        # values not published when they came in, and how many of them were published later
+        self.limited = 0
+        self.trailing_published = 0
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _delay(self):
+        # seconds until the next token
+        return (1 - self._tokens) / self.rate
+
+    def submit(self, topic, message, *options):
+        # publishes now if the limit allows it, returns whether it did
+        delay = None
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                # the newer value replaces a trailing one
+                self._pending = None
+                self.publish(topic, message, *options)
+                return True
+
+            self.limited += 1
+            logger.debug("rate limit reached for topic %s", topic)
+            if self.trailing:
+                self._pending = (topic, message, options)
+                if not self._scheduled:
+                    self._scheduled = True
+                    delay = self._delay()
+        if delay is not None:
+            self._schedule(delay, self._publish_pending)
+        return False
+
+    def _publish_pending(self):
+        delay = None
+        with self._lock:
+            self._scheduled = False
+            if self._pending is None:
+                return
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                topic, message, options = self._pending
+                self._pending = None
+                self.trailing_published += 1
+                logger.debug("publishing trailing value to topic %s", topic)
+                self.publish(topic, message, *options)
+                return
+            # woke up too early
+            self._scheduled = True
+            delay = self._delay()
+        self._schedule(delay, self._publish_pending)
+
+    def get_dropped(self):
+        with self._lock:
+            pending = 1 if self._pending is not None else 0
+            return self.limited - self.trailing_published - pending
@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import json
+
+from . processor_rule import ProcessorRule
+from . decision_tree import DecisionTree
+from matchers.evaluation_context import EvaluationContext
+
+class TestDecisionTree(unittest.TestCase):
+
+    def _rule(self, description, matchers):
+        return ProcessorRule({"description": description, "matchers": matchers, "value": "1"})
+
+    def _descriptions(self, rules):
+        return [rule.get_description() for rule in rules]
+
+    def _rules(self):
+        return [
+            self._rule("uniqueid 1", [
+                {"type": "has-key", "key": "$['state'].temperature"},
+                {"type": "keyvalue", "key": "e", "value": "changed"},
+                {"type": "keyvalue", "key": "uniqueid", "value": "1"}
+            ]),
+            self._rule("temperature", [
+                {"type": "has-key", "key": "$['state'].temperature"}
+            ]),
+            self._rule("uniqueid 2", [
+                {"type": "keyvalue", "key": "$.uniqueid", "value": "2"}
+            ]),
+            self._rule("changed", [
+                {"type": "keyvalue", "key": "e", "value": "changed"}
+            ]),
+            self._rule("always", [])
+        ]
+
+    def test_match(self):
+        testee = DecisionTree(self._rules())
+
+        event = json.loads('{"e":"changed","uniqueid":"1","state":{"temperature":2612}}')
+        self.assertEqual(["uniqueid 1", "temperature", "changed", "always"], self._descriptions(testee.match(event)))
+
+        event = json.loads('{"e":"added","uniqueid":"2"}')
+        self.assertEqual(["uniqueid 2", "always"], self._descriptions(testee.match(event)))
+
+        # unhashable values can't equal a compiled value
+        event = json.loads('{"e":"changed","uniqueid":{"nested":"1"}}')
+        self.assertEqual(["changed", "always"], self._descriptions(testee.match(event)))
+
+        self.assertEqual(["always"], self._descriptions(testee.match({})))
+
+    def test_same_as_rules(self):
+        rules = self._rules()
+        testee = DecisionTree(rules)
+        events = [
+            '{"e":"changed","uniqueid":"1","state":{"temperature":2612}}',
+            '{"e":"changed","uniqueid":"1","state":{"humidity":50}}',
+            '{"e":"changed","uniqueid":"2","state":{"temperature":null}}',
+            '{"e":"","uniqueid":"2"}',
+            '{"e":"deleted","uniqueid":"3"}'
+        ]
+        for event in events:
+            message = json.loads(event)
+            expected = [rule for rule in rules if rule.matches(message)]
+            self.assertEqual(self._descriptions(expected), self._descriptions(testee.match(message)), event)
+
+    def test_uncompiled_matchers(self):
+        rules = [
+            self._rule("list value", [
+                {"type": "keyvalue", "key": "uniqueid", "value": ["1"]}
+            ]),
+            self._rule("list value of 2", [
+                {"type": "keyvalue", "key": "r", "value": "sensors"},
+                {"type": "keyvalue", "key": "uniqueid", "value": ["2"]}
+            ])
+        ]
+        testee = DecisionTree(rules)
+        self.assertEqual(["list value"], self._descriptions(testee.match({"uniqueid": ["1"]})))
+        self.assertEqual(["list value of 2"], self._descriptions(testee.match({"r": "sensors", "uniqueid": ["2"]})))
+        self.assertEqual([], self._descriptions(testee.match({"r": "lights", "uniqueid": ["2"]})))
+        self.assertTrue("list value (checks uncompiled matchers)" in testee.dump())
+
+    def test_contradicting_values(self):
+        testee = DecisionTree([
+            self._rule("never", [
+                {"type": "keyvalue", "key": "e", "value": "changed"},
+                {"type": "keyvalue", "key": "$.e", "value": "added"}
+            ])
+        ])
+        self.assertEqual([], testee.match({"e": "changed"}))
+        self.assertEqual([], testee.match({"e": "added"}))
+
+    def test_in_set(self):
+        rules = [
+            self._rule("living room", [
+                {"type": "in-set", "key": "uniqueid", "values": ["1", "2"]},
+                {"type": "gt", "key": "$['state'].temperature", "value": 2000}
+            ]),
+            self._rule("all of 2", [
+                {"type": "all", "matchers": [
+                    {"type": "in-set", "key": "uniqueid", "values": ["2", "3"]},
+                    {"type": "keyvalue", "key": "e", "value": "changed"}
+                ]}
+            ]),
+            self._rule("only 2", [
+                {"type": "in-set", "key": "uniqueid", "values": ["1", "2"]},
+                {"type": "keyvalue", "key": "uniqueid", "value": "2"}
+            ])
+        ]
+        testee = DecisionTree(rules)
+        dump = testee.dump()
+        self.assertTrue("uniqueid == '1':" in dump)
+        self.assertTrue("uniqueid == '3':" in dump)
+        self.assertTrue("living room (checks uncompiled matchers)" in dump)
+
+        event = json.loads('{"e":"changed","uniqueid":"2","state":{"temperature":2612}}')
+        self.assertEqual(["living room", "all of 2", "only 2"], self._descriptions(testee.match(event)))
+        event = json.loads('{"e":"changed","uniqueid":"1","state":{"temperature":1000}}')
+        self.assertEqual([], self._descriptions(testee.match(event)))
+        event = json.loads('{"e":"changed","uniqueid":"3"}')
+        self.assertEqual(["all of 2"], self._descriptions(testee.match(event)))
+
+    def test_selective_first(self):
+        # both fields are tested by one rule, the identifier splits the events the most
+        testee = DecisionTree([
+            self._rule("changed", [
+                {"type": "keyvalue", "key": "e", "value": "changed"}
+            ]),
+            self._rule("uniqueid 1", [
+                {"type": "keyvalue", "key": "uniqueid", "value": "1"}
+            ])
+        ])
+        self.assertEqual("uniqueid == '1':", testee.dump().split("\n")[0])
+
+    def test_matches(self):
+        testee = DecisionTree(self._rules())
+        checked = []
+
+        def matches(rule, message, context):
+            checked.append(rule.get_description())
+            return rule.get_description() != "changed"
+
+        event = json.loads('{"e":"changed","uniqueid":"2"}')
+        context = EvaluationContext(event)
+        self.assertEqual(["uniqueid 2", "always"], self._descriptions(testee.match(context, matches)))
+        # only the rules the walk found
+        self.assertEqual(["uniqueid 2", "changed", "always"], checked)
+
+    def test_dump(self):
+        testee = DecisionTree(self._rules())
+        lines = testee.dump().split("\n")
+        self.assertEqual("-> [4] always", lines[0])
+        self.assertTrue("$.uniqueid == '1':" in lines)
+        self.assertTrue("  e == 'changed':" in lines)
+        self.assertTrue("      -> [0] uniqueid 1" in lines)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,8 +3,10 @@
 
 import unittest
 import json
+import threading
 
 from . deconz_to_mqtt_processor import DeconzToMqttProcessor
+from device_state import DeviceState
 
 class TestMqtt(object):
     
@@ -12,11 +14,17 @@ class TestMqtt(object):
         self.topic = None
         self.msg = None
         self.has_published = None
+        self.count = 0
+        self.qos = None
+        self.retain = None
     
-    def publish(self, topic, msg):
+    def publish(self, topic, msg, qos=0, retain=False):
         self.topic = topic
         self.msg = msg
+        self.qos = qos
+        self.retain = retain
         self.has_published = True
+        self.count += 1
         
     def get_topic(self):
         return self.topic
@@ -178,3 +186,325 @@ class TestDeconzToMqttProcessor(unittest.TestCase):
         testee = DeconzToMqttProcessor(rules, test_mqtt)
         testee.process_message(json.loads('{"e":"changed","state":{"temperature":"22,7"},"uniqueid":"1234"}'))
         self.assertFalse(test_mqtt.get_has_published())
+        
+    def test_publish_on_change_only(self):
+        rules = json.loads('''
+        [
+        {
+            "type": "deconz->mqtt",
+            "description": "Temperature",
+            "matchers": [
+                {
+                    "type": "keyvalue",
+                    "key":	"uniqueid",
+                    "value": "1234"
+                }
+            ],
+            "extract-expression": "$['state'].temperature",
+            "transform-expression": "divide-by-100",
+            "publish-on-change-only": true,
+            "deadband": 0.1,
+            "target-mqtt-topic": "test/Temperature"
+        }
+        ]
+        ''')
+        
+        test_mqtt = TestMqtt()
+        testee = DeconzToMqttProcessor(rules, test_mqtt)
+        for temperature in [2000, 2000, 2005, 2011, 2011]:
+            testee.process_message({"state": {"temperature": temperature}, "uniqueid": "1234"})
+        self.assertEqual(2, test_mqtt.count)
+        self.assertEqual(20.11, test_mqtt.get_msg())
+        self.assertEqual(3, testee.get_stats()['unchanged'])
+        
+        rules[0]["deadband"] = "much"
+        with self.assertRaises(ValueError):
+            DeconzToMqttProcessor(rules, test_mqtt)
+        
+    def test_publish_lock(self):
+        # trailing values of rate limits are published from timer threads, without the rules lock
+        rules = json.loads('''
+        [
+        {
+            "type": "deconz->mqtt",
+            "description": "Temperature",
+            "matchers": [
+                {
+                    "type": "keyvalue",
+                    "key":	"uniqueid",
+                    "value": "1234"
+                }
+            ],
+            "extract-expression": "$['state'].temperature",
+            "publish-on-change-only": true,
+            "target-mqtt-topic": "test/Temperature"
+        }
+        ]
+        ''')
+        
+        test_mqtt = TestMqtt()
+        testee = DeconzToMqttProcessor(rules, test_mqtt)
+        cache = testee._publish_cache
+        locked = []
+        
+        class CheckedCache(object):
+            
+            def is_unchanged(self, *args):
+                locked.append(testee._publish_lock.locked())
+                return cache.is_unchanged(*args)
+                
+            def remember(self, *args):
+                locked.append(testee._publish_lock.locked())
+                return cache.remember(*args)
+                
+            def __len__(self):
+                locked.append(testee._publish_lock.locked())
+                return len(cache)
+        
+        testee._publish_cache = CheckedCache()
+        for temperature in [2000, 2000]:
+            testee.process_message({"state": {"temperature": temperature}, "uniqueid": "1234"})
+        thread = threading.Thread(target=testee._publish, args=("test/Temperature", 2100))
+        thread.start()
+        thread.join()
+        stats = testee.get_stats()
+        
+        self.assertEqual(2, stats['published'])
+        self.assertEqual(1, stats['unchanged'])
+        self.assertEqual(1, stats['cached_topics'])
+        self.assertEqual([True] * 5, locked)
+        
+    def test_adaptive_matcher_order(self):
+        # only rules with matchers the decision tree can't compile are checked one matcher at a time
+        rules = json.loads('''
+        [
+        {
+            "type": "deconz->mqtt",
+            "description": "Compiled",
+            "matchers": [
+                {"type": "keyvalue", "key": "uniqueid", "value": "1234"}
+            ],
+            "extract-expression": "$['state'].temperature",
+            "target-mqtt-topic": "test/Compiled"
+        },
+        {
+            "type": "deconz->mqtt",
+            "description": "Checked after the walk",
+            "matchers": [
+                {"type": "keyvalue", "key": "uniqueid", "value": "1234"},
+                {"type": "gt", "key": "$['state'].temperature", "value": 2000}
+            ],
+            "extract-expression": "$['state'].temperature",
+            "target-mqtt-topic": "test/Checked"
+        }
+        ]
+        ''')
+        
+        test_mqtt = TestMqtt()
+        testee = DeconzToMqttProcessor(rules, test_mqtt, adaptive_matcher_order=True)
+        for temperature in [1000, 3000]:
+            testee.process_message({"state": {"temperature": temperature}, "uniqueid": "1234"})
+        testee.process_message({"state": {"temperature": 3000}, "uniqueid": "5678"})
+        
+        self.assertEqual(3, test_mqtt.count)
+        compiled, checked = testee.processor_rules
+        self.assertEqual([[0, 0]], compiled._matcher_stats)
+        # [evaluated, passed] per matcher, the tree already ruled out the other uniqueid
+        self.assertEqual([[2, 2], [2, 1]], checked._matcher_stats)
+        
+    def test_rate_limit(self):
+        rules = json.loads('''
+        [
+        {
+            "type": "deconz->mqtt",
+            "description": "Power",
+            "matchers": [
+                {
+                    "type": "keyvalue",
+                    "key":	"uniqueid",
+                    "value": "1234"
+                }
+            ],
+            "extract-expression": "$['state'].power",
+            "target-mqtt-topic": "test/Power",
+            "rate-limit": {
+                "min-interval": 60
+            }
+        },
+        {
+            "type": "deconz->mqtt",
+            "description": "Power of the second meter, same topic",
+            "matchers": [
+                {
+                    "type": "keyvalue",
+                    "key":	"uniqueid",
+                    "value": "5678"
+                }
+            ],
+            "extract-expression": "$['state'].power",
+            "target-mqtt-topic": "test/Power",
+            "rate-limit": {
+                "rate": 1,
+                "burst": 2,
+                "scope": "topic"
+            }
+        }
+        ]
+        ''')
+        
+        test_mqtt = TestMqtt()
+        testee = DeconzToMqttProcessor(rules, test_mqtt)
+        for power in [100, 101, 102]:
+            testee.process_message({"state": {"power": power}, "uniqueid": "1234"})
+        self.assertEqual(1, test_mqtt.count)
+        self.assertEqual("100", test_mqtt.get_msg())
+        self.assertEqual(2, testee.get_stats()['rate_limited'])
+        self.assertEqual(2, testee.get_stats()['rate_limit_dropped'])
+        
+        rules[0]["rate-limit"] = {"min-interval": 1, "rate": 2}
+        with self.assertRaises(ValueError):
+            DeconzToMqttProcessor(rules, test_mqtt)
+        rules[0]["rate-limit"] = {"burst": 2}
+        with self.assertRaises(ValueError):
+            DeconzToMqttProcessor(rules, test_mqtt)
+        
+    def test_merged_state(self):
+        rules = json.loads('''
+        [
+        {
+            "type": "deconz->mqtt",
+            "description": "Battery, also when only the state changes",
+            "matchers": [
+                {
+                    "type": "keyvalue",
+                    "key":	"uniqueid",
+                    "value": "1234"
+                }
+            ],
+            "merged-state": true,
+            "extract-expression": "$['config'].battery",
+            "target-mqtt-topic": "test/Battery"
+        }
+        ]
+        ''')
+        
+        device_state = DeviceState()
+        device_state.load(lambda resource: {"5": {"uniqueid": "1234", "state": {"temperature": 2000}, "config": {"battery": 90}}} if resource == "sensors" else {})
+        test_mqtt = TestMqtt()
+        testee = DeconzToMqttProcessor(rules, test_mqtt, device_state=device_state)
+        testee.publish_state()
+        self.assertEqual(1, test_mqtt.count)
+        self.assertEqual("90", test_mqtt.get_msg())
+        
+        testee.process_message({"e": "changed", "r": "sensors", "id": "5", "uniqueid": "1234", "state": {"temperature": 2100}})
+        self.assertEqual(2, test_mqtt.count)
+        self.assertEqual("90", test_mqtt.get_msg())
+        self.assertEqual(2100, device_state.get("sensors", "5")["state"]["temperature"])
+        
+    def test_gateways(self):
+        rules = json.loads('''
+        [
+        {
+            "type": "deconz->mqtt",
+            "description": "Sensor 1 of any gateway",
+            "matchers": [
+                {
+                    "type": "keyvalue",
+                    "key":	"id",
+                    "value": "1"
+                }
+            ],
+            "value": "any",
+            "target-mqtt-topic": "test/Any"
+        },
+        {
+            "type": "deconz->mqtt",
+            "description": "Sensor 1 of the attic gateway",
+            "gateway": "attic",
+            "matchers": [
+                {
+                    "type": "keyvalue",
+                    "key":	"id",
+                    "value": "1"
+                }
+            ],
+            "value": "attic",
+            "target-mqtt-topic": "test/Attic"
+        }
+        ]
+        ''')
+        
+        test_mqtt = TestMqtt()
+        testee = DeconzToMqttProcessor(rules, test_mqtt)
+        testee.process_message({"e": "changed", "r": "sensors", "id": "1"}, "home")
+        self.assertEqual(1, test_mqtt.count)
+        self.assertEqual("test/Any", test_mqtt.get_topic())
+        testee.process_message({"e": "changed", "r": "sensors", "id": "1"}, "attic")
+        self.assertEqual(3, test_mqtt.count)
+        self.assertEqual("test/Attic", test_mqtt.get_topic())
+        
+    def test_qos_retain(self):
+        rules = json.loads('''
+        [
+        {
+            "type": "deconz->mqtt",
+            "description": "Retained alarm",
+            "matchers": [
+                {
+                    "type": "keyvalue",
+                    "key":	"uniqueid",
+                    "value": "1234"
+                }
+            ],
+            "value": "alarm",
+            "qos": 1,
+            "retain": true,
+            "target-mqtt-topic": "test/Alarm"
+        }
+        ]
+        ''')
+        
+        test_mqtt = TestMqtt()
+        testee = DeconzToMqttProcessor(rules, test_mqtt)
+        testee.process_message({"uniqueid": "1234"})
+        self.assertEqual(1, test_mqtt.qos)
+        self.assertTrue(test_mqtt.retain)
+        
+        rules[0]["qos"] = 3
+        with self.assertRaises(ValueError):
+            DeconzToMqttProcessor(rules, test_mqtt)
+        
+    def test_reload(self):
+        rules = json.loads('''
+        [
+        {
+            "type": "deconz->mqtt",
+            "description": "Sensor 1",
+            "matchers": [
+                {
+                    "type": "keyvalue",
+                    "key":	"id",
+                    "value": "1"
+                }
+            ],
+            "value": "one",
+            "target-mqtt-topic": "test/One"
+        }
+        ]
+        ''')
+        
+        test_mqtt = TestMqtt()
+        testee = DeconzToMqttProcessor(rules, test_mqtt)
+        unchanged = testee.processor_rules[0]
+        
+        changed = dict(rules[0], value="1")
+        testee.reload([rules[0], changed])
+        self.assertIs(unchanged, testee.processor_rules[0])
+        self.assertEqual("1", testee.processor_rules[1].value)
+        testee.process_message({"id": "1"})
+        self.assertEqual(2, test_mqtt.count)
+        
+        # invalid rules leave the current ones in place
+        with self.assertRaises(ValueError):
+            testee.reload([dict(rules[0], qos=5)])
+        self.assertEqual(2, len(testee.processor_rules))
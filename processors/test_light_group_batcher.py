@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from . light_group_batcher import LightGroupBatcher
+
+class TestLightGroupBatcher(unittest.TestCase):
+
+    def test_batch(self):
+        testee = LightGroupBatcher({"1": ["1", "2"], "2": ["3", "4", "5"], "3": ["6"]})
+
+        commands = [
+            ("/lights/1/state", "on", False),
+            ("/sensors/1/config", "on", False),
+            ("/lights/2/state", "on", True),
+            ("/lights/3/state", "off", False),
+            ("/lights/4/state", "off", False)
+        ]
+        # lights 3 and 4 are only a part of group 2
+        self.assertEqual([
+            ("/groups/1/action", "on", False),
+            ("/sensors/1/config", "on", False),
+            ("/lights/3/state", "off", False),
+            ("/lights/4/state", "off", False)
+        ], testee.batch(commands))
+
+        commands = [
+            ("/lights/3/state", "on", True),
+            ("/lights/4/state", "on", True),
+            ("/lights/5/state", "on", True)
+        ]
+        self.assertEqual([("/groups/2/action", "on", True)], testee.batch(commands))
+
+    def test_related_paths(self):
+        testee = LightGroupBatcher({"1": ["1", "2"], "3": ["6"]})
+        self.assertEqual({"/groups/1/action", "/lights/1/state", "/lights/2/state"}, set(testee.related_paths("/groups/1/action")))
+        self.assertEqual({"/groups/3/action", "/lights/6/state"}, set(testee.related_paths("/groups/3/action")))
+        self.assertEqual(("/lights/1/state",), testee.related_paths("/lights/1/state"))
+        self.assertEqual(("/groups/2/action",), testee.related_paths("/groups/2/action"))
+
+    def test_different_values(self):
+        testee = LightGroupBatcher({"1": ["1", "2"]})
+        commands = [
+            ("/lights/1/state", "on", False),
+            ("/lights/2/state", "off", False)
+        ]
+        self.assertEqual(commands, testee.batch(commands))
+
+        commands = [
+            ("/lights/1/state", ["on"], False),
+            ("/lights/2/state", ["on"], False)
+        ]
+        self.assertEqual(commands, testee.batch(commands))
+
+    def test_single_light_group(self):
+        testee = LightGroupBatcher({"1": ["1"]})
+        commands = [("/lights/1/state", "on", False)]
+        self.assertEqual(commands, testee.batch(commands))
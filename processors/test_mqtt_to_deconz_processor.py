@@ -21,6 +21,9 @@ class TestMqtt(object):
     
     def subscribe_to(self, topic, clbk):
         self.subscriptions.append(topic)
+        
+    def unsubscribe_from(self, topic, clbk=None):
+        self.subscriptions.remove(topic)
     
     def get_has_subscription_to(self, topic):
         if topic in self.subscriptions:
@@ -37,7 +40,7 @@ class TestDeconzWS(object):
         self.received = {}
         self.msg = None
             
-    def send(self, path, value):
+    def send(self, path, value, coalesce=False):
         self.received[path] = value
         
     def get_has_received(self):
@@ -115,6 +118,154 @@ class TestMqttToDeconzProcessor(unittest.TestCase):
  
         return res
 
+    def test_rules_sharing_topic(self):
+        rules = json.loads('''
+        [
+            {
+                "type": "mqtt->deconz",
+                "description": "Light 1",
+                "source-mqtt-topic": "test/Room",
+                "target-path": "/lights/1/state"
+            },
+            {
+                "type": "mqtt->deconz",
+                "description": "Light 2",
+                "source-mqtt-topic": "test/Room",
+                "target-path": "/lights/2/state"
+            },
+            {
+                "type": "mqtt->deconz",
+                "description": "Other",
+                "source-mqtt-topic": "test/Other",
+                "target-path": "/lights/3/state"
+            }
+        ]
+        ''')
+        test_mqtt = TestMqtt()
+        test_deconz = TestDeconzWS()
+        testee = MqttToDeconzProcessor(rules, test_mqtt, test_deconz)
+        
+        self.assertEqual(["test/Room", "test/Other"], test_mqtt.subscriptions)
+        
+        testee.process_message("test/Room", None, "on")
+        self.assertEqual("on", test_deconz.get_for_path("/lights/1/state"))
+        self.assertEqual("on", test_deconz.get_for_path("/lights/2/state"))
+        self.assertEqual(None, test_deconz.get_for_path("/lights/3/state"))
+        
+        test_deconz.reinit()
+        testee.process_message("test/Unknown", None, "on")
+        self.assertFalse(test_deconz.get_has_received())
+
+    def test_light_group_batching(self):
+        rules = []
+        for light in ["1", "2", "3"]:
+            rules.append({
+                "type": "mqtt->deconz",
+                "description": "Light " + light,
+                "source-mqtt-topic": "test/Room",
+                "target-path": "/lights/" + light + "/state"
+            })
+        test_mqtt = TestMqtt()
+        test_deconz = TestDeconzWS()
+        testee = MqttToDeconzProcessor(rules, test_mqtt, test_deconz, {"7": ["1", "2", "3"], "8": ["1"]})
+        
+        testee.process_message("test/Room", None, "on")
+        self.assertEqual({"/groups/7/action": "on"}, test_deconz.received)
+
+    def test_gateways(self):
+        rules = [{
+            "type": "mqtt->deconz",
+            "description": "Light on the first gateway",
+            "source-mqtt-topic": "test/Light",
+            "target-path": "/lights/1/state"
+        },{
+            "type": "mqtt->deconz",
+            "description": "Light on the attic gateway",
+            "gateway": "attic",
+            "source-mqtt-topic": "test/Light",
+            "target-path": "/lights/2/state"
+        },{
+            "type": "mqtt->deconz",
+            "description": "Light on an unknown gateway",
+            "gateway": "garden",
+            "source-mqtt-topic": "test/Light",
+            "target-path": "/lights/3/state"
+        }]
+        test_mqtt = TestMqtt()
+        test_home = TestDeconzWS()
+        test_attic = TestDeconzWS()
+        testee = MqttToDeconzProcessor(rules, test_mqtt)
+        testee.add_gateway("home", test_home)
+        testee.add_gateway("attic", test_attic)
+        
+        testee.process_message("test/Light", None, "on")
+        self.assertEqual({"/lights/1/state": "on"}, test_home.received)
+        self.assertEqual({"/lights/2/state": "on"}, test_attic.received)
+
+    def test_reload(self):
+        rules = [{
+            "type": "mqtt->deconz",
+            "description": "Light 1",
+            "source-mqtt-topic": "test/Light1",
+            "target-path": "/lights/1/state"
+        },{
+            "type": "mqtt->deconz",
+            "description": "Light 2",
+            "source-mqtt-topic": "test/Light2",
+            "target-path": "/lights/2/state"
+        }]
+        test_mqtt = TestMqtt()
+        test_deconz = TestDeconzWS()
+        testee = MqttToDeconzProcessor(rules, test_mqtt, test_deconz)
+        unchanged = testee.processor_rules[0]
+        
+        testee.reload([rules[0], {
+            "type": "mqtt->deconz",
+            "description": "Light 3",
+            "source-mqtt-topic": "test/Light3",
+            "target-path": "/lights/3/state"
+        }])
+        self.assertIs(unchanged, testee.processor_rules[0])
+        self.assertEqual(["test/Light1", "test/Light3"], test_mqtt.subscriptions)
+        
+        testee.process_message("test/Light3", None, "on")
+        testee.process_message("test/Light2", None, "on")
+        self.assertEqual({"/lights/3/state": "on"}, test_deconz.received)
+
+    def test_wildcard_topic(self):
+        rules = json.loads('''
+        [
+            {
+                "type": "mqtt->deconz",
+                "description": "All lights",
+                "source-mqtt-topic": "home/+/light/set",
+                "target-path": "/lights/{0}/state"
+            },
+            {
+                "type": "mqtt->deconz",
+                "description": "Groups",
+                "source-mqtt-topic": "home/group/#",
+                "target-path": "/groups/{0}/action"
+            }
+        ]
+        ''')
+        test_mqtt = TestMqtt()
+        test_deconz = TestDeconzWS()
+        testee = MqttToDeconzProcessor(rules, test_mqtt, test_deconz)
+        
+        self.assertTrue(test_mqtt.get_has_subscription_to("home/+/light/set"))
+        self.assertTrue(test_mqtt.get_has_subscription_to("home/group/#"))
+        
+        testee.process_message("home/7/light/set", None, "on")
+        self.assertEqual("on", test_deconz.get_for_path("/lights/7/state"))
+        
+        testee.process_message("home/group/3", None, "off")
+        self.assertEqual("off", test_deconz.get_for_path("/groups/3/action"))
+        
+        test_deconz.reinit()
+        testee.process_message("home/7/light", None, "on")
+        self.assertFalse(test_deconz.get_has_received())
+
     def test_transforms(self):
         
         # float transform
@@ -7,7 +7,7 @@ import logging
 import sys
 import datetime
 
-from . deconz_to_mqtt_processor import ProcessorRule
+from . processor_rule import ProcessorRule
 
 logger = logging.getLogger(__name__)
 
@@ -230,3 +230,33 @@ class TestProcessorRule(unittest.TestCase):
         }
         '''))
         self.assertEqual("qwert", testee.get_value("qwert"))
+
+    def test_matcher_order(self):
+        testee = ProcessorRule({
+            "value": "1",
+            "matchers": [
+                {"type": "always"},
+                {"type": "has-key", "key": "$['state'].temperature"},
+                {"type": "keyvalue", "key": "e", "value": "changed"},
+                {"type": "keyvalue", "key": "uniqueid", "value": "1234"}
+            ]
+        })
+        # "e" is "changed" for most events, "always" never fails
+        self.assertEqual(["uniqueid", "$['state'].temperature", "e", None],
+            [getattr(matcher, 'key', None) for matcher in testee.matchers])
+        
+    def test_adaptive_matcher_order(self):
+        testee = ProcessorRule({
+            "value": "1",
+            "matchers": [
+                {"type": "keyvalue", "key": "uniqueid", "value": "1234"},
+                {"type": "keyvalue", "key": "$['state'].buttonevent", "value": 1002}
+            ]
+        })
+        testee.enable_adaptive_order(interval=100)
+        # every event is of the device, few are the button event
+        for i in range(100):
+            self.assertEqual(i % 10 == 0, testee.matches({"uniqueid": "1234", "state": {"buttonevent": 1002 if i % 10 == 0 else 1003}}))
+        self.assertEqual(["$['state'].buttonevent", "uniqueid"], [matcher.key for matcher in testee.matchers])
+        self.assertTrue(testee.matches({"uniqueid": "1234", "state": {"buttonevent": 1002}}))
+        self.assertFalse(testee.matches({"uniqueid": "5678", "state": {"buttonevent": 1002}}))
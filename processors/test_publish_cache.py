@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from . publish_cache import PublishCache
+
+class TestClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestPublishCache(unittest.TestCase):
+
+    def test_unchanged(self):
+        testee = PublishCache()
+        self.assertFalse(testee.is_unchanged("a", "1"))
+        testee.remember("a", "1")
+        self.assertTrue(testee.is_unchanged("a", "1"))
+        self.assertFalse(testee.is_unchanged("a", "2"))
+        self.assertFalse(testee.is_unchanged("b", "1"))
+
+    def test_deadband(self):
+        testee = PublishCache()
+        testee.remember("a", "20.5")
+        self.assertTrue(testee.is_unchanged("a", "20.8", deadband=0.5))
+        self.assertTrue(testee.is_unchanged("a", 21, deadband=0.5))
+        self.assertFalse(testee.is_unchanged("a", "21.1", deadband=0.5))
+        self.assertFalse(testee.is_unchanged("a", "foo", deadband=0.5))
+
+    def test_max_silence(self):
+        clock = TestClock()
+        testee = PublishCache(clock=clock)
+        testee.remember("a", "1")
+        clock.now = 59.0
+        self.assertTrue(testee.is_unchanged("a", "1", max_silence=60))
+        clock.now = 60.0
+        self.assertFalse(testee.is_unchanged("a", "1", max_silence=60))
+
+    def test_lru_eviction(self):
+        testee = PublishCache(max_size=2)
+        testee.remember("a", "1")
+        testee.remember("b", "1")
+        # a is used, so b is the least recently used topic
+        self.assertTrue(testee.is_unchanged("a", "1"))
+        testee.remember("c", "1")
+        self.assertEqual(2, len(testee))
+        self.assertTrue(testee.is_unchanged("a", "1"))
+        self.assertFalse(testee.is_unchanged("b", "1"))
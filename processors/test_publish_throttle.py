@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from . publish_throttle import PublishThrottle
+
+class TestClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestScheduler(object):
+
+    def __init__(self):
+        self.scheduled = []
+
+    def __call__(self, delay, function):
+        self.scheduled.append((delay, function))
+
+    def run(self):
+        scheduled = self.scheduled
+        self.scheduled = []
+        for delay, function in scheduled:
+            function()
+
+class TestPublishThrottle(unittest.TestCase):
+
+    def _create(self, rate, burst=1, trailing=False):
+        self.clock = TestClock()
+        self.scheduler = TestScheduler()
+        self.published = []
+        publish = lambda topic, message: self.published.append((topic, message))
+        return PublishThrottle(publish, rate, burst, trailing, schedule=self.scheduler, clock=self.clock)
+
+    def test_min_interval(self):
+        testee = self._create(rate=1.0)
+        self.assertTrue(testee.submit("t", "1"))
+        self.assertFalse(testee.submit("t", "2"))
+        self.clock.now = 0.5
+        self.assertFalse(testee.submit("t", "3"))
+        self.clock.now = 1.0
+        self.assertTrue(testee.submit("t", "4"))
+        self.assertEqual([("t", "1"), ("t", "4")], self.published)
+        self.assertEqual(2, testee.limited)
+        self.assertEqual(2, testee.get_dropped())
+        self.assertEqual([], self.scheduler.scheduled)
+
+    def test_burst(self):
+        testee = self._create(rate=2.0, burst=3)
+        self.assertEqual([True, True, True, False], [testee.submit("t", str(i)) for i in range(4)])
+        self.clock.now = 0.5
+        self.assertTrue(testee.submit("t", "4"))
+        self.assertFalse(testee.submit("t", "5"))
+
+    def test_trailing(self):
+        testee = self._create(rate=1.0, trailing=True)
+        testee.submit("t", "1")
+        self.clock.now = 0.25
+        testee.submit("t", "2")
+        testee.submit("t", "3")
+        self.assertEqual(1, len(self.scheduler.scheduled))
+        self.assertEqual(0.75, self.scheduler.scheduled[0][0])
+        # "2" was replaced by "3", which is still waiting
+        self.assertEqual(1, testee.get_dropped())
+
+        self.clock.now = 1.0
+        self.scheduler.run()
+        self.assertEqual([("t", "1"), ("t", "3")], self.published)
+        self.assertEqual(1, testee.trailing_published)
+        self.assertEqual(1, testee.get_dropped())
+
+    def test_trailing_replaced_by_newer_value(self):
+        testee = self._create(rate=1.0, trailing=True)
+        testee.submit("t", "1")
+        testee.submit("t", "2")
+        self.clock.now = 1.0
+        self.assertTrue(testee.submit("t", "3"))
+        self.scheduler.run()
+        self.assertEqual([("t", "1"), ("t", "3")], self.published)
+
+    def test_trailing_rescheduled_when_early(self):
+        testee = self._create(rate=1.0, trailing=True)
+        testee.submit("t", "1")
+        testee.submit("t", "2")
+        self.clock.now = 0.5
+        self.scheduler.run()
+        self.assertEqual([("t", "1")], self.published)
+        self.assertEqual(1, len(self.scheduler.scheduled))
+        self.clock.now = 1.0
+        self.scheduler.run()
+        self.assertEqual([("t", "1"), ("t", "2")], self.published)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+from collections import deque
+
+import paho.mqtt.client as mqtt
+
+logger = logging.getLogger(__name__)
+
+class PublishQueue(object):
+
+    # bounded queue of outgoing mqtt messages: they wait here while "max_inflight" QoS 1/2 messages
+    # are not acknowledged by the broker, flush() hands all waiting messages to paho in one go
+
+    def __init__(self, client, max_size=1000, max_inflight=20, clock=time.monotonic):
+        self.client = client
+        self.max_size = max_size
+        self.max_inflight = max_inflight
+        self._clock = clock
+
+        # (topic, payload, qos, retain)
+        self._queue = deque()
+        # QoS 1/2 messages published, but not acknowledged yet
+        self._inflight = 0
+        # mid -> (publish time, qos) until paho reports the message as published
+        self._sent = {}
+        # mid -> time, for messages paho reported before publish() returned
+        self._early = {}
+        self._flushing = False
+        self._flush_requested = False
+        # paho's callbacks come from its network thread, the lock is never held while calling paho
+        self._lock = threading.Lock()
+
+        self._stats = {
+            'queued': 0,
+            'published': 0,
+            'dropped': 0,
+            'failed': 0,
+            'acknowledged': 0,
+            'ack_latency_total': 0.0,
+            'ack_latency_max': 0.0
+        }
+
+    def put(self, topic, payload, qos=0, retain=False):
+        # returns False if the queue is full and the message was dropped
+        with self._lock:
+            if len(self._queue) >= self.max_size:
+                self._stats['dropped'] += 1
+                logger.warning("mqtt publish queue full, dropped message to topic %s", topic)
+                return False
+            self._queue.append((topic, payload, qos, retain))
+            self._stats['queued'] += 1
+            return True
+
+    def _take(self):
+        # the messages allowed to go now, in order
+        batch = []
+        while self._queue:
+            qos = self._queue[0][2]
+            if qos > 0:
+                if self._inflight >= self.max_inflight:
+                    break
+                self._inflight += 1
+            batch.append(self._queue.popleft())
+        return batch
+
+    def flush(self):
+        # publishes the waiting messages, only one flush runs at a time so the order is kept;
+        # a flush asked for meanwhile is done by the running one
+        with self._lock:
+            if self._flushing:
+                self._flush_requested = True
+                return
+            self._flushing = True
+
+        batch = []
+        try:
+            while True:
+                with self._lock:
+                    batch = self._take()
+                    if not batch:
+                        if not self._flush_requested:
+                            self._flushing = False
+                            return
+                        self._flush_requested = False
+                        continue
+                while batch:
+                    topic, payload, qos, retain = batch[0]
+                    self._publish(topic, payload, qos, retain)
+                    batch.pop(0)
+        except BaseException:
+            # the messages not handed to paho wait for the next flush
+            with self._lock:
+                for message in reversed(batch):
+                    self._queue.appendleft(message)
+                    if message[2] > 0:
+                        self._inflight -= 1
+                self._flushing = False
+            raise
+
+    def _publish(self, topic, payload, qos, retain):
+        start = self._clock()
+        try:
+            info = self.client.publish(topic, payload, qos, retain)
+        except Exception as e:
+            # e.g. an invalid topic or payload, the message is lost but the others go out
+            self._failed(topic, qos, e)
+            return
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            self._failed(topic, qos, mqtt.error_string(info.rc))
+            return
+        with self._lock:
+            self._stats['published'] += 1
+            acknowledged = self._early.pop(info.mid, None)
+            if acknowledged is None:
+                self._sent[info.mid] = (start, qos)
+            else:
+                self._acknowledged(acknowledged - start, qos)
+
+    def _failed(self, topic, qos, reason):
+        with self._lock:
+            self._stats['failed'] += 1
+            if qos > 0:
+                self._inflight -= 1
+        logger.error(f"cannot publish to topic {topic}, due to {reason}.")
+
+    def on_publish(self, client, userdata, mid):
+        # paho: sent for QoS 0, acknowledged by the broker for QoS 1/2
+        now = self._clock()
+        with self._lock:
+            sent = self._sent.pop(mid, None)
+            if sent is None:
+                self._early[mid] = now
+                return
+            start, qos = sent
+            released = self._acknowledged(now - start, qos)
+        # QoS 1/2 messages may wait for this acknowledgement
+        if released and self._queue:
+            self.flush()
+
+    def _acknowledged(self, latency, qos):
+        self._stats['acknowledged'] += 1
+        self._stats['ack_latency_total'] += latency
+        self._stats['ack_latency_max'] = max(self._stats['ack_latency_max'], latency)
+        if qos > 0:
+            self._inflight -= 1
+            return True
+        return False
+
+    def __len__(self):
+        return len(self._queue)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['depth'] = len(self._queue)
+            stats['inflight'] = self._inflight
+        stats['ack_latency_avg'] = stats['ack_latency_total'] / stats['acknowledged'] if stats['acknowledged'] else 0.0
+        return stats
@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# replays recorded deCONZ events (debug_file) through the rules of a config.json and
+# reports throughput, per-event latency and per-rule matching/extraction cost, e.g.:
+#
+#   python3 replay_benchmark.py events.txt --config config.json --repeat 10
+
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+
+from event_recorder import read_events
+from processors.deconz_to_mqtt_processor import DeconzToMqttProcessor
+from processors.mqtt_to_deconz_processor import MqttToDeconzProcessor
+
+logger = logging.getLogger(__name__)
+
+class InMemoryMqtt(object):
+
+    # stands in for MQTTConnector, keeps what would have been published
+
+    def __init__(self):
+        self.published = 0
+        self.subscriptions = []
+
+    def publish(self, topic, msg, qos=0, retain=False):
+        self.published += 1
+
+    def subscribe_to(self, topic, callback, overwrite=False):
+        self.subscriptions.append(topic)
+
+class InMemoryDeconz(object):
+
+    # stands in for the deCONZ REST sender
+
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, path, value_str, coalesce=False):
+        self.sent += 1
+
+class RuleCost(object):
+
+    def __init__(self, rule):
+        self.description = rule.get_description()
+        self.checked = 0
+        self.matched = 0
+        self.match_time = 0.0
+        self.extracted = 0
+        self.extract_time = 0.0
+
+    def total_time(self):
+        return self.match_time + self.extract_time
+
+def _instrument(rule, cost):
+    # the processors call rule.matches/rule.get_value, instance attributes take precedence
+    matches = rule.matches
+    get_value = rule.get_value
+
+    def timed_matches(*args, **kwargs):
+        start = time.perf_counter()
+        result = matches(*args, **kwargs)
+        cost.match_time += time.perf_counter() - start
+        cost.checked += 1
+        if result:
+            cost.matched += 1
+        return result
+
+    def timed_get_value(*args, **kwargs):
+        start = time.perf_counter()
+        result = get_value(*args, **kwargs)
+        cost.extract_time += time.perf_counter() - start
+        cost.extracted += 1
+        return result
+
+    rule.matches = timed_matches
+    rule.get_value = timed_get_value
+
+class RuleChecks(object):
+
+    # in place of metrics.RuleMetrics: the processor then checks every rule the decision tree found
+    # with rule.matches, so the instrumented rules count them
+
+    def matches(self, rule, message, context=None):
+        return rule.matches(message, context)
+
+    def get_value(self, rule, message, context=None):
+        return rule.get_value(message, context)
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    # nearest rank
+    rank = max(1, math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def load_events(filename):
+    return [event for timestamp, event in read_events(filename)]
+
+def run_benchmark(rules, events, repeat=1, per_rule=True):
+    mqtt = InMemoryMqtt()
+    d_to_m_proc = DeconzToMqttProcessor(rules, mqtt)
+    # parsed as well to catch rules an upgrade can't parse anymore
+    m_to_d_proc = MqttToDeconzProcessor(rules, mqtt, InMemoryDeconz())
+
+    costs = []
+    if per_rule:
+        for rule in d_to_m_proc.processor_rules:
+            cost = RuleCost(rule)
+            _instrument(rule, cost)
+            costs.append(cost)
+        d_to_m_proc.rule_metrics = RuleChecks()
+
+    latencies = []
+    started = time.perf_counter()
+    for i in range(repeat):
+        for data in events:
+            # same work as the websocket callback in main.py
+            start = time.perf_counter()
+            d_to_m_proc.process_message(json.loads(data))
+            latencies.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'events': len(latencies),
+        'rules': len(d_to_m_proc.processor_rules),
+        'seconds': elapsed,
+        'events_per_second': len(latencies) / elapsed if elapsed else 0.0,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p99': percentile(latencies, 99),
+        'latency_max': latencies[-1] if latencies else 0.0,
+        'published': mqtt.published,
+        'rule_costs': [{
+            'description': cost.description,
+            'checked': cost.checked,
+            'matched': cost.matched,
+            'match_time': cost.match_time,
+            'extracted': cost.extracted,
+            'extract_time': cost.extract_time
+        } for cost in sorted(costs, key=lambda cost: cost.total_time(), reverse=True)]
+    }
+
+def format_report(result, top=20):
+    lines = [
+        "events:       {}".format(result['events']),
+        "rules:        {}".format(result['rules']),
+        "published:    {}".format(result['published']),
+        "duration:     {:.3f} s".format(result['seconds']),
+        "throughput:   {:.0f} events/s".format(result['events_per_second']),
+        "latency p50:  {:.1f} us".format(result['latency_p50'] * 1e6),
+        "latency p99:  {:.1f} us".format(result['latency_p99'] * 1e6),
+        "latency max:  {:.1f} us".format(result['latency_max'] * 1e6)
+    ]
+    if result['rule_costs']:
+        lines.append("")
+        lines.append("{:>10} {:>10} {:>12} {:>10} {:>12}  {}".format("checked", "matched", "match us", "extracted", "extract us", "rule"))
+        for cost in result['rule_costs'][:top]:
+            lines.append("{:>10} {:>10} {:>12.1f} {:>10} {:>12.1f}  {}".format(
+                cost['checked'], cost['matched'], cost['match_time'] * 1e6,
+                cost['extracted'], cost['extract_time'] * 1e6, cost['description']))
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded deCONZ events through the bridge rules.')
+    parser.add_argument('events', help='recorded events (debug_file, may be gzipped)')
+    parser.add_argument('--config', default='config.json', help='config file with the rules (default config.json)')
+    parser.add_argument('--repeat', type=int, default=1, help='replay the events this many times')
+    parser.add_argument('--top', type=int, default=20, help='number of most expensive rules to show')
+    parser.add_argument('--no-per-rule', action='store_true', help='measure without per-rule instrumentation')
+    parser.add_argument('--json', action='store_true', help='print the result as json')
+    parser.add_argument('--dump-tree', action='store_true', help='print the decision tree of the rules and exit')
+    args = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stderr, level=logging.WARNING)
+
+    with open(args.config) as data_file:
+        rules = json.load(data_file)['rules']
+    if args.dump_tree:
+        print(DeconzToMqttProcessor(rules, InMemoryMqtt()).dump_rule_tree())
+        return
+    events = load_events(args.events)
+
+    result = run_benchmark(rules, events, repeat=args.repeat, per_rule=not args.no_per_rule)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(format_report(result, top=args.top))
+
+if __name__ == '__main__':
+    main()
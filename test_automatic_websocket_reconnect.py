@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import asyncio
+
+from automatic_websocket_reconnect import WSClient
+
+class TestWSClientQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.processed = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _callback(self, reply):
+        if reply == 'broken':
+            raise ValueError('cannot parse')
+        self.processed.append(reply)
+
+    def _run(self, testee, replies, wait=0.0):
+        async def run():
+            testee._queue = asyncio.Queue(maxsize=testee.queue_size)
+            for reply in replies:
+                testee._enqueue(reply)
+            # time spent in the queue before the processing starts
+            await asyncio.sleep(wait)
+            processor = asyncio.ensure_future(testee._process_forever())
+            while True:
+                stats = testee.get_stats()
+                if stats['processed'] + stats['failed'] == stats['received'] - stats['dropped']:
+                    break
+                await asyncio.sleep(0.01)
+            processor.cancel()
+            await asyncio.gather(processor, return_exceptions=True)
+        self.loop.run_until_complete(asyncio.wait_for(run(), timeout=5))
+
+    def test_drop_oldest(self):
+        testee = WSClient('ws://localhost', callback=self._callback, queue_size=2)
+        self._run(testee, ['1', '2', '3'])
+        self.assertEqual(['2', '3'], self.processed)
+        stats = testee.get_stats()
+        self.assertEqual(3, stats['received'])
+        self.assertEqual(1, stats['dropped'])
+        self.assertEqual(2, stats['processed'])
+        self.assertEqual(2, stats['max_depth'])
+        self.assertEqual(0, stats['depth'])
+
+    def test_failed(self):
+        # an exception in the callback is counted, the following messages are still processed
+        testee = WSClient('ws://localhost', callback=self._callback)
+        self._run(testee, ['1', 'broken', '2'])
+        self.assertEqual(['1', '2'], self.processed)
+        stats = testee.get_stats()
+        self.assertEqual(2, stats['processed'])
+        self.assertEqual(1, stats['failed'])
+        self.assertEqual(0, stats['dropped'])
+
+    def test_queue_time(self):
+        testee = WSClient('ws://localhost', callback=self._callback)
+        self._run(testee, ['1', '2'], wait=0.05)
+        stats = testee.get_stats()
+        self.assertGreaterEqual(stats['queue_time_max'], 0.05)
+        self.assertGreaterEqual(stats['queue_time_avg'], 0.05)
+        self.assertLessEqual(stats['queue_time_avg'], stats['queue_time_max'])
+
+    def test_process_in_thread(self):
+        testee = WSClient('ws://localhost', callback=self._callback, process_in_thread=True)
+        self._run(testee, ['1', 'broken', '2', '3'])
+        self.assertEqual(['1', '2', '3'], self.processed)
+        stats = testee.get_stats()
+        self.assertEqual(3, stats['processed'])
+        self.assertEqual(1, stats['failed'])
+
+if __name__ == '__main__':
+    unittest.main()
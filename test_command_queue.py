@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import threading
+import time
+
+from command_queue import CommandQueue
+
+class TestSender(object):
+
+    def __init__(self):
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def send(self, path, value):
+        if value == 'fail':
+            raise IOError('failed')
+        with self.lock:
+            self.sent.append((path, value))
+
+class TestCommandQueue(unittest.TestCase):
+
+    def test_send(self):
+        sender = TestSender()
+        testee = CommandQueue(sender.send, workers=3)
+        testee.start()
+        for i in range(10):
+            testee.submit('/lights/1/state', str(i))
+        testee.submit('/lights/2/state', 'fail')
+        self.assertTrue(testee.join(timeout=5))
+        testee.stop()
+
+        # same path keeps its order even with several workers
+        self.assertEqual([str(i) for i in range(10)], [value for path, value in sender.sent])
+        stats = testee.get_stats()
+        self.assertEqual(11, stats['submitted'])
+        self.assertEqual(10, stats['sent'])
+        self.assertEqual(1, stats['failed'])
+        self.assertEqual(0, stats['depth'])
+
+    def test_drop_oldest(self):
+        sender = TestSender()
+        testee = CommandQueue(sender.send, max_depth=2, overflow=CommandQueue.DROP_OLDEST)
+        self.assertTrue(testee.submit('/a', '1'))
+        self.assertTrue(testee.submit('/a', '2'))
+        self.assertTrue(testee.submit('/a', '3'))
+        self.assertEqual(1, testee.get_stats()['dropped'])
+
+        testee.start()
+        self.assertTrue(testee.join(timeout=5))
+        testee.stop()
+        self.assertEqual([('/a', '2'), ('/a', '3')], sender.sent)
+
+    def test_reject(self):
+        sender = TestSender()
+        testee = CommandQueue(sender.send, max_depth=1, overflow=CommandQueue.REJECT)
+        self.assertTrue(testee.submit('/a', '1'))
+        self.assertFalse(testee.submit('/a', '2'))
+        self.assertEqual(1, testee.get_stats()['rejected'])
+        self.assertEqual(1, testee.get_stats()['depth'])
+
+    def test_block(self):
+        sender = TestSender()
+        testee = CommandQueue(sender.send, max_depth=1, overflow=CommandQueue.BLOCK, timeout=0.01)
+        self.assertTrue(testee.submit('/a', '1'))
+        # nobody takes commands out, so a blocked submit gives up after the timeout
+        self.assertFalse(testee.submit('/a', '2'))
+        self.assertEqual(1, testee.get_stats()['rejected'])
+
+    def test_expired(self):
+        sender = TestSender()
+        testee = CommandQueue(sender.send, timeout=0)
+        testee.submit('/a', '1')
+        testee.start()
+        self.assertTrue(testee.join(timeout=5))
+        testee.stop()
+        self.assertEqual([], sender.sent)
+        self.assertEqual(1, testee.get_stats()['expired'])
+
+    def test_coalesce(self):
+        sender = TestSender()
+        testee = CommandQueue(sender.send)
+        testee.submit('/lights/1/state', '1', coalesce=True)
+        testee.submit('/lights/1/state', '2', coalesce=True)
+        testee.submit('/lights/2/state', 'a', coalesce=True)
+        testee.submit('/lights/1/state', '3', coalesce=True)
+        # not coalescing, later values must not overtake it
+        testee.submit('/lights/1/state', '4')
+        testee.submit('/lights/1/state', '5', coalesce=True)
+        testee.submit('/lights/1/state', '6', coalesce=True)
+        self.assertEqual(3, testee.get_stats()['coalesced'])
+        self.assertEqual(4, testee.get_stats()['depth'])
+
+        testee.start()
+        self.assertTrue(testee.join(timeout=5))
+        testee.stop()
+        self.assertEqual(['3', '4', '6'], [value for path, value in sender.sent if path == '/lights/1/state'])
+        self.assertEqual(['a'], [value for path, value in sender.sent if path == '/lights/2/state'])
+
+    def test_related_paths(self):
+        events = []
+        lock = threading.Lock()
+
+        def send(path, value):
+            with lock:
+                events.append(('start', path, value))
+            time.sleep(0.05)
+            with lock:
+                events.append(('end', path, value))
+
+        group = ['/groups/1/action', '/lights/1/state', '/lights/2/state']
+        testee = CommandQueue(send, workers=3, related_paths=lambda path: group if path == group[0] else (path,))
+        testee.submit('/groups/1/action', 'on')
+        testee.submit('/lights/3/state', 'on')
+        testee.submit('/lights/1/state', 'off')
+        testee.start()
+        self.assertTrue(testee.join(timeout=5))
+        testee.stop()
+
+        # the light of the group waits for the group action, the other light doesn't
+        self.assertEqual([('start', '/groups/1/action', 'on'), ('start', '/lights/3/state', 'on')], sorted(events[:2]))
+        self.assertEqual([
+            ('start', '/groups/1/action', 'on'),
+            ('end', '/groups/1/action', 'on'),
+            ('start', '/lights/1/state', 'off'),
+            ('end', '/lights/1/state', 'off')], [event for event in events if event[1] != '/lights/3/state'])
+
+    def test_related_paths_coalesce(self):
+        sender = TestSender()
+        group = ['/groups/1/action', '/lights/1/state', '/lights/2/state']
+        testee = CommandQueue(sender.send, related_paths=lambda path: group if path == group[0] else (path,))
+        testee.submit('/lights/1/state', 'on', coalesce=True)
+        testee.submit('/groups/1/action', 'off', coalesce=True)
+        # must not overtake the group action by merging into the first command
+        testee.submit('/lights/1/state', 'on again', coalesce=True)
+        testee.submit('/groups/1/action', 'off again', coalesce=True)
+        self.assertEqual(0, testee.get_stats()['coalesced'])
+
+        testee.start()
+        self.assertTrue(testee.join(timeout=5))
+        testee.stop()
+        self.assertEqual([
+            ('/lights/1/state', 'on'),
+            ('/groups/1/action', 'off'),
+            ('/lights/1/state', 'on again'),
+            ('/groups/1/action', 'off again')], sender.sent)
+
+    def test_invalid_configuration(self):
+        with self.assertRaises(ValueError):
+            CommandQueue(TestSender().send, overflow='foo')
+        with self.assertRaises(ValueError):
+            CommandQueue(TestSender().send, max_depth=0)
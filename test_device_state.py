@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from device_state import DeviceState
+
+class TestDeviceState(unittest.TestCase):
+
+    def _load(self):
+        testee = DeviceState()
+        resources = {
+            'lights': {'1': {'name': 'Lamp', 'uniqueid': 'l1', 'state': {'on': False, 'bri': 100}}},
+            'sensors': {'5': {'name': 'Aqara', 'uniqueid': 's5', 'state': {'temperature': 2000, 'humidity': 5000}, 'config': {'battery': 90}}},
+            'groups': {}
+        }
+        testee.load(lambda resource: resources[resource])
+        return testee
+
+    def test_load(self):
+        testee = self._load()
+        self.assertEqual(2, len(testee))
+        self.assertEqual('Lamp', testee.get('lights', 1)['name'])
+        self.assertIsNone(testee.get('groups', 1))
+
+    def test_changed(self):
+        testee = self._load()
+        merged = testee.apply({'t': 'event', 'e': 'changed', 'r': 'sensors', 'id': '5', 'uniqueid': 's5', 'state': {'temperature': 2100}})
+        self.assertEqual({'temperature': 2100, 'humidity': 5000}, merged['state'])
+        self.assertEqual({'battery': 90}, merged['config'])
+        self.assertEqual('changed', merged['e'])
+        self.assertEqual(2100, testee.get('sensors', '5')['state']['temperature'])
+        self.assertNotIn('e', testee.get('sensors', '5'))
+
+        merged = testee.apply({'t': 'event', 'e': 'changed', 'r': 'lights', 'id': '1', 'attr': {'name': 'Ceiling'}})
+        self.assertEqual('Ceiling', merged['name'])
+        self.assertEqual({'on': False, 'bri': 100}, merged['state'])
+
+    def test_added_and_deleted(self):
+        testee = self._load()
+        merged = testee.apply({'t': 'event', 'e': 'added', 'r': 'lights', 'id': '2', 'light': {'name': 'New', 'state': {'on': True}}})
+        self.assertEqual('New', merged['name'])
+        self.assertEqual(3, len(testee))
+        self.assertIsNone(testee.apply({'t': 'event', 'e': 'deleted', 'r': 'lights', 'id': '2'}))
+        self.assertIsNone(testee.get('lights', '2'))
+
+    def test_unknown(self):
+        testee = self._load()
+        self.assertIsNone(testee.apply({'t': 'event', 'e': 'changed', 'r': 'scenes', 'id': '1'}))
+        merged = testee.apply({'t': 'event', 'e': 'changed', 'r': 'sensors', 'id': '9', 'state': {'presence': True}})
+        self.assertEqual({'presence': True}, merged['state'])
+
+    def test_events(self):
+        testee = self._load()
+        events = list(testee.events())
+        self.assertEqual(2, len(events))
+        self.assertEqual({'t': 'event', 'e': 'changed', 'r': 'lights', 'id': '1', 'name': 'Lamp', 'uniqueid': 'l1', 'state': {'on': False, 'bri': 100}}, events[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import tempfile
+import gzip
+import os
+
+from event_recorder import EventRecorder, read_events
+
+class TestEventRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "events.txt")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _read(self, filename):
+        with open(filename) as f:
+            return f.read()
+
+    def test_record(self):
+        testee = EventRecorder(self.filename)
+        testee.record('{"e":"changed"}', received=1600000000.5)
+        testee.record('{"e":\r\n"added"}', received=1600000001.0)
+        # nothing written before the flush
+        self.assertFalse(os.path.exists(self.filename))
+        testee.flush()
+        self.assertEqual('1600000000.500 {"e":"changed"}\n1600000001.000 {"e":  "added"}\n', self._read(self.filename))
+        testee.close()
+
+    def test_background_flush(self):
+        testee = EventRecorder(self.filename, flush_interval=60, flush_size=10)
+        testee.start()
+        testee.record('{"e":"changed"}', received=1.0)
+        testee.close()
+        self.assertEqual('1.000 {"e":"changed"}\n', self._read(self.filename))
+
+    def test_rotate_by_size(self):
+        testee = EventRecorder(self.filename, max_bytes=10, backup_count=2)
+        for i in range(4):
+            testee.record('{"i":%d}' % i, received=1.0)
+            testee.flush()
+        testee.close()
+        self.assertEqual('1.000 {"i":3}\n', self._read(self.filename))
+        self.assertEqual('1.000 {"i":2}\n', self._read(self.filename + ".1"))
+        self.assertEqual('1.000 {"i":1}\n', self._read(self.filename + ".2"))
+        self.assertFalse(os.path.exists(self.filename + ".3"))
+
+    def test_rotate_compressed(self):
+        testee = EventRecorder(self.filename, max_bytes=10, compress=True)
+        testee.record('{"i":0}', received=1.0)
+        testee.flush()
+        testee.record('{"i":1}', received=1.0)
+        testee.flush()
+        testee.close()
+        self.assertEqual('1.000 {"i":1}\n', self._read(self.filename))
+        with gzip.open(self.filename + ".1.gz", 'rt') as f:
+            self.assertEqual('1.000 {"i":0}\n', f.read())
+
+    def test_rotate_by_age(self):
+        testee = EventRecorder(self.filename, max_bytes=None, max_age=0.000001)
+        testee.record('{"i":0}', received=1.0)
+        testee.flush()
+        testee.record('{"i":1}', received=1.0)
+        testee.flush()
+        testee.close()
+        self.assertEqual('1.000 {"i":1}\n', self._read(self.filename))
+        self.assertEqual('1.000 {"i":0}\n', self._read(self.filename + ".1"))
+
+    def test_read_events(self):
+        testee = EventRecorder(self.filename, max_bytes=10, compress=True)
+        testee.record('{"i": 0}', received=1.0)
+        testee.flush()
+        testee.record('{"i": 1}', received=2.0)
+        testee.close()
+        self.assertEqual([(1.0, '{"i": 0}')], list(read_events(self.filename + ".1.gz")))
+        self.assertEqual([(2.0, '{"i": 1}')], list(read_events(self.filename)))
+
+        # format written by older versions
+        with open(self.filename, 'w') as f:
+            f.write('{"i": 0}\r\n{"i": 1}\r\n')
+        self.assertEqual([(None, '{"i": 0}'), (None, '{"i": 1}')], list(read_events(self.filename)))
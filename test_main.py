@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import asyncio
+import collections
+import json
+import os
+import re
+import tempfile
+
+import main
+from metrics import Registry
+from processors.deconz_to_mqtt_processor import DeconzToMqttProcessor
+from processors.mqtt_to_deconz_processor import MqttToDeconzProcessor
+
+class TestLoop(object):
+
+    # an event loop without signal handlers, like the one on windows
+
+    def __init__(self):
+        self.tasks = []
+
+    def add_signal_handler(self, sig, callback):
+        raise NotImplementedError()
+
+    def create_task(self, coroutine):
+        self.tasks.append(coroutine)
+
+class TestProcessor(object):
+
+    def __init__(self, error=None):
+        self.error = error
+        self.reloaded = 0
+
+    def prepare_reload(self, rules):
+        if self.error:
+            raise self.error
+        return rules
+
+    def commit_reload(self, prepared):
+        self.reloaded += 1
+
+class TestMqtt(object):
+
+    def __init__(self):
+        self.subscribed = []
+
+    def subscribe_to(self, topic, callback):
+        self.subscribed.append(topic)
+
+    def unsubscribe_from(self, topic, callback):
+        self.subscribed.remove(topic)
+
+class TestReload(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        with open('config.json', 'w') as config_file:
+            json.dump({'rules': []}, config_file)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def test_without_signal_handlers(self):
+        loop = TestLoop()
+        processor = TestProcessor()
+        reload = main.init_reload({'watch_config': 1}, loop, [processor])
+        # config changes are watched instead
+        self.assertEqual(1, len(loop.tasks))
+        loop.tasks[0].close()
+        reload()
+        self.assertEqual(1, processor.reloaded)
+
+    def test_invalid_rules(self):
+        # errors of any kind keep the current rules
+        for error in [re.error('missing )'), AttributeError('upper'), ValueError('no type')]:
+            reload = main.init_reload({}, TestLoop(), [TestProcessor(error)])
+            reload()
+
+    def test_atomic(self):
+        deconz_rule = {"type": "deconz->mqtt", "description": "on", "matchers": [],
+            "extract-type": "jsonpath", "extract-expression": "$['state'].on", "target-mqtt-topic": "Switch/State"}
+        mqtt_rule = {"type": "mqtt->deconz", "description": "switch", "source-mqtt-topic": "Switch/Command",
+            "extract-type": "regex", "extract-expression": "on", "output-expression": "{{ 'on': {} }}",
+            "target-path": "/lights/1/state"}
+        mqtt = TestMqtt()
+        processors = [DeconzToMqttProcessor([deconz_rule], mqtt), MqttToDeconzProcessor([mqtt_rule], mqtt)]
+        current = [list(processor.processor_rules) for processor in processors]
+
+        # the deconz->mqtt rules are fine, but an mqtt->deconz rule is not
+        changed = dict(deconz_rule, description="changed")
+        invalid = dict(mqtt_rule, **{"source-mqtt-topic": "Switch/Other", "extract-expression": "("})
+        with open('config.json', 'w') as config_file:
+            json.dump({'rules': [changed, invalid]}, config_file)
+        main.init_reload({}, TestLoop(), processors)()
+
+        # neither processor took over the new rules
+        self.assertEqual(current, [processor.processor_rules for processor in processors])
+        self.assertEqual(["Switch/Command"], mqtt.subscribed)
+
+        with open('config.json', 'w') as config_file:
+            json.dump({'rules': [changed, dict(mqtt_rule, **{"source-mqtt-topic": "Switch/Other"})]}, config_file)
+        main.init_reload({}, TestLoop(), processors)()
+        self.assertEqual("changed", processors[0].processor_rules[0].get_description())
+        self.assertEqual(["Switch/Other"], mqtt.subscribed)
+
+    def test_watch_file(self):
+        changes = []
+
+        def callback():
+            changes.append(len(changes))
+            if len(changes) == 1:
+                raise re.error('missing )')
+
+        async def watch():
+            watcher = asyncio.ensure_future(main.watch_file('config.json', 0.01, callback))
+            for mtime in [1000, 2000]:
+                await asyncio.sleep(0.05)
+                os.utime('config.json', (mtime, mtime))
+            await asyncio.sleep(0.05)
+            watcher.cancel()
+            await asyncio.gather(watcher, return_exceptions=True)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(watch())
+        finally:
+            loop.close()
+        # still watching after the failed first change
+        self.assertEqual([0, 1], changes)
+
+class TestComponent(object):
+
+    # returns the same value for every stat
+
+    def __init__(self, value):
+        self.value = value
+        self.commands = self
+
+    def get_stats(self):
+        return collections.defaultdict(lambda: self.value)
+
+class TestRegisterMetrics(unittest.TestCase):
+
+    def test_register_metrics(self):
+        registry = Registry()
+        main.register_metrics(registry, TestComponent(1), TestComponent(2), {'attic': TestComponent(3)}, {None: TestComponent(4)})
+        lines = registry.render().splitlines()
+        for line in [
+                'deconz_ws_processed_total{gateway=""} 4',
+                'deconz_ws_queue_time_avg{gateway=""} 4',
+                'deconz_ws_queue_time_max{gateway=""} 4',
+                'deconz_command_coalesced_total{gateway="attic"} 3',
+                'mqtt_publish_inflight 1',
+                'bridge_rate_limited_total 2',
+                'bridge_rate_limit_dropped_total 2']:
+            self.assertIn(line, lines)
+
+if __name__ == '__main__':
+    unittest.main()
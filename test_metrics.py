@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+from urllib.request import urlopen
+from urllib.error import HTTPError
+
+from metrics import Registry, RuleMetrics, MetricsServer
+from processors.processor_rule import ProcessorRule
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter(self):
+        registry = Registry()
+        counter = registry.counter('events_total', 'Events.')
+        counter.inc()
+        counter.inc(2)
+        labelled = registry.counter('errors_total', 'Errors.', ['gateway'])
+        labelled.labels('attic').inc()
+        self.assertEqual('\n'.join([
+            '# HELP events_total Events.',
+            '# TYPE events_total counter',
+            'events_total 3',
+            '# HELP errors_total Errors.',
+            '# TYPE errors_total counter',
+            'errors_total{gateway="attic"} 1',
+            '']), registry.render())
+
+    def test_histogram(self):
+        registry = Registry()
+        histogram = registry.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(5)
+        lines = registry.render().splitlines()
+        self.assertEqual([
+            'latency_seconds_bucket{le="0.1"} 2',
+            'latency_seconds_bucket{le="1"} 2',
+            'latency_seconds_bucket{le="+Inf"} 3',
+            'latency_seconds_sum 5.15',
+            'latency_seconds_count 3'], lines[2:])
+
+    def test_callback(self):
+        registry = Registry()
+        registry.callback('depth', 'Depth.', 'gauge', lambda: 4)
+        registry.callback('received_total', 'Received.', 'counter', lambda: {('a"b',): 1}, ['gateway'])
+        registry.callback('broken', 'Broken.', 'gauge', lambda: 1 / 0)
+        lines = registry.render().splitlines()
+        self.assertIn('depth 4', lines)
+        self.assertIn('received_total{gateway="a\\"b"} 1', lines)
+        self.assertIn('# TYPE broken gauge', lines)
+
+    def test_rule_metrics(self):
+        registry = Registry()
+        testee = RuleMetrics(registry, 'test')
+        rule = ProcessorRule({"description": "Rule", "matchers": [{"type": "keyvalue", "key": "id", "value": "1"}], "value": "on"})
+        self.assertTrue(testee.matches(rule, {"id": "1"}))
+        self.assertEqual("on", testee.get_value(rule, {"id": "1"}))
+        lines = registry.render().splitlines()
+        self.assertIn('test_rule_match_seconds_count{rule="Rule"} 1', lines)
+        self.assertIn('test_rule_value_seconds_count{rule="Rule"} 1', lines)
+
+    def test_server(self):
+        registry = Registry()
+        registry.counter('events_total', 'Events.').inc()
+        server = MetricsServer(registry, port=0)
+        server.start()
+        try:
+            body = urlopen('http://127.0.0.1:{}/metrics'.format(server.port)).read().decode('utf-8')
+            self.assertIn('events_total 1', body)
+            with self.assertRaises(HTTPError):
+                urlopen('http://127.0.0.1:{}/other'.format(server.port))
+        finally:
+            server.stop()
+
+if __name__ == '__main__':
+    unittest.main()
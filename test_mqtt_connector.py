@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import asyncio
+import struct
+import warnings
+import threading
+from unittest import mock
+
+from mqtt_connector import AsyncioMQTTConnector
+
+CONNECT = 0x10
+PUBLISH = 0x30
+SUBSCRIBE = 0x80
+PINGREQ = 0xC0
+
+async def _read_packet(reader):
+    header = (await reader.readexactly(1))[0]
+    length = 0
+    multiplier = 1
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        multiplier *= 128
+        if not byte & 0x80:
+            break
+    return header, await reader.readexactly(length)
+
+def _publish_packet(topic, payload):
+    topic = topic.encode('utf-8')
+    body = struct.pack('!H', len(topic)) + topic + payload.encode('utf-8')
+    return bytes([PUBLISH, len(body)]) + body
+
+class TestBroker(object):
+
+    # just enough of an mqtt broker: accepts a connection, acknowledges subscriptions
+    # and keeps the publishes it receives
+
+    def __init__(self):
+        self.published = asyncio.Queue()
+        self.subscribed = asyncio.Queue()
+        self.writer = None
+
+    async def handle(self, reader, writer):
+        self.writer = writer
+        while True:
+            try:
+                header, body = await _read_packet(reader)
+            except asyncio.IncompleteReadError:
+                return
+            kind = header & 0xF0
+            if kind == CONNECT:
+                writer.write(bytes([0x20, 2, 0, 0]))
+            elif kind == SUBSCRIBE:
+                length = struct.unpack('!H', body[2:4])[0]
+                writer.write(bytes([0x90, 3]) + body[:2] + bytes([0]))
+                await self.subscribed.put(body[4:4 + length].decode('utf-8'))
+            elif kind == PUBLISH:
+                length = struct.unpack('!H', body[:2])[0]
+                await self.published.put((body[2:2 + length].decode('utf-8'), body[2 + length:].decode('utf-8')))
+            elif kind == PINGREQ:
+                writer.write(bytes([0xD0, 0]))
+            await writer.drain()
+
+class TestAsyncioMQTTConnector(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.broker = TestBroker()
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.broker.handle, '127.0.0.1', 0))
+        port = self.server.sockets[0].getsockname()[1]
+        with warnings.catch_warnings():
+            # paho warns about its version 1 callback api, which MQTTConnector uses
+            warnings.simplefilter('ignore', DeprecationWarning)
+            self.testee = AsyncioMQTTConnector('127.0.0.1', port, self.loop)
+        self.testee.start()
+
+    def tearDown(self):
+        self.testee.client.disconnect()
+        self.testee._misc.cancel()
+        self.server.close()
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.loop.close()
+
+    def _wait_for(self, queue):
+        return self.loop.run_until_complete(asyncio.wait_for(queue.get(), timeout=5))
+
+    def test_publish(self):
+        self.testee.publish('test/Topic', '42')
+        self.assertEqual(('test/Topic', '42'), self._wait_for(self.broker.published))
+
+    def test_publish_from_thread(self):
+        thread = threading.Thread(target=self.testee.publish, args=('test/Thread', 'on'))
+        thread.start()
+        thread.join()
+        self.assertEqual(('test/Thread', 'on'), self._wait_for(self.broker.published))
+
+    def test_subscribe(self):
+        received = asyncio.Queue()
+        self.testee.subscribe_to('test/+', lambda topic, userdata, message: received.put_nowait((topic, message)))
+        self.assertEqual('test/+', self._wait_for(self.broker.subscribed))
+
+        self.broker.writer.write(_publish_packet('test/Light', 'on'))
+        self.assertEqual(('test/Light', 'on'), self._wait_for(received))
+
+class TestSupports(unittest.TestCase):
+
+    def test_supports(self):
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertTrue(AsyncioMQTTConnector.supports(loop))
+            # the proactor event loop of windows has no add_reader/add_writer
+            with mock.patch.object(asyncio, 'ProactorEventLoop', type(loop), create=True):
+                self.assertFalse(AsyncioMQTTConnector.supports(loop))
+        finally:
+            loop.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import paho.mqtt.client as mqtt
+
+from publish_queue import PublishQueue
+
+class TestClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestInfo(object):
+
+    def __init__(self, rc, mid):
+        self.rc = rc
+        self.mid = mid
+
+class TestClient(object):
+
+    def __init__(self):
+        self.published = []
+        self.rc = mqtt.MQTT_ERR_SUCCESS
+        # called from within publish, like paho's network thread may for QoS 0
+        self.on_publish = None
+
+    def publish(self, topic, payload, qos, retain):
+        self.published.append((topic, payload, qos, retain))
+        mid = len(self.published)
+        if self.on_publish and qos == 0:
+            self.on_publish(self, None, mid)
+        return TestInfo(self.rc, mid)
+
+class TestPublishQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = TestClock()
+        self.client = TestClient()
+
+    def test_flush(self):
+        testee = PublishQueue(self.client, clock=self.clock)
+        testee.put("a", "1")
+        testee.put("b", "2", 1, True)
+        self.assertEqual([], self.client.published)
+        testee.flush()
+        self.assertEqual([("a", "1", 0, False), ("b", "2", 1, True)], self.client.published)
+        self.assertEqual(1, testee.get_stats()['inflight'])
+
+    def test_max_size(self):
+        testee = PublishQueue(self.client, max_size=2)
+        self.assertTrue(testee.put("a", "1"))
+        self.assertTrue(testee.put("a", "2"))
+        self.assertFalse(testee.put("a", "3"))
+        self.assertEqual(1, testee.get_stats()['dropped'])
+        self.assertEqual(2, len(testee))
+
+    def test_max_inflight(self):
+        testee = PublishQueue(self.client, max_inflight=2, clock=self.clock)
+        for i in range(4):
+            testee.put("a", str(i), 1)
+        testee.flush()
+        self.assertEqual(2, len(self.client.published))
+        self.assertEqual(2, len(testee))
+
+        # the acknowledgement lets the next message go
+        self.clock.now = 0.5
+        testee.on_publish(self.client, None, 1)
+        self.assertEqual(3, len(self.client.published))
+        stats = testee.get_stats()
+        self.assertEqual(1, stats['acknowledged'])
+        self.assertEqual(0.5, stats['ack_latency_max'])
+        self.assertEqual(2, stats['inflight'])
+
+    def test_acknowledged_during_publish(self):
+        self.client.on_publish = lambda client, userdata, mid: testee.on_publish(client, userdata, mid)
+        testee = PublishQueue(self.client, clock=self.clock)
+        testee.put("a", "1")
+        testee.flush()
+        stats = testee.get_stats()
+        self.assertEqual(1, stats['acknowledged'])
+        self.assertEqual(0.0, stats['ack_latency_avg'])
+
+    def test_failed(self):
+        self.client.rc = mqtt.MQTT_ERR_NO_CONN
+        testee = PublishQueue(self.client)
+        testee.put("a", "1", 2)
+        testee.flush()
+        stats = testee.get_stats()
+        self.assertEqual(1, stats['failed'])
+        self.assertEqual(0, stats['inflight'])
+
+    def test_publish_raises(self):
+        publish = self.client.publish
+
+        def raise_once(topic, payload, qos, retain):
+            self.client.publish = publish
+            raise ValueError("Invalid topic.")
+
+        self.client.publish = raise_once
+        testee = PublishQueue(self.client, max_inflight=1)
+        testee.put("a", "1", 1)
+        testee.put("b", "2", 1)
+        testee.flush()
+        # the message after the failed one still goes out, in the slot given back
+        self.assertEqual([("b", "2", 1, False)], self.client.published)
+        stats = testee.get_stats()
+        self.assertEqual(1, stats['failed'])
+        self.assertEqual(1, stats['published'])
+        self.assertEqual(1, stats['inflight'])
+
+        # later flushes are not blocked
+        testee.on_publish(self.client, None, 1)
+        testee.put("c", "3")
+        testee.flush()
+        self.assertEqual(("c", "3", 0, False), self.client.published[-1])
+
+    def test_flush_interrupted(self):
+        testee = PublishQueue(self.client)
+
+        def interrupt(topic, payload, qos, retain):
+            raise KeyboardInterrupt()
+
+        self.client.publish = interrupt
+        testee.put("a", "1", 1)
+        testee.put("b", "2")
+        with self.assertRaises(KeyboardInterrupt):
+            testee.flush()
+        # the messages wait for the next flush, the inflight slot is given back
+        self.assertEqual(2, len(testee))
+        self.assertEqual(0, testee.get_stats()['inflight'])
+
+        del self.client.publish
+        testee.flush()
+        self.assertEqual([("a", "1", 1, False), ("b", "2", 0, False)], self.client.published)
+
+if __name__ == '__main__':
+    unittest.main()
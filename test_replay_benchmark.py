@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import json
+
+from replay_benchmark import run_benchmark, format_report, percentile
+
+class TestReplayBenchmark(unittest.TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, percentile(values, 50))
+        self.assertEqual(99, percentile(values, 99))
+        self.assertEqual(100, percentile(values, 100))
+        self.assertEqual(1, percentile(values, 0))
+        self.assertEqual(0.0, percentile([], 50))
+
+    def test_run_benchmark(self):
+        rules = json.loads('''
+        [
+        {
+            "type": "deconz->mqtt",
+            "description": "Temperature",
+            "matchers": [
+                {"type": "has-key", "key": "$['state'].temperature"},
+                {"type": "keyvalue", "key": "uniqueid", "value": "1234"}
+            ],
+            "extract-expression": "$['state'].temperature",
+            "target-mqtt-topic": "test/Temperature"
+        },
+        {
+            "type": "mqtt->deconz",
+            "description": "Switch",
+            "source-mqtt-topic": "test/Switch",
+            "target-path": "/lights/1/state"
+        }
+        ]
+        ''')
+        events = [
+            '{"e":"changed","uniqueid":"1234","state":{"temperature":2612}}',
+            '{"e":"changed","uniqueid":"5678","state":{"temperature":2612}}'
+        ]
+        result = run_benchmark(rules, events, repeat=3)
+        self.assertEqual(6, result['events'])
+        self.assertEqual(1, result['rules'])
+        self.assertEqual(3, result['published'])
+        self.assertEqual(1, len(result['rule_costs']))
+        self.assertEqual(3, result['rule_costs'][0]['checked'])
+        self.assertEqual(3, result['rule_costs'][0]['matched'])
+        self.assertEqual(3, result['rule_costs'][0]['extracted'])
+        self.assertTrue("Temperature" in format_report(result))
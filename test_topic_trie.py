@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from topic_trie import TopicTrie
+
+class TestTopicTrie(unittest.TestCase):
+
+    def _matched(self, trie, topic):
+        return sorted((topic_filter, values, captures) for topic_filter, values, captures in trie.match(topic))
+
+    def test_exact(self):
+        testee = TopicTrie()
+        self.assertTrue(testee.add("home/light/set", 1))
+        self.assertFalse(testee.add("home/light/set", 2))
+
+        self.assertEqual([("home/light/set", [1, 2], [])], self._matched(testee, "home/light/set"))
+        self.assertEqual([], self._matched(testee, "home/light"))
+        self.assertEqual([], self._matched(testee, "home/light/set/more"))
+
+    def test_wildcards(self):
+        testee = TopicTrie()
+        testee.add("home/+/light/set", "single")
+        testee.add("home/#", "multi")
+        testee.add("#", "all")
+        testee.add("home/kitchen/light/set", "exact")
+
+        self.assertEqual([
+            ("#", ["all"], ["home/kitchen/light/set"]),
+            ("home/#", ["multi"], ["kitchen/light/set"]),
+            ("home/+/light/set", ["single"], ["kitchen"]),
+            ("home/kitchen/light/set", ["exact"], [])
+        ], self._matched(testee, "home/kitchen/light/set"))
+
+        # '#' matches the parent level as well
+        self.assertEqual([
+            ("#", ["all"], ["home"]),
+            ("home/#", ["multi"], [""])
+        ], self._matched(testee, "home"))
+
+        # no wildcard match on the first level of $ topics
+        self.assertEqual([], self._matched(testee, "$SYS/broker"))
+
+    def test_remove(self):
+        testee = TopicTrie()
+        testee.add("home/+/set", 1)
+        testee.add("home/+/set", 2)
+        testee.add("home/+/set/deeper", 3)
+
+        self.assertFalse(testee.remove("home/+/set", 1))
+        self.assertEqual([("home/+/set", [2], ["a"])], self._matched(testee, "home/a/set"))
+        self.assertTrue(testee.remove("home/+/set"))
+        self.assertEqual([], self._matched(testee, "home/a/set"))
+        self.assertEqual(["home/+/set/deeper"], testee.filters())
+        self.assertFalse(testee.remove("unknown"))
+
+    def test_invalid_filters(self):
+        testee = TopicTrie()
+        for topic_filter in ["", "home/#/set", "home/a#", "home/a+/set"]:
+            with self.assertRaises(ValueError):
+                testee.add(topic_filter, 1)
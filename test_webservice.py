@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.error import HTTPError
+
+from webservice import KeepAliveClient
+
+class TestServer(object):
+
+    # keeps connections alive, but drops them after "timeout" idle seconds like deCONZ does
+
+    def __init__(self, timeout=0.2):
+        self.connections = 0
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1'
+
+            def setup(handler):
+                handler.timeout = timeout
+                server.connections += 1
+                super().setup()
+
+            def _respond(handler):
+                length = int(handler.headers.get('Content-Length', 0))
+                server.requests.append((handler.command, handler.path, handler.rfile.read(length).decode('utf-8')))
+                if handler.path.endswith('/missing'):
+                    handler.send_error(404)
+                    return
+                body = b'[{"success": true}]'
+                handler.send_response(200)
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            do_GET = _respond
+            do_PUT = _respond
+
+            def log_message(handler, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}/api/key'.format(self._server.server_address[1])
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+class TestKeepAliveClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TestServer()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_reuse(self):
+        testee = KeepAliveClient(self.server.url)
+        self.assertEqual(b'[{"success": true}]', testee.put('/lights/1/state', '{"on": true}'))
+        self.assertEqual(b'[{"success": true}]', testee.get('/lights'))
+        self.assertEqual(1, self.server.connections)
+        self.assertEqual([
+            ('PUT', '/api/key/lights/1/state', '{"on": true}'),
+            ('GET', '/api/key/lights', '')], self.server.requests)
+        testee.close()
+
+    def test_reconnect_stale(self):
+        testee = KeepAliveClient(self.server.url)
+        testee.get('/lights')
+        # the server drops the idle connection, the client still has it in its pool
+        time.sleep(0.5)
+        self.assertEqual(b'[{"success": true}]', testee.get('/lights'))
+        self.assertEqual(2, self.server.connections)
+        self.assertEqual(2, len(self.server.requests))
+        testee.close()
+
+    def test_max_idle(self):
+        testee = KeepAliveClient(self.server.url, max_idle=0)
+        testee.get('/lights')
+        testee.get('/lights')
+        # closed instead of reused
+        self.assertEqual(2, self.server.connections)
+        testee.close()
+
+    def test_http_error(self):
+        testee = KeepAliveClient(self.server.url)
+        with self.assertRaises(HTTPError) as context:
+            testee.get('/missing')
+        self.assertEqual(404, context.exception.code)
+        self.assertEqual(self.server.url + '/missing', context.exception.url)
+        # the client keeps working after an error response
+        self.assertEqual(b'[{"success": true}]', testee.get('/lights'))
+        testee.close()
+
+if __name__ == '__main__':
+    unittest.main()
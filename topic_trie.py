@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+SINGLE_LEVEL_WILDCARD = '+'
+MULTI_LEVEL_WILDCARD = '#'
+
+class _Node(object):
+
+    def __init__(self):
+        self.children = {}
+        self.values = []
+        self.topic_filter = None
+
+class TopicTrie(object):
+
+    # maps MQTT topic filters (with + and # wildcards) to values,
+    # matching a topic costs O(topic depth) instead of a scan over all filters
+
+    def __init__(self):
+        self._root = _Node()
+        # topic filter -> node, in insertion order
+        self._filters = {}
+
+    def _validate(self, topic_filter):
+        if not topic_filter:
+            raise ValueError('empty topic filter')
+        levels = topic_filter.split('/')
+        for i, level in enumerate(levels):
+            if MULTI_LEVEL_WILDCARD in level and (level != MULTI_LEVEL_WILDCARD or i != len(levels) - 1):
+                raise ValueError('invalid use of {} in topic filter {}'.format(MULTI_LEVEL_WILDCARD, topic_filter))
+            if SINGLE_LEVEL_WILDCARD in level and level != SINGLE_LEVEL_WILDCARD:
+                raise ValueError('invalid use of {} in topic filter {}'.format(SINGLE_LEVEL_WILDCARD, topic_filter))
+        return levels
+
+    def add(self, topic_filter, value):
+        # returns True if the topic filter was not known before
+        levels = self._validate(topic_filter)
+        is_new = topic_filter not in self._filters
+        node = self._root
+        for level in levels:
+            node = node.children.setdefault(level, _Node())
+        node.values.append(value)
+        node.topic_filter = topic_filter
+        self._filters[topic_filter] = node
+        return is_new
+
+    def remove(self, topic_filter, value=None):
+        # removes one value (or all if None), returns True if the topic filter is gone afterwards
+        node = self._filters.get(topic_filter)
+        if node is None:
+            return False
+        if value is None:
+            node.values = []
+        elif value in node.values:
+            node.values.remove(value)
+        if node.values:
+            return False
+        self._filters.pop(topic_filter)
+        self._prune(topic_filter.split('/'))
+        return True
+
+    def _prune(self, levels):
+        # drop nodes that neither carry values nor lead to any
+        path = [self._root]
+        for level in levels:
+            path.append(path[-1].children[level])
+        for i in range(len(levels), 0, -1):
+            node = path[i]
+            if node.values or node.children:
+                break
+            del path[i - 1].children[levels[i - 1]]
+
+    def get(self, topic_filter):
+        node = self._filters.get(topic_filter)
+        if node is None:
+            return []
+        return list(node.values)
+
+    def __contains__(self, topic_filter):
+        return topic_filter in self._filters
+
+    def __len__(self):
+        return len(self._filters)
+
+    def filters(self):
+        return list(self._filters)
+
+    def match(self, topic):
+        # returns a list of (topic filter, values, captures) for every filter matching the topic,
+        # captures holds the levels matched by + and the remainder matched by # (joined by /)
+        levels = topic.split('/')
+        # topics starting with $ are not matched by a wildcard on the first level
+        system_topic = topic.startswith('$')
+        result = []
+        # stack of (node, level index, captures)
+        stack = [(self._root, 0, [])]
+        while stack:
+            node, i, captures = stack.pop()
+            wildcards_allowed = i > 0 or not system_topic
+
+            multi = node.children.get(MULTI_LEVEL_WILDCARD)
+            if multi is not None and multi.values and wildcards_allowed:
+                # '#' also matches the parent level, e.g. a/# matches a
+                result.append((multi.topic_filter, list(multi.values), captures + ['/'.join(levels[i:])]))
+
+            if i == len(levels):
+                if node.values:
+                    result.append((node.topic_filter, list(node.values), captures))
+                continue
+
+            level = levels[i]
+            single = node.children.get(SINGLE_LEVEL_WILDCARD)
+            if single is not None and wildcards_allowed:
+                stack.append((single, i + 1, captures + [level]))
+            child = node.children.get(level)
+            if child is not None:
+                stack.append((child, i + 1, captures))
+        return result
@@ -2,9 +2,18 @@
 # -*- coding: utf-8 -*-
 
 from urllib.request import urlopen, build_opener, HTTPHandler, Request
+from urllib.parse import urlsplit
+from urllib.error import HTTPError
+import http.client
+import threading
+import logging
+import queue
+import time
 import json
 import datetime
 
+logger = logging.getLogger(__name__)
+
 def get_value_from(url):
     # need to have this header all other headers are ignored!
     req = Request(url)
@@ -31,4 +40,97 @@ def _params_from_value(value):
         time_string = value.strftime("%Y-%m-%dT%H:%M:%S")
         return time_string.encode('utf-8')
     else:
-        return value.encode('utf-8')
\ No newline at end of file
+        return value.encode('utf-8')
+
+class KeepAliveClient(object):
+
+    # keeps a pool of persistent HTTP/1.1 connections to one server,
+    # so repeated requests don't pay for a TCP handshake each time
+
+    # errors of a reused connection the server already closed, the request is retried once
+    STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest, ConnectionError)
+
+    def __init__(self, base_url, pool_size=4, timeout=10, max_idle=30):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError('unsupported url {}'.format(base_url))
+        self.base_url = base_url.rstrip('/')
+        self._connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self._host = parts.hostname
+        self._port = parts.port
+        self._base_path = parts.path.rstrip('/')
+        self.timeout = timeout
+        # idle connections older than this are closed instead of reused
+        self.max_idle = max_idle
+        # limits the connections open at the same time
+        self._slots = threading.BoundedSemaphore(pool_size)
+        # idle connections as (connection, last used), most recently used first
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+
+    def _acquire(self):
+        while True:
+            try:
+                connection, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connection_class(self._host, self._port, timeout=self.timeout), False
+            if time.monotonic() - last_used < self.max_idle:
+                return connection, True
+            connection.close()
+
+    def _release(self, connection):
+        try:
+            self._idle.put_nowait((connection, time.monotonic()))
+        except queue.Full:
+            connection.close()
+
+    def request(self, method, path, body=None, headers=None):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError('no free connection to {}'.format(self.base_url))
+        try:
+            return self._request(method, path, body, headers)
+        finally:
+            self._slots.release()
+
+    def _request(self, method, path, body, headers):
+        url = self._base_path + path
+        while True:
+            connection, reused = self._acquire()
+            try:
+                connection.request(method, url, body, headers or {})
+                response = connection.getresponse()
+                data = response.read()
+            except self.STALE_CONNECTION_ERRORS as e:
+                connection.close()
+                if not reused:
+                    raise
+                # the server closed the kept-alive socket, retry on a fresh connection
+                logger.debug("stale connection to %s (%s), reconnecting", self.base_url, e)
+                continue
+            except Exception:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(connection)
+
+            if response.status >= 400:
+                raise HTTPError(self.base_url + path, response.status, response.reason, response.headers, None)
+            return data
+
+    def get(self, path):
+        return self.request('GET', path)
+
+    def put(self, path, value):
+        # need to have this header all other headers are ignored!
+        header = {"Content-Type":"text/plain"}
+        return self.request('PUT', path, _params_from_value(value), header)
+
+    def close(self):
+        while True:
+            try:
+                connection, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            connection.close()